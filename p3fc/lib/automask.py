@@ -0,0 +1,152 @@
+import numpy as np
+from scipy import ndimage as ndi
+from p3fc.lib.mask import rasterize_patch
+from p3fc.lib.projection import project_frames
+
+##############################################
+##         Automatic beamstop mask          ##
+##############################################
+# the beamstop shadow of a run is proposed as the base
+# patches of the mask viewer: a circle (the beamstop) and
+# a rectangle (its arm), in image coordinates (see mask.py)
+
+def subsample(frames, number=20):
+    '''
+     'number' frames, evenly spread over the run
+    '''
+    frames = list(frames)
+    if number is None or len(frames) <= number:
+        return frames
+    return [frames[idx] for idx in np.linspace(0, len(frames) - 1, number).round().astype(int)]
+
+def low_intensity_map(projection):
+    '''
+     robust background of a run (see projection.RunProjection):
+     the mean intensity without the brightest frame of each
+     pixel (spots, zingers), NaN for dead (negative) pixels
+    '''
+    if projection.number > 1:
+        data = (projection.sum - projection.max) / float(projection.number - 1)
+    else:
+        data = projection.sum.astype(float)
+    data[projection.max < 0] = np.nan
+    return data
+
+def _normalized_filter(data, valid, size):
+    # mean of the valid pixels in a size x size window
+    weight = ndi.uniform_filter(valid.astype(float), size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ndi.uniform_filter(np.where(valid, data, 0.0), size) / weight
+
+def shadow_map(data, level=0.3, center=None, smooth=5, fill=25, clean=3):
+    '''
+     the beamstop shadow of a low intensity map
+      - smoothed ('smooth' pixels), dead pixels are filled
+        from their surroundings ('fill' pixels)
+      - pixels below 'level' times the median are shadow
+      - cleaned: opened, closed ('clean' iterations),
+        grown by the smoothing and the holes filled
+      - returns the connected region at 'center' (x, y) or
+        the largest one as bool array, None if there is none
+    '''
+    valid = np.isfinite(data)
+    if not valid.any():
+        return None
+    threshold = level * np.median(data[valid])
+    filled = np.where(valid, _normalized_filter(data, valid, smooth), _normalized_filter(data, valid, fill))
+    with np.errstate(invalid='ignore'):
+        shadow = filled < threshold
+    shadow = ndi.binary_opening(shadow, iterations=clean)
+    # the arm leaves the image, closed as if it continued
+    shadow = ndi.binary_closing(np.pad(shadow, clean, mode='edge'), iterations=clean)[clean:-clean, clean:-clean]
+    # the smoothing shrinks the shadow, grown back
+    shadow = ndi.binary_dilation(shadow, iterations=smooth // 2)
+    shadow = ndi.binary_fill_holes(shadow)
+    labels, number = ndi.label(shadow)
+    if number == 0:
+        return None
+    label = 0
+    if center is not None:
+        col, row = int(np.floor(center[0])), int(np.floor(center[1]))
+        if 0 <= row < shadow.shape[0] and 0 <= col < shadow.shape[1]:
+            label = labels[row, col]
+    if label == 0:
+        label = np.argmax(np.bincount(labels.ravel())[1:]) + 1
+    return labels == label
+
+def fit_patches(shadow, margin=2.0, edge=10.0):
+    '''
+     fit the base patches of the mask viewer to a shadow
+      - circle: the largest circle inside the shadow
+      - rectangle: the largest part of the shadow outside
+        the circle (arm), along its principal axis and from
+        the circle center on, 'edge' pixels beyond the image
+        if it reaches the border, else placed outside
+      - both are grown by 'margin' pixels
+      - returns [rect, circ], (name, pos, size, angle, 0)
+    '''
+    rows, cols = shadow.shape
+    dist = ndi.distance_transform_edt(np.pad(shadow, 1))[1:-1, 1:-1]
+    row, col = np.unravel_index(np.argmax(dist), dist.shape)
+    center = np.array([col + 0.5, row + 0.5])
+    radius = float(dist[row, col]) + margin
+    circ = ('circ', (float(center[0] - radius), float(center[1] - radius)), (2.0 * radius, 2.0 * radius), 0.0, 0)
+
+    # the arm, without the circle
+    arm = shadow.copy()
+    rasterize_patch(arm, *circ[:4], False)
+    labels, number = ndi.label(arm)
+    rect = None
+    if number > 0:
+        sizes = np.bincount(labels.ravel())[1:]
+        label = np.argmax(sizes) + 1
+        if sizes[label - 1] >= radius**2:
+            y, x = np.nonzero(labels == label)
+            points = np.column_stack((x + 0.5, y + 0.5))
+            mean = points.mean(axis=0)
+            values, vectors = np.linalg.eigh(np.cov(points.T))
+            u = vectors[:, np.argmax(values)]
+            # rotated rectangle: local x along u, local y along v
+            v = np.array([-u[1], u[0]])
+            s = (points - mean) @ u
+            t = (points - mean) @ v
+            s_center = (center - mean) @ u
+            s0, s1 = min(s.min(), s_center) - 0.5 - margin, max(s.max(), s_center) + 0.5 + margin
+            t0, t1 = t.min() - 0.5 - margin, t.max() + 0.5 + margin
+            if x.min() == 0 or y.min() == 0 or x.max() == cols - 1 or y.max() == rows - 1:
+                # the far end reaches the border
+                if abs(s_center - s0) < abs(s_center - s1):
+                    s1 += edge
+                else:
+                    s0 -= edge
+            origin = mean + s0 * u + t0 * v
+            rect = ('rect', (float(origin[0]), float(origin[1])), (float(s1 - s0), float(t1 - t0)), float(np.rad2deg(np.arctan2(u[1], u[0]))), 0)
+    if rect is None:
+        # not needed, outside of the image
+        rect = ('rect', (-2.0 * edge - 20.0, -2.0 * edge - 20.0), (20.0, 20.0), 0.0, 0)
+    return [rect, circ]
+
+def propose_patches(frames, number=20, center=None, level=0.3, margin=2.0, flip=False, workers=None, progress=None, stop=None):
+    '''
+     propose the base patches of a run
+      - 'number' frames of the run are streamed (see
+        subsample and projection.project_frames)
+      - center: beam center (x, y), picks the shadow
+      - flip: the patches are drawn on the flipped image
+      - see shadow_map and fit_patches
+      - returns the patches, None if no shadow is found
+        or 'stop' is set
+    '''
+    projection = project_frames(subsample(frames, number), workers=workers, progress=progress, stop=stop)
+    if projection is None:
+        return None
+    data = low_intensity_map(projection)
+    if flip:
+        data = data[::-1]
+    shadow = shadow_map(data, level=level, center=center)
+    if shadow is None:
+        return None
+    return fit_patches(shadow, margin=margin)
+##############################################
+##       END Automatic beamstop mask        ##
+##############################################
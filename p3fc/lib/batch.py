@@ -0,0 +1,175 @@
+import os
+import time
+from p3fc.lib.formats import list_frames, detect_format
+from p3fc.lib.convert import get_conversion, convert_frames
+from p3fc.lib.manifest import Manifest, conversion_options
+
+##############################################
+##        Batch conversion of datasets      ##
+##############################################
+def find_datasets(paths, recursive=False):
+    '''
+     find the directories that contain frames
+      - paths: list of directories
+      - recursive: search the directory trees,
+        hidden directories are skipped
+      - returns a sorted list of absolute paths
+    '''
+    datasets = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if not recursive:
+            if os.path.isdir(path) and list_frames(path):
+                datasets.add(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            if list_frames(root):
+                datasets.add(root)
+    return sorted(datasets)
+
+def convert_batch_frame(fname, setups, write=None):
+    '''
+     convert a frame of a batch of datasets
+      - setups: {input directory: (conversion, args, kwargs)}
+      - write: passed on to the conversion (see pipeline_frames)
+      - frames of all datasets share one pool of workers
+    '''
+    conversion, args, kwargs = setups[os.path.dirname(fname)]
+    if write is not None:
+        kwargs = dict(kwargs, write=write)
+    return conversion(fname, *args, **kwargs)
+
+class ConversionJob(object):
+    '''
+     A dataset (directory) in the batch queue
+      - status: queued, running, done, up to date or failed
+      - converted/failed/total frames and the throughput
+    '''
+    def __init__(self, path_input, path_output):
+        self.path_input = os.path.abspath(path_input)
+        self.path_output = os.path.abspath(path_output)
+        self.name = os.path.basename(self.path_input)
+        self.site = ''
+        self.status = 'queued'
+        self.message = ''
+        self.frames = []
+        self.setup = None
+        self.manifest = None
+        self.options = None
+        self.total = 0
+        self.converted = 0
+        self.failed = 0
+        self.t_start = None
+        self.t_end = None
+
+    def prepare(self, overwrite=True, resume=False, verify=False, tth_corr=None, source_w=None):
+        '''
+         find the frames, check the format and set up the conversion
+          - resume: only frames that are not up to date (see manifest.py),
+            unrecorded existing outputs are kept unless 'overwrite'
+          - not overwrite: frames whose output exists are skipped
+          - returns True if there are frames to convert
+        '''
+        frames = list_frames(self.path_input)
+        if not frames:
+            self.status, self.message = 'failed', 'No suitable image files found'
+            return False
+        fmt = detect_format(frames[0])
+        if fmt is None:
+            self.status, self.message = 'failed', 'Unknown frame format: {}'.format(os.path.basename(frames[0]))
+            return False
+        self.site = fmt['site']
+        setup = get_conversion(fmt, frames[0], self.path_input, self.path_output,
+                               overwrite=overwrite, tth_corr=tth_corr, source_w=source_w)
+        if setup is None:
+            self.status, self.message = 'failed', 'Unknown facility!'
+            return False
+        self.setup = setup
+        os.makedirs(self.path_output, exist_ok=True)
+        self.manifest = Manifest(self.path_output)
+        self.options = conversion_options(*setup)
+        if resume:
+            frames = self.manifest.pending(frames, self.options, verify=verify, overwrite=overwrite)
+            setup[2]['overwrite'] = True
+        elif not overwrite:
+            frames = self.manifest.missing(frames)
+        self.frames = frames
+        self.total = len(frames)
+        if not frames:
+            self.status = 'up to date'
+            return False
+        return True
+
+    @property
+    def done(self):
+        return self.converted + self.failed
+
+    def throughput(self):
+        '''
+         converted frames per second
+        '''
+        if self.t_start is None:
+            return 0.0
+        elapsed = (self.t_end or time.time()) - self.t_start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        if self.status in ('running', 'done'):
+            return '{}: {} {} {}/{} frames, {} failed, {:.1f} frames/s'.format(self.name, self.site, self.status, self.done, self.total, self.failed, self.throughput())
+        return '{}: {} {} {}'.format(self.name, self.site, self.status, self.message).rstrip()
+
+def run_batch(jobs, workers=None, backend='pipeline', depth=None):
+    '''
+     convert the frames of all prepared jobs with one pool of workers
+      - the frames are fed job after job, a job is started
+        as soon as the workers are free, there is no barrier
+        between the jobs and small datasets never leave workers idle
+      - records the converted frames in the manifest of each job
+      - yields (job, fname, result) in order of completion
+    '''
+    jobs = [job for job in jobs if job.frames]
+    setups = {job.path_input:job.setup for job in jobs}
+    owner = {fname:job for job in jobs for fname in job.frames}
+
+    ########################
+    ##     run_batch      ##
+    ##     FUNCTIONS      ##
+    ########################
+    def feed():
+        # pipeline: a job starts when its first frame is taken
+        for job in jobs:
+            job.status = 'running'
+            job.t_start = time.time()
+            for fname in job.frames:
+                yield fname
+    ########################
+    ##     run_batch      ##
+    ##   FUNCTIONS END    ##
+    ########################
+
+    frames = feed()
+    if backend != 'pipeline':
+        # all frames are submitted at once
+        frames = list(frames)
+    try:
+        for fname, result in convert_frames(frames, convert_batch_frame, (setups,), {}, workers=workers, backend=backend, depth=depth):
+            job = owner[fname]
+            if result:
+                job.converted += 1
+                job.manifest.record(fname, job.options, result)
+                if job.manifest.changed >= 100:
+                    job.manifest.flush()
+            else:
+                job.failed += 1
+            if job.done == job.total:
+                job.status = 'done'
+                job.t_end = time.time()
+                job.manifest.save()
+            yield job, fname, result
+    finally:
+        for job in jobs:
+            job.manifest.save()
+##############################################
+##      END Batch conversion of datasets    ##
+##############################################
@@ -0,0 +1,213 @@
+import os
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from p3fc.lib.formats import FRAME_PATTERNS
+from p3fc.lib.decompress import compression_of, read_head
+from p3fc.lib.utility import get_run_info, parse_pilatus_header
+
+##############################################
+##               Frame catalog              ##
+##############################################
+# stored in the input directory, or in the user cache
+# directory if the input directory is not writable
+CATALOG_NAME = '.p3fc_catalog.sqlite'
+CATALOG_VERSION = 1
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS frames (name TEXT PRIMARY KEY,
+                                   size INTEGER,
+                                   mtime INTEGER,
+                                   stem TEXT,
+                                   run INTEGER,
+                                   frame INTEGER,
+                                   omega REAL,
+                                   chi REAL,
+                                   phi REAL,
+                                   kappa REAL,
+                                   tth REAL,
+                                   increment REAL,
+                                   exposure REAL,
+                                   flux REAL);
+CREATE INDEX IF NOT EXISTS frames_run ON frames (stem, run, frame);
+'''
+
+# header values: (column, PILATUS header keys, the first one found is used)
+_HEADER_COLUMNS = (('omega', ('Omega',)),
+                   ('chi', ('Chi',)),
+                   ('phi', ('Phi',)),
+                   ('kappa', ('Kappa',)),
+                   ('tth', ('Detector_2theta',)),
+                   ('increment', ('Phi_increment', 'Omega_increment', 'Chi_increment')),
+                   ('exposure', ('Exposure_time',)),
+                   ('flux', ('Flux',)))
+
+def user_cache_dir(*subdirs):
+    '''
+     ~/.cache/p3fc/subdirs, created if needed
+    '''
+    cache = os.path.join(os.path.expanduser('~'), '.cache', 'p3fc', *subdirs)
+    os.makedirs(cache, exist_ok=True)
+    return cache
+
+def catalog_path(path):
+    '''
+     path of the catalog of directory 'path'
+      - the catalog is a sidecar file of the directory,
+        ~/.cache/p3fc is used for read-only directories
+    '''
+    path = os.path.abspath(path)
+    if os.access(path, os.W_OK):
+        return os.path.join(path, CATALOG_NAME)
+    return os.path.join(user_cache_dir(), '{}.sqlite'.format(hashlib.sha1(path.encode()).hexdigest()))
+
+def frame_name_info(name):
+    '''
+     stem, run and frame number from a frame name
+      - (None, None, None) if the name does not follow
+        any_name_run_frame or the SPring-8 convention
+    '''
+    if compression_of(name) is not None:
+        name = os.path.splitext(name)[0]
+    try:
+        stem, run, frame, _ = get_run_info(os.path.splitext(name)[0])
+        return stem, run, frame
+    except (ValueError, IndexError):
+        return None, None, None
+
+def scan_frame(fname):
+    '''
+     header-only scan of a frame
+      - only the first 4096 bytes are read (decompressed)
+      - returns the _HEADER_COLUMNS values, None if missing
+    '''
+    values = []
+    try:
+        header = parse_pilatus_header(read_head(fname))
+    except (OSError, EOFError):
+        return [None] * len(_HEADER_COLUMNS)
+    for column, keys in _HEADER_COLUMNS:
+        value = None
+        for key in keys:
+            if key in header and isinstance(header[key], float):
+                value = header[key]
+                # first non-zero increment: the scan axis
+                if column != 'increment' or value != 0.0:
+                    break
+        values.append(value)
+    return values
+
+class FrameCatalog(object):
+    '''
+     Indexed catalog (SQLite) of the frames of a directory
+      - stem, run and frame number of every frame and its
+        key header values (angles, increment, exposure, flux)
+      - update() lists the directory once and scans only new
+        or changed frames (size, mtime), concurrently
+      - runs, gaps and the number of frames per run are queries
+      - use as context manager or call close()
+    '''
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.db = sqlite3.connect(catalog_path(self.path))
+        self.db.executescript(_SCHEMA)
+        version = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or int(version[0]) != CATALOG_VERSION:
+            with self.db:
+                self.db.execute('DELETE FROM frames')
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(CATALOG_VERSION),))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def update(self, patterns=FRAME_PATTERNS, workers=None):
+        '''
+         bring the catalog up to date with the directory
+          - new and changed frames are scanned (see scan_frame)
+            by a pool of threads, removed frames are deleted
+          - returns the number of scanned frames
+        '''
+        import fnmatch
+        with os.scandir(self.path) as entries:
+            listed = {}
+            for entry in entries:
+                if entry.is_file() and any(fnmatch.fnmatch(entry.name, p) for p in patterns):
+                    stat = entry.stat()
+                    listed[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        known = {name:(size, mtime) for name, size, mtime in self.db.execute('SELECT name, size, mtime FROM frames')}
+        todo = [name for name, key in listed.items() if known.get(name) != key]
+        gone = [(name,) for name in known if name not in listed]
+        if workers is None:
+            workers = min(32, 4 * (os.cpu_count() or 1))
+        rows = []
+        if todo:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for name, values in zip(todo, pool.map(scan_frame, [os.path.join(self.path, name) for name in todo])):
+                    rows.append((name, *listed[name], *frame_name_info(name), *values))
+        with self.db:
+            self.db.executemany('DELETE FROM frames WHERE name = ?', gone)
+            self.db.executemany('INSERT OR REPLACE INTO frames VALUES ({})'.format(', '.join(['?'] * 14)), rows)
+        return len(todo)
+
+    def frames(self, stem=None, run=None):
+        '''
+         sorted list of the frame paths (of a run)
+        '''
+        if run is None:
+            query = self.db.execute('SELECT name FROM frames ORDER BY name')
+        else:
+            query = self.db.execute('SELECT name FROM frames WHERE stem = ? AND run = ? ORDER BY frame', (stem, run))
+        return [os.path.join(self.path, name) for name, in query]
+
+    def runs(self):
+        '''
+         list of the runs: (stem, run, first frame path, first frame number,
+                            last frame number, number of frames)
+          - the first frame is the first one present, runs with
+            a missing first frame are found as well
+        '''
+        query = self.db.execute('''SELECT f.stem, f.run, MIN(f.name), r.first, r.last, r.number FROM frames f
+                                   JOIN (SELECT stem, run, MIN(frame) AS first, MAX(frame) AS last, COUNT(*) AS number
+                                         FROM frames WHERE run IS NOT NULL GROUP BY stem, run) r
+                                   ON f.stem = r.stem AND f.run = r.run AND f.frame = r.first
+                                   GROUP BY f.stem, f.run ORDER BY f.stem, f.run''')
+        return [(stem, run, os.path.join(self.path, name), first, last, number) for stem, run, name, first, last, number in query]
+
+    def gaps(self, stem, run):
+        '''
+         missing frame numbers of a run (starting at 1)
+        '''
+        numbers = [frame for frame, in self.db.execute('SELECT frame FROM frames WHERE stem = ? AND run = ? ORDER BY frame', (stem, run))]
+        if not numbers:
+            return []
+        return sorted(set(range(1, numbers[-1] + 1)).difference(numbers))
+
+    def nframes(self):
+        '''
+         number of frames per run: {stem: {run: highest frame number}}
+          - the highest number counts missing frames as well
+        '''
+        nframes = {}
+        for stem, run, last in self.db.execute('SELECT stem, run, MAX(frame) FROM frames WHERE run IS NOT NULL GROUP BY stem, run'):
+            nframes.setdefault(stem, {})[run] = last
+        return nframes
+
+    def header(self, fname):
+        '''
+         catalogued header values of a frame: {column: value}
+        '''
+        columns = [column for column, _ in _HEADER_COLUMNS]
+        row = self.db.execute('SELECT {} FROM frames WHERE name = ?'.format(', '.join(columns)), (os.path.basename(fname),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(columns, row))
+##############################################
+##             END Frame catalog            ##
+##############################################
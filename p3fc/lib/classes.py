@@ -1,19 +1,27 @@
 import os
 import sys
+import itertools
+import threading
 import logging
-import re
-import glob
-import gzip
 import pickle
+import sqlite3
 import numpy as np
 import pyqtgraph as pg
-from scipy import ndimage as ndi
 from collections import defaultdict
 from PyQt6 import QtCore, QtWidgets, QtGui
 from p3fc.lib.gui import Ui_MainWindow
-from p3fc.lib.utility import read_pilatus_cbf, read_pilatus_tif, read_pilatus_tif_gz, get_run_info, pilatus_pad,\
-                             convert_frame_APS_Bruker, convert_frame_SP8_Bruker, convert_frame_SP8_Bruker_gz,\
-                             convert_frame_DLS_Bruker, write_bruker_frame, bruker_header
+from p3fc.lib.utility import read_sp8_inf
+from p3fc.lib.formats import FRAME_PATTERNS, scan_frames, detect_format
+from p3fc.lib.convert import get_conversion, convert_frames
+from p3fc.lib.manifest import Manifest, conversion_options
+from p3fc.lib.watch import FrameWatcher
+from p3fc.lib.batch import find_datasets, ConversionJob, run_batch
+from p3fc.lib.catalog import FrameCatalog
+from p3fc.lib.framecache import FrameCache, display_lut, display_buffer
+from p3fc.lib.projection import PROJECTIONS, run_projection, projection_image
+from p3fc.lib.automask import propose_patches
+from p3fc.lib.mask import MaskRaster, mask_frame, write_mask, overlay_buffer, update_overlay, mask_paths
+from p3fc.lib.diskcache import enable_disk_cache, disable_disk_cache, disk_cache_path
 # todo
 # use tth to calculate beamcenter offset on rotation
 # clear patches when loading new folder -> or setup a dict structure to keep them in order!
@@ -86,6 +94,171 @@ class FillCircleROI(pg.CircleROI):
         r = QtCore.QRectF(r.x()/r.width(), r.y()/r.height(), 1,1)
         p.drawEllipse(r)
 
+class FrameCountModel(QtGui.QFileSystemModel):
+    '''
+     QFileSystemModel that shows the number of frames
+     next to the scanned directories
+    '''
+    def __init__(self, *args, **kwargs):
+        super(FrameCountModel, self).__init__(*args, **kwargs)
+        self.counts = {}
+    
+    def set_count(self, path, number):
+        self.counts[path] = number
+        index = self.index(path)
+        if index.isValid():
+            self.dataChanged.emit(index, index, [QtCore.Qt.ItemDataRole.DisplayRole])
+    
+    def data(self, index, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        value = super(FrameCountModel, self).data(index, role)
+        if role == QtCore.Qt.ItemDataRole.DisplayRole and index.column() == 0:
+            number = self.counts.get(os.path.abspath(self.filePath(index)))
+            if number:
+                return '{}  ({} frames)'.format(value, number)
+        return value
+
+class BatchDialog(QtWidgets.QDialog):
+    '''
+     Batch conversion of several datasets
+      - add directories (and their subdirectories) to the queue
+      - the frames of all datasets share one pool of workers (see batch.py)
+      - status and throughput per dataset
+    '''
+    columns = ('Dataset', 'Format', 'Frames', 'Converted', 'Failed', 'Status', 'Frames/s')
+
+    class Signals(QtCore.QObject):
+        changed = QtCore.pyqtSignal(int)
+        done = QtCore.pyqtSignal()
+
+    class Processing(QtCore.QRunnable):
+        def __init__(self, jobs, prepare, backend):
+            '''
+             jobs:    ConversionJobs to run
+             prepare: Keywords to pass to ConversionJob.prepare
+             backend: 'process' or 'pipeline' (see convert.convert_frames)
+            '''
+            super(self.__class__, self).__init__()
+            self.jobs = jobs
+            self.prepare = prepare
+            self.backend = backend
+            self.signals = BatchDialog.Signals()
+
+        def run(self):
+            # check the formats, then convert all frames
+            # signal the job index if a job changed
+            try:
+                for idx, job in enumerate(self.jobs):
+                    job.prepare(**self.prepare)
+                    self.signals.changed.emit(idx)
+                index = {job:idx for idx, job in enumerate(self.jobs)}
+                for job, _, _ in run_batch(self.jobs, backend=self.backend):
+                    self.signals.changed.emit(index[job])
+            finally:
+                self.signals.done.emit()
+
+    def __init__(self, parent, suffix, prepare, backend):
+        '''
+         suffix:  added to the input directory to name the output directory
+         prepare: Keywords to pass to ConversionJob.prepare
+         backend: 'process' or 'pipeline' (see convert.convert_frames)
+        '''
+        super(BatchDialog, self).__init__(parent)
+        self.setWindowTitle('Batch Conversion')
+        self.resize(900, 400)
+        self.suffix = suffix
+        self.prepare = prepare
+        self.backend = backend
+        self.jobs = []
+        self.pool = QtCore.QThreadPool()
+        
+        self.table = QtWidgets.QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeMode.Stretch)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.cb_recursive = QtWidgets.QCheckBox('Include Subdirectories')
+        self.cb_recursive.setChecked(True)
+        self.tb_add = QtWidgets.QPushButton('Add Directory')
+        self.tb_clear = QtWidgets.QPushButton('Clear')
+        self.tb_start = QtWidgets.QPushButton('Convert')
+        self.status = QtWidgets.QLabel()
+        
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(self.tb_add)
+        buttons.addWidget(self.cb_recursive)
+        buttons.addStretch()
+        buttons.addWidget(self.tb_clear)
+        buttons.addWidget(self.tb_start)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addWidget(self.status)
+        layout.addLayout(buttons)
+        
+        self.tb_add.clicked.connect(self.add_directory)
+        self.tb_clear.clicked.connect(self.clear)
+        self.tb_start.clicked.connect(self.start)
+        self.tb_add.setToolTip('Add a directory, all directories containing frames are added.')
+        self.tb_start.setToolTip('Convert all datasets, the output directories are named input directory + {}.'.format(suffix))
+
+    def add_directory(self):
+        path = QtWidgets.QFileDialog.getExistingDirectory(self, 'Add Directory')
+        if path:
+            self.add_datasets([path])
+
+    def add_datasets(self, paths):
+        # every dataset is added once
+        known = set(job.path_input for job in self.jobs)
+        for path in find_datasets(paths, recursive=self.cb_recursive.isChecked()):
+            if path in known:
+                continue
+            self.jobs.append(ConversionJob(path, path + self.suffix))
+            self.table.insertRow(len(self.jobs) - 1)
+            self.update_row(len(self.jobs) - 1)
+        self.status.setText('{} datasets'.format(len(self.jobs)))
+
+    def clear(self):
+        self.jobs = []
+        self.table.setRowCount(0)
+        self.status.setText('')
+
+    def update_row(self, idx):
+        job = self.jobs[idx]
+        values = (job.path_input, job.site, job.total, job.converted, job.failed,
+                  job.message or job.status, '{:.1f}'.format(job.throughput()))
+        for col, value in enumerate(values):
+            item = self.table.item(idx, col)
+            if item is None:
+                item = QtWidgets.QTableWidgetItem()
+                self.table.setItem(idx, col, item)
+            item.setText(str(value))
+
+    def start(self):
+        if not self.jobs:
+            return
+        # fresh jobs, a batch can be run again
+        self.jobs = [ConversionJob(job.path_input, job.path_output) for job in self.jobs]
+        for idx in range(len(self.jobs)):
+            self.update_row(idx)
+        for widget in (self.tb_add, self.tb_clear, self.tb_start, self.cb_recursive):
+            widget.setEnabled(False)
+        self.status.setText('Converting {} datasets'.format(len(self.jobs)))
+        self.parent().set_disk_cache(os.path.commonpath([job.path_output for job in self.jobs]))
+        worker = self.Processing(self.jobs, self.prepare, self.backend)
+        worker.signals.changed.connect(self.update_row)
+        worker.signals.done.connect(self.batch_finished)
+        self.pool.start(worker)
+
+    def batch_finished(self):
+        for idx in range(len(self.jobs)):
+            self.update_row(idx)
+        for widget in (self.tb_add, self.tb_clear, self.tb_start, self.cb_recursive):
+            widget.setEnabled(True)
+        self.status.setText('Successfully converted {} images of {} datasets!'.format(sum(job.converted for job in self.jobs), len(self.jobs)))
+
+    def reject(self):
+        # don't close while converting
+        if self.pool.activeThreadCount() == 0:
+            super(BatchDialog, self).reject()
+
 class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
     def __init__(self):
         logging.debug(self.__class__.__name__)
@@ -139,12 +312,40 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         self.colormaps = sorted(pg.colormap.listMaps())
         
         self.cmap = pg.colormap.get(self.colormap, skipCache=True)
-        self.img.setLookupTable( self.cmap.getLookupTable(nPts=256) )
+        self.update_lookup_table()
         #self.img.setColorMap(self.colormap)
         self.img.setZValue(-2)
+        # the masked pixels, shown through a lookup table
+        # - 0: transparent, 1: masked, see mask.overlay_buffer
+        self.img_mask = pg.ImageItem()
+        overlay_lut = np.zeros((256, 4), dtype=np.uint8)
+        overlay_lut[1:] = (255, 0, 0, 110)
+        self.img_mask.setLookupTable(overlay_lut)
+        self.img_mask.setZValue(-1)
+        self.plt.addItem(self.img_mask)
+        self.mask_overlay = None
+        self.mask_overlay_offset = (0, 0)
+        self.mask_dead = None
+        # frames are prepared for display by a worker
+        # - the image shows a uint8 display buffer, see framecache.py
+        self.image_pool = QtCore.QThreadPool()
+        self.image_pool.setMaxThreadCount(1)
+        self.image_request = 0
+        self.frame_data = None
+        # stops the running projection
+        self.projection_stop = None
         self.img.hoverEvent = self.imageHoverEvent
         self.patches = defaultdict(list)
         self.patches_reset_size()
+        # the mask of the patches, redrawn where they change
+        # masks are written by a worker, in order
+        # - patches being written: {path: patches}
+        self.mask_raster = None
+        self.mask_pool = QtCore.QThreadPool()
+        self.mask_pool.setMaxThreadCount(1)
+        self.patches_pending = {}
+        # stops the running mask proposal
+        self.proposal_stop = None
         
         # link GUI to functions
         self.tb_convert.clicked.connect(self.start_conversion)
@@ -154,14 +355,21 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         self.tb_mask_next_img.clicked.connect(lambda: self.mask_change_image_rel(inc =  1))
         self.tb_mask_prev_img.clicked.connect(lambda: self.mask_change_image_rel(inc = -1))
         self.cb_mask_fname.currentIndexChanged.connect(self.mask_change_image_abs)
+        self.cb_mask_image.currentIndexChanged.connect(self.mask_change_image_mode)
         #self.tb_mask_reset.clicked.connect(self.FVObj.reset_patches)
         self.tabWidget.currentChanged.connect(self.on_tab_change)
         
         self.action_add_circle.triggered.connect(self.patches_circs_add)
         self.action_rem_circle.triggered.connect(self.patches_circs_rem)
+        self.action_propose_mask.triggered.connect(self.mask_propose)
         self.action_flip_image.triggered.connect(self.change_image)
+        self.action_show_overlay.toggled.connect(self.mask_overlay_reset)
+        self.action_use_padding.toggled.connect(self.mask_overlay_reset)
         self.action_set_wavelength.triggered.connect(self.set_wavelength)
         self.action_set_twotheta.triggered.connect(self.set_twotheta)
+        self.action_watch_input.triggered.connect(self.watch_input)
+        self.action_batch_convert.triggered.connect(self.batch_conversion)
+        self.action_disk_cache.triggered.connect(lambda: self.set_disk_cache(self.le_output.text()))
         
         # disable the draw-mask tabWidget
         # enable if valid images are loaded
@@ -183,6 +391,7 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         val, ok = QtWidgets.QInputDialog.getDouble(self, 'Set Experimental Parameter', '2-Theta offset [%]', value=self.SP8_tth_corr*100, min=-10.0, max=10.0, decimals=1, step=0.1)
         if ok:
             self.SP8_tth_corr = round(val / 100, 3)
+            self.SP8_tth_user = self.SP8_tth_corr
             self.change_image()
 
     def set_tooltips(self):
@@ -192,22 +401,30 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         self.le_output.setToolTip('Current output directory.\nIf unlinked: Select to specify the target output directory using the file-browser.\nManual editing is allowed, non-existing paths will be created recursively.')
         self.le_input.setToolTip('Current input directory.\nIf unlinked: Select to specify the target input directory using the file-browser.')
         self.cb_link.setToolTip('Link/Unlink output directory and input directory.\nIf linked: the output directory follows the input directory (plus added suffix).\nIf unlinked: Select either to specify the target directory using the filebrowser.')
-        self.cb_overwrite.setToolTip('Overwrite existing files in the output directory?')
+        self.cb_overwrite.setToolTip('Overwrite existing files in the output directory?\nIf unchecked: existing files are kept, only new or changed frames and frames converted with different settings are converted.')
         
         self.action_set_wavelength.setToolTip('Check and manually set the wavelength, uncheck to use the .inf information.')
         self.action_set_twotheta.setToolTip('Check and manually set an 2-Theta offset, uncheck to use the .inf information.')
+        self.action_use_processes.setToolTip('Check to convert using a pool of processes (scales with the number of cores).')
+        self.action_watch_input.setToolTip('Check to keep converting new frames while they are collected, uncheck to stop watching.')
+        self.action_disk_cache.setToolTip('Check to keep the decoded frames (.cbf, compressed .tif) in a cache in the output directory,\nviewing and converting the frames again reads them from the cache.')
+        self.action_batch_convert.setToolTip('Convert several datasets using the current settings.')
 
+        self.cb_mask_image.setToolTip('Draw the mask on the first frame of the run or on a projection of all its frames.\nProjections are made in the background once per run and kept in the user cache (~/.cache/p3fc).')
         self.action_add_circle.setToolTip('Add a pair of circles. Use the green circle to unmask regions.')
         self.action_rem_circle.setToolTip('Remove the last Circle pair.')
+        self.action_propose_mask.setToolTip('Place the rectangle and the circle on the beamstop shadow found in the frames of the run.\nThe proposal is a starting point, check and adjust it before saving.')
         self.action_write_bruker_sfrm.setToolTip('Write a bruker .sfrm file?')
         self.action_write_numpy_npy.setToolTip('Write numpy .npy file?')
         self.action_show_matplotlib.setToolTip('Check to plot and show the final mask using matplotlib.')
         self.action_use_padding.setToolTip('Check to pad the mask to a multiple of 8 (SAINT).')
+        self.action_show_overlay.setToolTip('Check to show the pixels the mask will mask (red), updated while the patches are dragged.')
     
     def init_file_browser(self):
         logging.debug(self.__class__.__name__)
         # use the QFileSystemModel
-        self.model = QtGui.QFileSystemModel()
+        # - shows the number of frames of scanned directories
+        self.model = FrameCountModel()
         self.model.setReadOnly(True)
         self.model.setRootPath('')
         # currently only shows directories
@@ -215,6 +432,10 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         # to show files
         self.model.setFilter(QtCore.QDir.Filter.AllDirs | QtCore.QDir.Filter.NoDotAndDotDot)# | QtCore.QDir.Filter.AllEntries)
         
+        # directories are scanned in the background, one at a time
+        self.scan_pool = QtCore.QThreadPool()
+        self.scan_pool.setMaxThreadCount(1)
+        
         # set treeView to use the QFileSystemModel
         self.treeView.setAnimated(False)
         self.treeView.setUniformRowHeights(True)
@@ -294,14 +515,17 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         self.exp_distance = None     # m SCAN_DET_RELZERO=2.000 0.000   130.00;
         self.exp_wavelength = None   # Ang SCAN_WAVELENGTH=0.2482;
         self.SP8_tth_corr = 0.0      # Correction factor for 2-theta offset [%]
+        self.SP8_tth_user = None     # 2-theta offset set by the user, else per dataset
         self.current_tth = 0.0       # Indicator to change the patches to new positions
         self.reset_patches = True
         self.mask_negative = True
         self.flag_reset_view = False
         self.fRnum = None
         self.fStem = None
+        self.fFormat = None
         self.runList = []
         self.framesList = []
+        self.watcher = None
         self.patches_base = []
         self.patches_circs = []
         self.currentIndex = 0
@@ -315,6 +539,10 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         self.patch_size_increment = 50
         self.handle_size = 12
         self.handle_width = 5
+        # decoded frames of the mask viewer, the neighbouring
+        # runs (+-prefetch_range) are decoded in the background
+        self.frame_cache = FrameCache()
+        self.prefetch_range = 2
 
         _cmap = pg.colormap.get(self.colormap)
         _color_05 = _cmap.map(0.5, mode='qcolor')
@@ -339,182 +567,53 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         self.hs_mask_int.setMinimum(1)
         self.hs_mask_int.setMaximum(100)
         
-        #########################################
-        ##  Add new format identifiers here!   ##
-        #########################################
-        self.exts = ('*_*.tif', '*_*.cbf', '*_*.tif.gz')
-        self.availableFormats = [self.format_SP8,
-                                 self.format_SP8_gz,
-                                 self.format_APS,
-                                 self.format_DLS]
+        # new formats are added in formats.py
+        self.exts = FRAME_PATTERNS
     
-    ##############################################
-    ##         Frame Format definitions         ##
-    ##############################################
     def check_format(self):
-        logging.debug(self.__class__.__name__)
-        for aCheckFunc in self.availableFormats:
-            if aCheckFunc():
-                return True
-            else:
-                continue
-        return False
-    
-    def format_DLS(self):
-        logging.debug(self.__class__.__name__)
-        '''
-        Check the first file if reformatting to Bruker name format is possible
-        any_name_#run_#frame.tif -> any_name_rr_ffff.sfrm
-        '''
-        try:
-            fhead, fname = os.path.split(self.currentFrame)
-            bname, ext = os.path.splitext(fname)
-            if not ext == '.cbf':
-                return False
-            # open file and check: _diffrn.id DLS_I19-1
-            with open(self.currentFrame, 'rb') as oFrame:
-                try:
-                    id = re.search(rb'_diffrn.id\s+(?P<id>.+)', oFrame.read(2048)).group('id').decode().strip()
-                except AttributeError:
-                    return False
-            if not id == 'DLS_I19-1':
-                return False
-            fstm, rnum, fnum, flen = get_run_info(bname)
-            self.fRnum = rnum                         # Run number
-            self.fStem = fstm                         # Frame name up to the run number
-            self.fStar = '{:>0{w}}.'.format(1, w=flen)# Number indicating start of a run
-            self.fInfo = (1679, 1475, 0, np.int32)    # Frame info (rows, cols, offset)
-            self.fSite = 'DLS'                        # Facility identifier
-            self.fFunc = read_pilatus_cbf             # Frame read function (from _Utility)
-            self.fRota = False                        # rotate the frame upon conversion?
-            self.detector_type = 'PILATUS'            # detector type for SAINT
-            return True
-        except (ValueError, IndexError):
-            return False
-    
-    def format_APS(self):
-        logging.debug(self.__class__.__name__)
-        '''
-        Check the first file if reformatting to Bruker name format is possible
-        any_name_#run_#frame.tif -> any_name_rr_ffff.sfrm
-        '''
-        try:
-            fhead, fname = os.path.split(self.currentFrame)
-            bname, ext = os.path.splitext(fname)
-            if not ext == '.tif':
-                return False
-            # open file and check S/N: 10-0147
-            with open(self.currentFrame, 'rb') as oFrame:
-                SN = re.search(rb'S/N\s+(?P<SN>\d+\-\d+)', oFrame.read(128)).group('SN').decode()
-            if not SN == '10-0147':
-                return False
-            fstm, rnum, fnum, flen = get_run_info(bname)
-            self.fRnum = rnum                         # Run number
-            self.fStem = fstm                         # Frame name up to the run number
-            self.fStar = '{:>0{w}}.'.format(1, w=flen)# Number indicating start of a run
-            self.fInfo = (1043, 981, 4096, np.int32)  # Frame info (rows, cols, offset)
-            self.fSite = 'APS'                        # Facility identifier
-            self.fFunc = read_pilatus_tif             # Frame read function (from _Utility)
-            self.fRota = True                         # rotate the frame upon conversion?
-            self.detector_type = 'PILATUS'            # detector type for SAINT
-            return True
-        except (ValueError, IndexError):
-            return False
-    
-    def format_SP8(self):
         logging.debug(self.__class__.__name__)
         '''
-        Check the first file if name is compatible with SPring-8 convention
-        e.g. any_name_rrfff.tif, where rr is the 2 digit run numer: 00 - 99
-        fff is the 3 digit frame number: 001 - 999
+         check the current frame against all known formats
+         and set the frame format info
         '''
-        try:
-            fhead, fname = os.path.split(self.currentFrame)
-            bname, ext = os.path.splitext(fname)
-            if not ext == '.tif':
-                return False
-            # open file and check S/N: 10-0163
-            with open(self.currentFrame, 'rb') as oFrame:
-                SN = re.search(rb'S/N\s+(?P<SN>\d+\-\d+)', oFrame.read(128)).group('SN').decode()
-            if not SN == '10-0163':
-                return False
-            fstm, rnum, fnum, flen = get_run_info(bname)
-            ########################################
-            ## USE FNUM TO DEFINE START OF RUN!!! ##
-            ########################################
-            self.fRnum = rnum                         # Run number
-            self.fStem = fstm                         # Frame name up to the run number
-            self.fStar = '{:>0{w}}.'.format(1, w=flen)# Number indicating start of a run
-            self.fInfo = (1043, 981, 4096, np.int32)  # Frame info (rows, cols, offset)
-            self.fSite = 'SP8'                        # Facility identifier
-            self.fFunc = read_pilatus_tif             # Frame read function (from _Utility)
-            self.fRota = True                         # rotate the frame upon conversion?
-            self.detector_type = 'PILATUS'            # detector type for SAINT
-            return True
-        except ValueError:
+        fmt = detect_format(self.currentFrame)
+        if fmt is None:
             return False
-    
-    def format_SP8_gz(self):
-        logging.info(self.__class__.__name__)
-        '''
-        Check the first file if name is compatible with SPring-8 convention
-        e.g. any_name_rrfff.tif, where rr is the 2 digit run numer: 00 - 99
-        fff is the 3 digit frame number: 001 - 999
-        '''
-        try:
-            fhead, fname = os.path.split(self.currentFrame)
-            zname, ext = os.path.splitext(fname)
-            if not ext == '.gz':
-                return False
-            # open file and check S/N: 10-0163
-            with gzip.open(self.currentFrame, 'rb') as oFrame:
-                SN = re.search(rb'S/N\s+(?P<SN>\d+\-\d+)', oFrame.read(128)).group('SN').decode()
-            if not SN == '10-0163':
-                return False
-            bname, ext = os.path.splitext(zname)
-            fstm, rnum, fnum, flen = get_run_info(bname)
-            ########################################
-            ## USE FNUM TO DEFINE START OF RUN!!! ##
-            ########################################
-            self.fRnum = rnum                         # Run number
-            self.fStem = fstm                         # Frame name up to the run number
-            self.fStar = '{:>0{w}}.'.format(1, w=flen)# Number indicating start of a run
-            self.fInfo = (1043, 981, 4096, np.int32)  # Frame info (rows, cols, offset)
-            self.fSite = 'SP8_gz'                     # Facility identifier
-            self.fFunc = read_pilatus_tif_gz          # Frame read function (from _Utility)
-            self.fRota = True                         # rotate the frame upon conversion?
-            self.detector_type = 'PILATUS'            # detector type for SAINT
-            return True
-        except ValueError:
-            return False
-    ##############################################
-    ##       END Frame Format definitions       ##
-    ##############################################
+        self.fRnum = fmt['run']                   # Run number
+        self.fStem = fmt['stem']                  # Frame name up to the run number
+        self.fStar = fmt['start']                 # Number indicating start of a run
+        self.fInfo = fmt['info']                  # Frame info (rows, cols, offset, dtype)
+        self.fSite = fmt['site']                  # Facility identifier
+        self.fFunc = fmt['read']                  # Frame read function (from utility)
+        self.fRota = fmt['rotate']                # rotate the frame upon conversion?
+        self.detector_type = fmt['detector']      # detector type for SAINT
+        self.fFormat = fmt
+        return True
     
     def read_inf(self):
-        # check if info file exists
-        if os.path.isfile(self.path_inf):
-            # extract header information
-            with open(self.path_inf) as rFile:
-                infoFile = rFile.read()
-                self.exp_beamcenter_y, self.exp_beamcenter_x = [float(i) for i in re.search(r'CCD_SPATIAL_BEAM_POSITION\s*=\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*;', infoFile).groups()]
-                self.exp_wavelength = float(re.search(r'SCAN_WAVELENGTH\s*=\s*(\d+\.\d+)\s*;', infoFile).groups()[0])
-                self.exp_tth, inf_distance = [float(i) for i in re.search(r'SCAN_DET_RELZERO\s*=\s*-*\d+\.\d+\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*;', infoFile).groups()]
-                self.exp_distance = inf_distance * 1e-3
-                # apply SP8 2-theta correction factor
-                self.exp_tth += self.exp_tth * self.SP8_tth_corr
-                if self.exp_tth == self.current_tth:
-                    self.reset_patches = False
-                else:
-                    self.current_tth = self.exp_tth
-                    self.reset_patches = True
-                # Add POBI 2-theta offset
-                offset_tth = np.tan(np.deg2rad(self.exp_tth)) * self.exp_distance / self.exp_pixelsize
-                self.exp_beamcenter_x += offset_tth
-        else:
+        # extract header information
+        # - the .inf files are parsed once and cached
+        try:
+            inf = read_sp8_inf(self.path_inf)
+        except FileNotFoundError:
             logging.warning(f'WARNING: Info file {os.path.basename(self.path_inf)} is missing')
             self.exp_beamcenter_x = self.img_dim_x/2
             self.exp_beamcenter_y = self.img_dim_y/2
+            return
+        self.exp_beamcenter_y, self.exp_beamcenter_x = inf.beam_x, inf.beam_y
+        self.exp_wavelength = inf.wavelength
+        self.exp_tth = inf.tth
+        self.exp_distance = inf.distance * 1e-3
+        # apply SP8 2-theta correction factor
+        self.exp_tth += self.exp_tth * self.SP8_tth_corr
+        if self.exp_tth == self.current_tth:
+            self.reset_patches = False
+        else:
+            self.current_tth = self.exp_tth
+            self.reset_patches = True
+        # Add POBI 2-theta offset
+        offset_tth = np.tan(np.deg2rad(self.exp_tth)) * self.exp_distance / self.exp_pixelsize
+        self.exp_beamcenter_x += offset_tth
 
     def mask_prepare_writing(self):
         logging.debug(self.__class__.__name__)
@@ -524,6 +623,7 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
     
     def mask_change_image_abs(self, idx):
         logging.debug(self.__class__.__name__)
+        self.currentIndex = idx
         self.currentFrame = os.path.abspath(self.runList[idx])
         self.check_format()
         self.change_image()
@@ -537,9 +637,19 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         # setCurrentIndex calls self.mask_change_image_abs
         self.cb_mask_fname.setCurrentIndex(self.currentIndex)
     
+    def mask_change_image_mode(self, idx):
+        logging.debug(self.__class__.__name__)
+        # frame or run projection, only if the viewer is open
+        if self.tabWidget.currentIndex() == 1:
+            self.change_image()
+    
     def mask_change_frame_max_int(self):
         #logging.debug(self.__class__.__name__)
-        self.img.setLevels(levels=[-2, self.hs_mask_int.value()])
+        # the levels are part of the lookup table
+        self.update_lookup_table()
+    
+    def update_lookup_table(self):
+        self.img.setLookupTable(display_lut(self.cmap, self.hs_mask_int.value()))
         
     def eventFilter(self, obj, event):
         #logging.debug(self.__class__.__name__)
@@ -625,31 +735,159 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         self.plt.setYRange(0, self.img_dim_y, padding=0)
 
     def change_image(self):
-        _, data = self.fFunc(self.currentFrame, *self.fInfo)
-        if self.fRota:
-            data = np.rot90(data, k=1, axes=(1, 0))
-        if self.action_flip_image.isChecked():
-            data = np.flipud(data)
-        self.img.setImage(data, rotate=self.fRota)
+        # decoded, rotated and flipped by a worker
+        # -> on_image_prepared
+        self.image_request += 1
+        if self.projection_stop is not None:
+            self.projection_stop.set()
+            self.projection_stop = None
+        if self.proposal_stop is not None:
+            self.proposal_stop.set()
+            self.proposal_stop = None
+        # 0: the first frame of the run, else a projection of the run
+        mode = self.cb_mask_image.currentIndex()
+        if mode > 0:
+            self.projection_stop = threading.Event()
+            worker = self.Projecting(self.currentFrame, self.fStem, self.fRnum, PROJECTIONS[mode - 1], self.action_flip_image.isChecked(), self.image_request, self.projection_stop)
+            worker.signals.progress.connect(self.on_projection_progress)
+        else:
+            worker = self.Preparing(self.frame_cache, self.currentFrame, self.action_flip_image.isChecked(), self.image_request, lambda: self.image_request)
+            self.prefetch_images()
+        worker.signals.prepared.connect(self.on_image_prepared)
+        self.image_pool.start(worker)
+    
+    class Preparing(QtCore.QRunnable):
+        class Signals(QtCore.QObject):
+            '''
+             Custom signals can only be defined on objects derived from QObject
+            '''
+            prepared = QtCore.pyqtSignal(int, object, object)
+        
+        def __init__(self, cache, fname, flip, request, current):
+            '''
+             cache:   FrameCache
+             fname:   Frame to display
+             flip:    Flip the frame upside down
+             request: Number of the request
+             current: returns the number of the current request,
+                      superseded requests are skipped
+            '''
+            super(self.__class__, self).__init__()
+            self.cache = cache
+            self.fname = fname
+            self.flip = flip
+            self.request = request
+            self.current = current
+            self.signals = Main_GUI.Preparing.Signals()
+        
+        def run(self):
+            if self.request != self.current():
+                return
+            data, buffer = None, None
+            try:
+                data, buffer = self.cache.display(self.fname, self.flip)
+            except (OSError, ValueError, EOFError) as e:
+                logging.warning('WARNING: Reading {} failed: {}'.format(os.path.basename(self.fname), e))
+            finally:
+                self.signals.prepared.emit(self.request, data, buffer)
+    
+    class Projecting(QtCore.QRunnable):
+        class Signals(QtCore.QObject):
+            '''
+             Custom signals can only be defined on objects derived from QObject
+            '''
+            prepared = QtCore.pyqtSignal(int, object, object)
+            progress = QtCore.pyqtSignal(int, int, int)
+        
+        def __init__(self, fname, stem, run, mode, flip, request, stop):
+            '''
+             fname:   A frame of the run
+             stem:    Frame name up to the run number
+             run:     Run number
+             mode:    Projection, see projection.PROJECTIONS
+             flip:    Flip the image upside down
+             request: Number of the request
+             stop:    threading.Event, set if superseded
+            '''
+            super(self.__class__, self).__init__()
+            self.fname = fname
+            self.stem = stem
+            self.run_num = run
+            self.mode = mode
+            self.flip = flip
+            self.request = request
+            self.stop = stop
+            self.signals = Main_GUI.Projecting.Signals()
+        
+        def run(self):
+            # the frames of the run are taken from the catalog
+            data, buffer = None, None
+            try:
+                path = os.path.dirname(self.fname)
+                with FrameCatalog(path) as catalog:
+                    frames = catalog.frames(self.stem, self.run_num)
+                projection = run_projection(path, self.stem, self.run_num, frames, stop=self.stop,
+                                            progress=lambda done, total: self.signals.progress.emit(self.request, done, total))
+                if projection is not None:
+                    data = projection_image(projection, self.mode)
+                    buffer = display_buffer(data, self.flip)
+                    if self.flip:
+                        data = data[::-1]
+            except (OSError, ValueError, EOFError, sqlite3.Error) as e:
+                logging.warning('WARNING: Projecting run {} failed: {}'.format(self.run_num, e))
+            finally:
+                self.signals.prepared.emit(self.request, data, buffer)
+    
+    def on_projection_progress(self, request, done, total):
+        if request != self.image_request:
+            return
+        self.statusBar.show()
+        self.status.setText('Projecting run {}: {}/{} frames'.format(self.fRnum, done, total))
+    
+    def on_image_prepared(self, request, data, buffer):
+        '''
+         show the prepared frame
+         - results of superseded requests are dropped
+        '''
+        if request != self.image_request:
+            return
+        if self.cb_mask_image.currentIndex() > 0 and not self.pb_convert.isVisible():
+            self.statusBar.hide()
+        if data is None:
+            return
+        # the display buffer is shown as is, no copy, no levels
+        self.frame_data = data
+        self.img.setImage(buffer, autoLevels=False, levels=None)
         self.img_dim_y, self.img_dim_x = data.shape
         if self.flag_reset_view:
             self.reset_view()
-        self.mask_change_frame_max_int()
         self.add_resolution_label()
         
         #iPath = os.path.abspath(self.le_input.text())
         oPath = os.path.abspath(self.le_output.text())
         #self.path_inf = os.path.join(iPath, '{}_{:>02}_{}inf'.format(self.fStem, int(self.fRnum), self.fStar))
         self.path_inf = f'{os.path.splitext(os.path.splitext(self.currentFrame)[0])[0]}.inf'
-        self.path_mask = os.path.join(oPath, '{}_xa_{:>02}_0001.sfrm'.format(self.fStem, int(self.fRnum)))
-        self.path_patches = os.path.join(oPath, '{}_xa_{:>02}_0001.msk'.format(self.fStem, int(self.fRnum)))
+        self.path_mask, self.path_patches = mask_paths(oPath, self.fStem, self.fRnum)
         self.read_inf()
         self.patches_clear()
         self.patches_reset_size()
         self.patches_load()
         self.patches_add()
+        self.mask_overlay_reset()
         self.add_beamcenter()
 
+    def prefetch_images(self):
+        '''
+         decode the neighbouring runs in the background,
+         nearest first, the next one before the previous one
+        '''
+        frames = []
+        for inc in range(1, self.prefetch_range + 1):
+            for idx in (self.currentIndex + inc, self.currentIndex - inc):
+                if 0 <= idx < len(self.runList):
+                    frames.append(self.runList[idx])
+        self.frame_cache.prefetch(frames, self.action_flip_image.isChecked())
+
     def add_beamcenter(self):
         if self.exp_beamcenter_x is None:
             return
@@ -670,103 +908,78 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
             self.menu_mask.setEnabled(False)
             return
     
-    def mask_add_obj(self, obj, val):
+    @staticmethod
+    def patch_name(obj):
+        if isinstance(obj, pg.graphicsItems.ROI.RectROI):
+            return 'rect'
+        return 'circ'
+
+    def mask_patches(self):
         '''
-        Circles and Ellipses
-        Note: returnMappedCoords is not yet supported for this ROI type.
-        
-        Workaround taken from:
-        https://groups.google.com/g/pyqtgraph/c/fcysRvIcJi8
-        https://groups.google.com/g/pyqtgraph/c/-kNPXxDeERs
-        
-        Still produces erroneously unmasked regions so we are not going to use ellipses
-        The tilting of the rectangle should be only minute, showing only single unmasked pixels
-        Application of scipy.ndimage.binary_erosion() before writing the mask should make it smooth and clean.
-        - This is bad!
-        - Still not supported in pyqtgraph version 0.13.3
+         the patches in drawing order: (name, pos, size, angle, value)
+         - circles from large to small, the base patches on top
         '''
-        cols, rows = self.img.image.shape
-        m = np.mgrid[:cols,:rows]
-        possx = m[0,:,:]
-        possy = m[1,:,:]
-        possx.shape = cols, rows
-        possy.shape = cols, rows
-        mpossx = obj.getArrayRegion(possx, self.img).astype(int)
-        mpossy = obj.getArrayRegion(possy, self.img).astype(int)
-        self.msk[mpossx, mpossy] = val
-
-    def mask_write(self):
-        ##############################
-        # DEMANDING FOR MANY PATCHES #
-        # !!!!!!! TWEAK HERE !!!!!!! #
-        #      -> mask_add_obj()     #
-        ##############################
-        self.msk = np.ones(self.img.image.shape)
-        self.patches['circles'] = []
         newlist = sorted(self.patches_circs, key=lambda x: x[0].size().manhattanLength(), reverse=True)
-        for obj, val in newlist:
-            self.mask_add_obj(obj, val)
-            self.patches['circles'].append(['circ', obj.pos(), obj.size(), obj.angle(), val])
-        ##########################
+        return [('circ', obj.pos(), obj.size(), obj.angle(), val) for obj, val in newlist] +\
+               [(self.patch_name(obj), obj.pos(), obj.size(), obj.angle(), val) for obj, val in self.patches_base]
 
-        self.patches['base'] = []
-        for obj, val in self.patches_base:
-            self.mask_add_obj(obj, val)
-            if isinstance(obj, pg.graphicsItems.ROI.RectROI):
-                self.patches['base'].append(['rect', obj.pos(), obj.size(), obj.angle(), val])
-            elif isinstance(obj, pg.graphicsItems.ROI.CircleROI):
-                self.patches['base'].append(['circ', obj.pos(), obj.size(), obj.angle(), val])
-        # interpolation fails -> erode the mask
-        self.msk = ndi.binary_erosion(self.msk)
-        
-        # mask negatives?
-        if self.mask_negative:
-            self.msk[self.img.image < 0] = 0
+    def mask_update(self):
+        '''
+         bring the mask up to date with the patches
+         - only the changed patches are redrawn, see mask.MaskRaster
+        '''
+        if self.frame_data is None:
+            return
+        if self.mask_raster is None or self.mask_raster.shape != self.frame_data.shape:
+            self.mask_raster = MaskRaster(self.frame_data.shape)
+        dirty = self.mask_raster.update(self.mask_patches())
+        self.msk = self.mask_raster.mask
+        if self.mask_overlay is not None and dirty:
+            update_overlay(self.mask_overlay, self.mask_overlay_offset, self.msk, self.mask_dead, dirty)
+            self.img_mask.setImage(self.mask_overlay, autoLevels=False, levels=None)
 
-        # get the frame saint ready
-        # - pad with zeros
-        if self.action_use_padding.isChecked():
-            self.msk, offset_rows, offset_cols = pilatus_pad(self.msk, fill=0)
+    def mask_overlay_reset(self):
+        '''
+         show the pixels the mask of the frame will mask
+         - the patches, negative pixels and the padding
+         - redrawn where the patches change, see mask_update
+        '''
+        self.mask_overlay = None
+        if self.frame_data is None or not self.action_show_overlay.isChecked():
+            self.img_mask.hide()
+            return
+        self.mask_update()
+        self.mask_dead = self.frame_data < 0 if self.mask_negative else None
+        self.mask_overlay, self.mask_overlay_offset = overlay_buffer(self.msk, self.mask_dead, self.action_use_padding.isChecked())
+        self.img_mask.setImage(self.mask_overlay, autoLevels=False, levels=None)
+        self.img_mask.setPos(-self.mask_overlay_offset[1], -self.mask_overlay_offset[0])
+        self.img_mask.show()
 
-        header = bruker_header()
-        # fill known header entries
-        header['NCOLS']       = [self.msk.shape[1]]                 # Number of pixels per row; number of mosaic tiles in X; dZ/dX
-        header['NROWS']       = [self.msk.shape[0]]                 # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
-        #header['CCDPARM'][:] = [1.47398, 36.60, 359.8295, 0.0, 163810.0] # readnoise, electronsperadu, electronsperphoton, bruker_bias, bruker_fullscale
-        #header['DETTYPE'][:] = ['CMOS-PHOTONII', 37.037037, 1.004, 0, 0.425, 0.035, 1]
-        header['DETTYPE'][:]  = [self.detector_type, 10.0, 1.0, 0, 0.0, 0.0, 1] # dettype pix512percm cmtogrid circular brassspacing windowthickness accuratetime
-        #header['SITE']       = ['Aarhus Huber Diffractometer']           # Site name
-        #header['MODEL']      = ['Microfocus X-ray Source']               # Diffractometer model
-        #header['TARGET']     = ['Ag Ka']                                 # X-ray target material)
-        #header['SOURCEK']    = [50.0]                                    # X-ray source kV
-        #header['SOURCEM']    = [0.880]                                   # Source milliamps
-        #header['WAVELEN'][:] = [0.560860, 0.559420, 0.563810]            # Wavelengths (average, a1, a2)
-        if self.action_set_wavelength.isChecked():
-            header['WAVELEN'][:] = [self.exp_wavelength, self.exp_wavelength, self.exp_wavelength] # Wavelengths (average, a1, a2)
-        else:
-            header['WAVELEN'][:] = [1.0, 1.0, 1.0]                            # Wavelengths (average, a1, a2)
-        #header['CORRECT']    = ['INTERNAL, s/n: A110247']                # Flood correction filename
-        #header['DARK']       = ['INTERNAL, s/n: A110247']                # Dark current frame name
-        #header['WARPFIL']    = ['LINEAR']                                # Spatial correction filename
-        #header['LINEAR'][:]  = [1.00, 0.00]                              # bruker_linearscale, bruker_linearoffset
-        #header['PHD'][:]     = [0.68, 0.051]                             # Phosphor efficiency, phosphor thickness
-        #header['OCTMASK'][:] = [0, 0, 0, 767, 767, 1791, 1023, 1023]
+    def mask_write(self):
+        '''
+         write the mask and the patches of the run
+         - the mask is kept up to date (see mask_update),
+           a worker composes and writes the files
+         - the patches are recolored, the image stays
+        '''
+        self.mask_update()
+        drawn = [list(patch) for patch in self.mask_patches()]
+        # a new dict, the worker pickles it
+        self.patches = defaultdict(list)
+        self.patches['circles'] = drawn[:len(self.patches_circs)]
+        self.patches['base'] = drawn[len(self.patches_circs):]
+        self.patches_pending[self.path_patches] = self.patches
 
-        # write the frame
-        if self.action_write_bruker_sfrm.isChecked():
-            write_bruker_frame(self.path_mask, header, np.flipud(self.msk))
-        
-        # save mask as numpy npy file
-        if self.action_write_numpy_npy.isChecked():
-            np.save(os.path.splitext(self.path_mask)[0], np.flipud(self.msk))
-        
-        # dump patches dict
-        self.patches_save()
+        wavelength = self.exp_wavelength if self.action_set_wavelength.isChecked() else None
+        worker = self.MaskWriting(self.msk.copy(), self.frame_data if self.mask_negative else None,
+                                  self.action_use_padding.isChecked(), self.path_mask, self.detector_type, wavelength,
+                                  self.action_write_bruker_sfrm.isChecked(), self.action_write_numpy_npy.isChecked(),
+                                  self.path_patches, self.patches)
+        worker.signals.written.connect(self.on_mask_written)
+        self.mask_pool.start(worker)
 
         self.cb_mask_stored.setChecked(True)
-
-        # reload image to set saved mask colors
-        self.change_image()
+        self.patches_recolor()
 
         # DEBUG
         # show mask in matplotlib
@@ -774,14 +987,160 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
             import matplotlib.pyplot as plt
             plt.axis('off')
             plt.subplots_adjust(0,0,1,1,0,0)
-            plt.imshow(np.flipud(self.msk))
+            plt.imshow(np.flipud(mask_frame(self.msk, worker.frame, worker.pad)))
             plt.show()
 
+    class MaskWriting(QtCore.QRunnable):
+        class Signals(QtCore.QObject):
+            '''
+             Custom signals can only be defined on objects derived from QObject
+            '''
+            written = QtCore.pyqtSignal(str, object, str)
+        
+        def __init__(self, mask, frame, pad, path_mask, detector_type, wavelength, sfrm, npy, path_patches, patches):
+            '''
+             mask:          Mask of the patches (copy)
+             frame:         Frame, negative pixels are masked, or None
+             pad:           Pad the mask, see mask.mask_frame
+             path_mask:     Mask file (.sfrm)
+             detector_type: Detector type for SAINT
+             wavelength:    Wavelength or None
+             sfrm:          Write the .sfrm
+             npy:           Write the .npy
+             path_patches:  Patches file (.msk)
+             patches:       Patches dict to pickle
+            '''
+            super(self.__class__, self).__init__()
+            self.mask = mask
+            self.frame = frame
+            self.pad = pad
+            self.path_mask = path_mask
+            self.detector_type = detector_type
+            self.wavelength = wavelength
+            self.sfrm = sfrm
+            self.npy = npy
+            self.path_patches = path_patches
+            self.patches = patches
+            self.signals = Main_GUI.MaskWriting.Signals()
+        
+        def run(self):
+            error = ''
+            try:
+                mask = mask_frame(self.mask, self.frame, self.pad)
+                write_mask(self.path_mask, mask, self.detector_type, self.wavelength, self.sfrm, self.npy)
+                # dump patches dict, never seen half written
+                tmp = '{}.{}'.format(self.path_patches, os.getpid())
+                with open(tmp, 'wb') as wf:
+                    pickle.dump(self.patches, wf)
+                os.replace(tmp, self.path_patches)
+            except OSError as e:
+                error = str(e)
+            finally:
+                self.signals.written.emit(self.path_patches, self.patches, error)
+
+    def on_mask_written(self, path_patches, patches, error):
+        if self.patches_pending.get(path_patches) is patches:
+            del self.patches_pending[path_patches]
+        if error:
+            logging.error('ERROR: Writing the mask failed: {}'.format(error))
+            if path_patches == self.path_patches:
+                self.cb_mask_stored.setChecked(os.path.exists(path_patches))
+                self.patches_recolor()
+
+    def mask_propose(self):
+        '''
+         propose the base patches from the beamstop shadow
+         of the current run, see automask.py
+         - found by a worker, the circles are kept
+        '''
+        if self.currentFrame is None or self.frame_data is None:
+            return
+        if self.proposal_stop is not None:
+            self.proposal_stop.set()
+        self.proposal_stop = threading.Event()
+        center = None
+        if self.exp_beamcenter_x is not None:
+            center = (self.exp_beamcenter_x, self.exp_beamcenter_y)
+        worker = self.Proposing(self.currentFrame, self.fStem, self.fRnum, center, self.action_flip_image.isChecked(), self.path_patches, self.proposal_stop)
+        worker.signals.progress.connect(self.on_proposal_progress)
+        worker.signals.proposed.connect(self.on_mask_proposed)
+        self.mask_pool.start(worker)
+
+    class Proposing(QtCore.QRunnable):
+        class Signals(QtCore.QObject):
+            '''
+             Custom signals can only be defined on objects derived from QObject
+            '''
+            proposed = QtCore.pyqtSignal(str, object)
+            progress = QtCore.pyqtSignal(str, int, int)
+        
+        def __init__(self, fname, stem, run, center, flip, key, stop):
+            '''
+             fname:  A frame of the run
+             stem:   Frame name up to the run number
+             run:    Run number
+             center: Beam center (x, y) or None
+             flip:   The image is flipped upside down
+             key:    Patches file of the run
+             stop:   threading.Event, set if superseded
+            '''
+            super(self.__class__, self).__init__()
+            self.fname = fname
+            self.stem = stem
+            self.run_num = run
+            self.center = center
+            self.flip = flip
+            self.key = key
+            self.stop = stop
+            self.signals = Main_GUI.Proposing.Signals()
+        
+        def run(self):
+            # the frames of the run are taken from the catalog
+            patches = None
+            try:
+                with FrameCatalog(os.path.dirname(self.fname)) as catalog:
+                    frames = catalog.frames(self.stem, self.run_num)
+                patches = propose_patches(frames, center=self.center, flip=self.flip, stop=self.stop,
+                                          progress=lambda done, total: self.signals.progress.emit(self.key, done, total))
+            except (OSError, ValueError, EOFError, sqlite3.Error) as e:
+                logging.warning('WARNING: Proposing a mask for run {} failed: {}'.format(self.run_num, e))
+            finally:
+                self.signals.proposed.emit(self.key, patches)
+
+    def on_proposal_progress(self, key, done, total):
+        if key != self.path_patches:
+            return
+        self.statusBar.show()
+        self.status.setText('Proposing a mask for run {}: {}/{} frames'.format(self.fRnum, done, total))
+
+    def on_mask_proposed(self, key, patches):
+        if not self.pb_convert.isVisible():
+            self.statusBar.hide()
+        if key != self.path_patches:
+            return
+        if patches is None:
+            logging.warning('WARNING: No beamstop shadow found in run {}'.format(self.fRnum))
+            return
+        # the proposal replaces the base patches
+        circles = [list(patch) for patch in self.mask_patches()[:len(self.patches_circs)]]
+        self.patches_clear()
+        self.patches = defaultdict(list)
+        self.patches['base'] = [list(patch) for patch in patches]
+        self.patches['circles'] = circles
+        self.cb_mask_stored.setChecked(False)
+        self.patches_add()
+        self.patches_adjust_size()
+        self.mask_overlay_reset()
+
     def patches_reset_size(self):
         self.patch_size_current = self.patch_size_default
     
     def patches_load(self):
-        if os.path.exists(self.path_patches):
+        if self.path_patches in self.patches_pending:
+            # still being written
+            self.cb_mask_stored.setChecked(True)
+            self.patches = defaultdict(list, self.patches_pending[self.path_patches])
+        elif os.path.exists(self.path_patches):
             self.cb_mask_stored.setChecked(True)
             with open(self.path_patches, 'rb') as rf:
                 self.patches = pickle.load(rf)
@@ -812,6 +1171,8 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
                     r_roi.addScaleHandle((0.0,0.0), center=(1.0,1.0))
                     r_roi.setZValue(100)
                     r_roi.set_handles(size=self.handle_size, width=self.handle_width)
+                    r_roi.sigRegionChangeFinished.connect(self.patches_changed)
+                    r_roi.sigRegionChanged.connect(self.mask_update)
                     self.plt.addItem(r_roi)
                     self.patches_base.append((r_roi, msk))
                 elif name == 'circ':
@@ -819,6 +1180,8 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
                     c_roi.setZValue(101)
                     c_roi.set_handles(size=self.handle_size, width=self.handle_width)
                     c_roi.sigRegionChangeFinished.connect(self.patches_adjust_size)
+                    c_roi.sigRegionChangeFinished.connect(self.patches_changed)
+                    c_roi.sigRegionChanged.connect(self.mask_update)
                     self.plt.addItem(c_roi)
                     self.patches_base.append((c_roi, msk))
         if 'circles' in self.patches:
@@ -830,6 +1193,8 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
                 c_roi.set_handles(size=self.handle_size, width=self.handle_width)
                 c_roi.setZValue(idx)
                 c_roi.sigRegionChangeFinished.connect(self.patches_circs_sort)
+                c_roi.sigRegionChangeFinished.connect(self.patches_changed)
+                c_roi.sigRegionChanged.connect(self.mask_update)
                 self.plt.addItem(c_roi)
                 self.patches_circs.append((c_roi, msk))
     
@@ -839,9 +1204,27 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
                 if patch.size()[0] > self.patch_size_current:
                     self.patch_size_current = patch.size()[0]
 
-    def patches_save(self):
-        with open(self.path_patches, 'wb') as wf:
-            pickle.dump(self.patches, wf)
+    def patches_recolor(self):
+        '''
+         set the brush of the base patches: saved or unsaved
+        '''
+        if self.cb_mask_stored.isChecked():
+            active_brush = self.brush_saved
+        else:
+            active_brush = self.brush_unsaved
+        for patch, _ in self.patches_base:
+            patch.setBrush(active_brush)
+
+    def patches_changed(self):
+        '''
+         a patch was moved, added or removed
+         - the mask is updated where it changed
+         - the patches are marked unsaved
+        '''
+        self.mask_update()
+        if self.cb_mask_stored.isChecked():
+            self.cb_mask_stored.setChecked(False)
+            self.patches_recolor()
     
     def patches_circs_add(self):
         #x = self.img_dim_x/2 - self.patch_size_current/2 - self.patch_size_increment/2
@@ -854,6 +1237,8 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         patch_add = FillCircleROI((x,y), (self.patch_size_current,self.patch_size_current), pen=self.pen_unmask, brush=self.brush_unmask, **self.patch_parameter)
         patch_add.set_handles(size=self.handle_size, width=self.handle_width)
         patch_add.sigRegionChangeFinished.connect(self.patches_circs_sort)
+        patch_add.sigRegionChangeFinished.connect(self.patches_changed)
+        patch_add.sigRegionChanged.connect(self.mask_update)
         self.plt.addItem(patch_add)
         self.patches_circs.append((patch_add, 1))
         
@@ -863,10 +1248,13 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         patch_sub = FillCircleROI((x,y), (self.patch_size_current,self.patch_size_current), pen=self.pen_mask, brush=self.brush_mask, **self.patch_parameter)
         patch_sub.set_handles(size=self.handle_size, width=self.handle_width)
         patch_sub.sigRegionChangeFinished.connect(self.patches_circs_sort)
+        patch_sub.sigRegionChangeFinished.connect(self.patches_changed)
+        patch_sub.sigRegionChanged.connect(self.mask_update)
         self.plt.addItem(patch_sub)
         self.patches_circs.append((patch_sub, 0))
         
         self.patches_circs_sort()
+        self.patches_changed()
     
     def patches_circs_rem(self):
         if self.patches_circs:
@@ -876,6 +1264,7 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
             self.plt.removeItem(p)
             self.patch_size_current -= 2 * self.patch_size_increment
             self.patches_circs_sort()
+            self.patches_changed()
     
     def patches_circs_sort(self):
         if self.patches_circs:
@@ -919,7 +1308,7 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
             self.colormap = self.colormaps[idx]
             
             self.cmap = pg.colormap.get(self.colormap, skipCache=True)
-            self.img.setLookupTable( self.cmap.getLookupTable(nPts=256) )
+            self.update_lookup_table()
             logging.info(self.colormap)
             #self.img.setColorMap(self.colormaps[idx])
         elif k == QtCore.Qt.Key.Key_A:
@@ -988,11 +1377,10 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
     def on_treeView_clicked(self, index):
         logging.debug(self.__class__.__name__)
         '''
-         Current find run_list implementation is flawed yet simple:
-         - iterate over all frames found and find the 001. (SP8) or 
-           0001. (APS) entries that mark the beginning of a new run
-         - if the first frame is missing THIS WILL CRASH!
-           hence, to be fixed later, if ever.
+         the runs are taken from the frame catalog (see catalog.py):
+         - the first frame present marks the beginning of a run,
+           runs with a missing first frame are found as well
+         - missing frames (gaps) are reported
         '''
         self.indexItem = self.model.index(index.row(), 0, index.parent())
         self.curPath = os.path.abspath(self.model.filePath(self.indexItem))
@@ -1008,19 +1396,76 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
             self.le_output.setText(self.curPath)
             return
         
+        # the frames are viewed through the cache of the output
+        # directory, running conversions keep theirs (see diskcache.py)
+        self.set_disk_cache(self.le_output.text())
+        
         self.tb_convert.setText('Convert Images')
         self.tb_convert.setEnabled(False)
 
-        # find files
-        fDir = QtCore.QDir()
-        fDir.setPath(self.curPath)
-        fDir.setNameFilters(self.exts)
-        fDir.setFilter(QtCore.QDir.Filter.Files | QtCore.QDir.Filter.NoDotAndDotDot)
-        fDir.setSorting(QtCore.QDir.SortFlag.Name)
-        nFrames = fDir.count()
+        # find files in the background
+        # - on_frames_scanned is called once the scan is finished
+        worker = self.__class__.Scanning(self.curPath, self.exts)
+        worker.signals.progress.connect(self.on_frames_progress)
+        worker.signals.finished.connect(self.on_frames_scanned)
+        self.scan_pool.start(worker)
+    
+    class Scanning(QtCore.QRunnable):
+        class Signals(QtCore.QObject):
+            '''
+             Custom signals can only be defined on objects derived from QObject
+            '''
+            progress = QtCore.pyqtSignal(str, int)
+            finished = QtCore.pyqtSignal(str, list, list)
+        
+        def __init__(self, path, patterns):
+            '''
+             path:     Directory to scan
+             patterns: Frame name patterns
+            '''
+            super(self.__class__, self).__init__()
+            self.path = path
+            self.patterns = patterns
+            self.signals = Main_GUI.Scanning.Signals()
+        
+        def run(self):
+            # the number of frames is reported while scanning
+            # the catalog is only kept for directories with frames
+            frames, runs = [], []
+            try:
+                number = 0
+                for chunk in scan_frames(self.path, self.patterns):
+                    number += len(chunk)
+                    self.signals.progress.emit(self.path, number)
+                if number > 0:
+                    with FrameCatalog(self.path) as catalog:
+                        catalog.update(self.patterns)
+                        frames = catalog.frames()
+                        runs = catalog.runs()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning('WARNING: Scanning {} failed: {}'.format(self.path, e))
+            finally:
+                self.signals.finished.emit(self.path, frames, runs)
+    
+    def on_frames_progress(self, path, number):
+        self.model.set_count(path, number)
+        if path == self.curPath:
+            self.tb_convert.setText('Scanning: {} Images'.format(number))
+    
+    def on_frames_scanned(self, path, frames, runs):
+        logging.debug(self.__class__.__name__)
+        '''
+         the scan of 'path' is finished
+         - results of a directory that is no longer selected are dropped
+        '''
+        self.model.set_count(path, len(frames))
+        if path != self.curPath:
+            return
+        nFrames = len(frames)
+        self.tb_convert.setText('Convert Images')
         
         if nFrames > 0:
-            self.framesList = [i.absoluteFilePath() for i in fDir.entryInfoList()]
+            self.framesList = frames
             
             # Check frame format
             self.currentFrame = self.framesList[0]
@@ -1029,10 +1474,11 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
                 self.currentFrame = None
                 return
             
-            # Incorrect/Incomplete runs may end in empty self.runList
-            # - e.g. if first frame is missing it's not considered a run!
-            # - self.fStar is updated by self.check_format()
-            self.runList = sorted([os.path.abspath(f) for f in self.framesList if self.fStar in f])
+            # the first frame present of each run
+            self.runList = [first for _, _, first, _, _, _ in runs]
+            for stem, run, _, _, last, number in runs:
+                if number < last:
+                    logging.warning('WARNING: {} of {} frames missing in run {} of {}'.format(last - number, last, run, stem))
             
             # generate the mask list here would save calling check_format a lot!
             # - getting the run name however is non-trivial due to different naming conventions!
@@ -1090,6 +1536,16 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         if not os.path.exists(aPath):
             os.makedirs(aPath)
     
+    def set_disk_cache(self, aPath):
+        '''
+         enable the disk cache of decoded frames in
+         output directory 'aPath' (see diskcache.py)
+        '''
+        if self.action_disk_cache.isChecked():
+            enable_disk_cache(disk_cache_path(aPath))
+        else:
+            disable_disk_cache()
+    
     def disable_user_input(self, toggle):
         logging.debug(self.__class__.__name__)
         self.cb_link.setDisabled(toggle)
@@ -1125,6 +1581,7 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         
         # Make directories recursively
         self.create_output_directory(path_output)
+        self.set_disk_cache(path_output)
         
         # disable main window elements
         # re-enabled after conversion finished
@@ -1135,128 +1592,183 @@ class Main_GUI(QtWidgets.QMainWindow, Ui_MainWindow):
         # pass it on to the conversion function
         overwrite_flag = self.cb_overwrite.isChecked()
         
-        # create a pool of workers
-        #  - pool.apply_async, map doesn't work since we need to specify the output directory!
-        #  - the list 'results' together with 'callback=results.append' is used to track the conversion progress
-        #     - 'while len(results) != _todo' constantly checks results to update the progressbar
-        #  - pool.close(): close the pool when there are no more files left in 'self.framesList'
-        #  - pool.join(): wait for remaining processes to finish
-        #########################################
-        ##  Add new format identifiers here!   ##
-        #########################################
+        # change wavelength
+        source_w = None
+        if self.action_set_wavelength.isChecked():
+            source_w = self.exp_wavelength
+        
         # fork here according to specified facility
-        #  - conversion: what _Utility.py function to call
-        #  - parameters: parameters for the conversion function
-        #     - path_output, dimension1, dimension2, overwrite_flag
-        #     - more if needed, e.g. SP8 2-th correction value
-        if self.fSite == 'APS':
-            rows, cols, offset, dtype = self.fInfo
-            conversion = convert_frame_APS_Bruker
-            beamflux = {}
-            for f in glob.glob(os.path.join(path_input,'*_flux.txt')):
-                with open(f) as ofile:
-                    beamflux[int(f.split('_')[-2])] = [int(float(x)) for x in ofile.read().split()[1::2]]
-            args = [path_output]
-            kwargs = {'rows':rows, 'cols':cols, 'offset':offset, 'overwrite':overwrite_flag, 'beamflux':beamflux}
-        elif self.fSite == 'SP8':
-            rows, cols, offset, dtype = self.fInfo
-            # check data collection timestamp
-            with open(self.currentFrame, 'rb') as ofile:
-                year = int(re.search(rb'(\d{4}):\d{2}:\d{2}\s+\d{2}:\d{2}:\d{2}', ofile.read(64)).group(1).decode())
-            if year < 2019:
-                self.SP8_tth_corr = 0.048
-            conversion = convert_frame_SP8_Bruker
-            args = [path_output]
-            # change wavelength
-            source_w = None
-            if self.action_set_wavelength.isChecked():
-                source_w = self.exp_wavelength
-            kwargs = {'tth_corr':self.SP8_tth_corr, 'rows':rows, 'cols':cols, 'offset':offset, 'overwrite':overwrite_flag, 'source_w':source_w}
-        elif self.fSite == 'SP8_gz':
-            rows, cols, offset, dtype = self.fInfo
-            # check data collection timestamp
-            with gzip.open(self.currentFrame, 'rb') as ofile:
-                year = int(re.search(rb'(\d{4}):\d{2}:\d{2}\s+\d{2}:\d{2}:\d{2}', ofile.read(64)).group(1).decode())
-            if year < 2019:
-                self.SP8_tth_corr = 0.048
-            conversion = convert_frame_SP8_Bruker_gz
-            args = [path_output]
-            # change wavelength
-            source_w = None
-            if self.action_set_wavelength.isChecked():
-                source_w = self.exp_wavelength
-            kwargs = {'tth_corr':self.SP8_tth_corr, 'rows':rows, 'cols':cols, 'offset':offset, 'overwrite':overwrite_flag, 'source_w':source_w}
-        elif self.fSite == 'DLS':
-            rows, cols, offset, dtype = self.fInfo
-            conversion = convert_frame_DLS_Bruker
-            args = [path_output]
-            kwargs = {'rows':rows, 'cols':cols, 'offset':offset, 'overwrite':overwrite_flag}
-        else:
+        #  - new formats are added in formats.py / convert.py
+        # watch: the number of frames per run is unknown
+        setup = get_conversion(self.fFormat, self.currentFrame, path_input, path_output,
+                               overwrite=overwrite_flag, tth_corr=self.SP8_tth_corr, source_w=source_w,
+                               catalog=not self.action_watch_input.isChecked())
+        if setup is None:
             self.popup_window('Information', 'Unknown facility!', '')
+            self.disable_user_input(False)
+            return
+        conversion, args, kwargs = setup
+        # pre 2019 SP8 data needs the 2-theta correction
+        if 'tth_corr' in kwargs:
+            self.SP8_tth_corr = kwargs['tth_corr']
+        
+        # the manifest records all converted frames
+        # - don't overwrite: skip frames that are up to date
+        manifest = Manifest(path_output)
+        options = conversion_options(conversion, args, kwargs)
+        if overwrite_flag:
+            self.convertList = list(self.framesList)
+        else:
+            # existing frames that are not recorded are kept
+            self.convertList = manifest.pending(self.framesList, options, overwrite=False)
+            kwargs['overwrite'] = True
+        # watch: convert new frames as they are collected
+        # - until action_watch_input is unchecked
+        self.watcher = None
+        if self.action_watch_input.isChecked():
+            # the frames found may still be written, they are passed
+            # on by the watcher once complete, the others are ignored
+            self.watcher = FrameWatcher(path_input, info=self.fInfo, known=set(self.framesList).difference(self.convertList))
+            self.convertList = []
+        elif not self.convertList:
+            self.popup_window('Information', 'All images are up to date!', '')
+            self.disable_user_input(False)
             return
         
         self.tb_convert.hide()
         self.pb_convert.show()
         self.statusBar.show()
+        # the number of frames is unknown, busy indicator
+        if self.watcher is not None:
+            self.pb_convert.setRange(0, 0)
         
-        # Now uses QRunnable and QThreadPool instead of multiprocessing.pool()
-        self.num_to_convert = len(self.framesList)
+        # a single QRunnable feeds and monitors either
+        #  - a pool of processes
+        #  - a pipeline of reader, converter and writer threads,
+        #    reading, converting and writing frames overlap
+        self.num_to_convert = len(self.convertList)
         self.converted = []
         self.pool = QtCore.QThreadPool()
-        for fname in self.framesList:
-            worker = self.__class__.Threading(conversion, fname, args, kwargs)
-            worker.signals.finished.connect(self.conversion_process)
-            self.pool.start(worker)
+        if self.action_use_processes.isChecked() and self.watcher is None:
+            worker = self.__class__.Processing(conversion, self.convertList, args, kwargs, backend='process', manifest=manifest, options=options)
+        else:
+            worker = self.__class__.Processing(conversion, self.convertList, args, kwargs, backend='pipeline', manifest=manifest, options=options, watcher=self.watcher)
+        worker.signals.finished.connect(self.conversion_process)
+        worker.signals.done.connect(self.conversion_finished)
+        self.pool.start(worker)
         
         # switch view to mask drawing
         self.tabWidget.setCurrentIndex(1)
 
-    class Threading(QtCore.QRunnable):
+    class Processing(QtCore.QRunnable):
         class Signals(QtCore.QObject):
             '''
              Custom signals can only be defined on objects derived from QObject
             '''
             finished = QtCore.pyqtSignal(bool)
+            done = QtCore.pyqtSignal()
     
-        def __init__(self, fn_conversion, file_name, fn_args, fn_kwargs):
+        def __init__(self, fn_conversion, file_names, fn_args, fn_kwargs, backend='process', manifest=None, options=None, watcher=None):
             '''
              fn_conversion: Conversion function
-             file_name:     File name to convert
+             file_names:    File names to convert
              fn_args:       Arguments to pass to the function
              fn_kwargs:     Keywords to pass to the function
+             backend:       'process' or 'pipeline' (see convert.convert_frames)
+             manifest:      Manifest to record the converted frames
+             options:       Conversion options fingerprint for the manifest
+             watcher:       FrameWatcher, convert the frames it finds
+                            until it is stopped (pipeline backend)
             '''
             super(self.__class__, self).__init__()
             self.conversion = fn_conversion
-            self.name = file_name
+            self.names = list(file_names)
             self.args = fn_args
             self.kwargs = fn_kwargs
-            self.signals = self.__class__.Signals()
+            self.backend = backend
+            self.manifest = manifest
+            self.options = options
+            self.watcher = watcher
+            self.signals = Main_GUI.Processing.Signals()
         
         def run(self):
-            # conversion: returns True/False
-            # signal to conversion_process to track the process
-            self.signals.finished.emit(self.conversion(self.name, *self.args, **self.kwargs))
+            # the frames are converted by the persistent process pool
+            # or the read/convert/write pipeline threads
+            # signal to conversion_process for every finished frame
+            # the manifest is only touched by this thread
+            # signal done when all frames are converted
+            frames = self.names
+            if self.watcher is not None:
+                frames = itertools.chain(self.names, self.watcher.frames())
+            try:
+                for fname, result in convert_frames(frames, self.conversion, self.args, self.kwargs, backend=self.backend):
+                    if result and self.manifest is not None:
+                        self.manifest.record(fname, self.options, result)
+                        if self.manifest.changed >= 100:
+                            self.manifest.flush()
+                    self.signals.finished.emit(bool(result))
+            finally:
+                if self.manifest is not None:
+                    self.manifest.save()
+                self.signals.done.emit()
     
     def conversion_process(self, finished):
         self.converted.append(finished)
         num_converted = len(self.converted)
+        # watch: the number of frames is unknown
+        if self.watcher is not None:
+            self.status.setText('Watching: {} images converted'.format(num_converted))
+            return
         progress = float(num_converted) / float(self.num_to_convert) * 100.0
         self.pb_convert.setValue(int(round(progress,0)))
-        self.status.setText('{}'.format(os.path.basename(self.framesList[num_converted-1])))
+        self.status.setText('{}'.format(os.path.basename(self.convertList[num_converted-1])))
+    
+    def conversion_finished(self):
         # conversion finished
-        if num_converted == self.num_to_convert:
-            self.popup_window('Information', 'Successfully converted {} images!'.format(np.count_nonzero(self.converted)), '')
-            self.statusBar.hide()
-            self.pb_convert.hide()
-            self.tb_convert.show()
-            # enable main window elements
-            self.disable_user_input(False)
+        self.watcher = None
+        self.popup_window('Information', 'Successfully converted {} images!'.format(np.count_nonzero(self.converted)), '')
+        self.statusBar.hide()
+        self.pb_convert.setRange(0, 100)
+        self.pb_convert.hide()
+        self.tb_convert.show()
+        # enable main window elements
+        self.disable_user_input(False)
+    
+    def batch_conversion(self):
+        logging.debug(self.__class__.__name__)
+        '''
+         convert several datasets, the current settings
+         (overwrite, wavelength, 2-theta correction, processes)
+         are used for all of them
+        '''
+        source_w = None
+        if self.action_set_wavelength.isChecked():
+            source_w = self.exp_wavelength
+        # don't overwrite: skip frames that are up to date
+        prepare = {'overwrite':self.cb_overwrite.isChecked(),
+                   'resume':not self.cb_overwrite.isChecked(),
+                   'tth_corr':self.SP8_tth_user,
+                   'source_w':source_w}
+        backend = 'process' if self.action_use_processes.isChecked() else 'pipeline'
+        dialog = BatchDialog(self, self.suffix, prepare, backend)
+        dialog.exec()
+    
+    def watch_input(self, toggle):
+        # stop watching, the conversion finishes
+        # once the pending frames are converted
+        if not toggle and self.watcher is not None:
+            self.watcher.stop()
         
     def closeEvent(self, event):
         logging.debug(self.__class__.__name__)
         '''
         User clicks the 'x' mark in window
         '''
+        self.frame_cache.close()
+        # the masks being written
+        if self.proposal_stop is not None:
+            self.proposal_stop.set()
+        self.mask_pool.waitForDone()
         self.exitApp()
 
     def exitApp(self):
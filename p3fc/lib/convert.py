@@ -0,0 +1,352 @@
+import os
+import re
+import glob
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from p3fc.lib.decompress import read_head
+from p3fc.lib.catalog import FrameCatalog
+from p3fc.lib.diskcache import disk_cache_settings, use_disk_cache
+from p3fc.lib.manifest import frame_output
+from p3fc.lib.utility import convert_frame_APS_Bruker, convert_frame_SP8_Bruker, convert_frame_SP8_Bruker_gz,\
+                             convert_frame_DLS_Bruker, encode_bruker_frame
+
+def read_beamflux(path_input):
+    '''
+     read the APS beamflux files (*_flux.txt) of a directory
+      - returns a dict: {run number: [flux per frame]}
+    '''
+    beamflux = {}
+    for f in glob.glob(os.path.join(path_input,'*_flux.txt')):
+        with open(f) as ofile:
+            beamflux[int(f.split('_')[-2])] = [int(float(x)) for x in ofile.read().split()[1::2]]
+    return beamflux
+
+def read_collection_year(fname):
+    '''
+     read the data collection year from the (compressed) tif header
+      - only the head of the frame is decompressed
+    '''
+    return int(re.search(rb'(\d{4}):\d{2}:\d{2}\s+\d{2}:\d{2}:\d{2}', read_head(fname, 64)).group(1).decode())
+
+def read_nframes(path_input):
+    '''
+     number of frames per run from the frame catalog
+      - the catalog is brought up to date first
+      - returns a dict: {stem: {run number: number of frames}}
+    '''
+    with FrameCatalog(path_input) as catalog:
+        catalog.update()
+        return catalog.nframes()
+
+def get_conversion(fmt, fname, path_input, path_output, overwrite=True, tth_corr=0.0, source_w=None, catalog=True):
+    '''
+     fork here according to specified facility
+      - fmt: format info dict (see formats.detect_format)
+      - fname: a frame of the dataset, used to check the collection date
+      - conversion: what utility.py function to call
+      - parameters: parameters for the conversion function
+         - path_output, dimension1, dimension2, overwrite_flag
+         - more if needed, e.g. SP8 2-th correction value
+      - tth_corr: SP8 2-th correction, None: 0.0, pre 2019 data
+        is always corrected (0.048)
+      - catalog: number of frames per run from the frame catalog
+        (APS, DLS), False if unknown, e.g. while watching
+     returns conversion, args, kwargs or None if the facility is unknown
+    '''
+    #########################################
+    ##  Add new format identifiers here!   ##
+    #########################################
+    rows, cols, offset, dtype = fmt['info']
+    args = [path_output]
+    if fmt['site'] == 'APS':
+        conversion = convert_frame_APS_Bruker
+        beamflux = read_beamflux(path_input)
+        nframes = read_nframes(path_input) if catalog else None
+        kwargs = {'rows':rows, 'cols':cols, 'offset':offset, 'overwrite':overwrite, 'beamflux':beamflux, 'nframes':nframes}
+    elif fmt['site'] in ('SP8', 'SP8_gz'):
+        # check data collection timestamp
+        # 2-th were misaligned (pre 2019 data)
+        if read_collection_year(fname) < 2019:
+            tth_corr = 0.048
+        elif tth_corr is None:
+            tth_corr = 0.0
+        if fmt['site'] == 'SP8':
+            conversion = convert_frame_SP8_Bruker
+        else:
+            conversion = convert_frame_SP8_Bruker_gz
+        kwargs = {'tth_corr':tth_corr, 'rows':rows, 'cols':cols, 'offset':offset, 'overwrite':overwrite, 'source_w':source_w}
+    elif fmt['site'] == 'DLS':
+        conversion = convert_frame_DLS_Bruker
+        nframes = read_nframes(path_input) if catalog else None
+        kwargs = {'rows':rows, 'cols':cols, 'offset':offset, 'overwrite':overwrite, 'nframes':nframes}
+    else:
+        return None
+    return conversion, args, kwargs
+
+def convert_frame_safe(conversion, fname, args, kwargs):
+    '''
+     run a conversion, log and return False on errors
+     - a single broken frame must not stop the whole batch
+     - returns the FrameOutput of the written frame (see
+       manifest.frame_output), the result of the conversion
+       if it is given a 'write' function (see pipeline_frames)
+    '''
+    written = []
+    def write(outName, header, data):
+        chunks = encode_bruker_frame(header, data)
+        with open(outName, 'wb') as brukerFrame:
+            brukerFrame.writelines(chunks)
+        written.append(frame_output(chunks))
+    try:
+        result = conversion(fname, *args, **dict({'write':write}, **kwargs))
+    except Exception as e:
+        logging.error('ERROR: Conversion failed for {}: {}'.format(os.path.basename(fname), e))
+        return False
+    if result and written:
+        return written[-1]
+    return result
+
+def convert_chunk(conversion, fnames, args, kwargs, cache=None):
+    '''
+     convert a chunk of frames in one go
+     - a process pool task, returns a list of (fname, result)
+     - cache: disk cache settings of the submitting process,
+       the persistent workers don't see later changes
+       (see diskcache.use_disk_cache)
+    '''
+    use_disk_cache(cache)
+    return [(fname, convert_frame_safe(conversion, fname, args, kwargs)) for fname in fnames]
+
+def init_worker():
+    '''
+     warm up a process pool worker
+     - import numpy and the conversion functions once
+    '''
+    import numpy
+    import p3fc.lib.utility
+
+# the process pool is kept alive between conversions
+_PROCESS_POOL = None
+_PROCESS_POOL_WORKERS = None
+
+def get_process_pool(workers=None):
+    '''
+     return the persistent pool of worker processes
+      - workers are spawned (not forked) as the GUI runs Qt threads
+      - a new pool is only started if the number of workers changes
+    '''
+    global _PROCESS_POOL, _PROCESS_POOL_WORKERS
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if _PROCESS_POOL is None or _PROCESS_POOL_WORKERS != workers:
+        shutdown_process_pool()
+        _PROCESS_POOL = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=init_worker)
+        _PROCESS_POOL_WORKERS = workers
+    return _PROCESS_POOL
+
+def shutdown_process_pool():
+    '''
+     stop the persistent worker processes
+    '''
+    global _PROCESS_POOL, _PROCESS_POOL_WORKERS
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.shutdown(wait=False)
+    _PROCESS_POOL = None
+    _PROCESS_POOL_WORKERS = None
+
+# read ahead buffers of the pipeline reader threads
+_READ_AHEAD = threading.local()
+
+def read_ahead(fname, size=2**20):
+    '''
+     read a file into the page cache
+      - the conversion then reads it from memory
+    '''
+    buffer = getattr(_READ_AHEAD, 'buffer', None)
+    if buffer is None:
+        buffer = _READ_AHEAD.buffer = bytearray(size)
+    with open(fname, 'rb', buffering=0) as f:
+        while f.readinto(buffer):
+            pass
+
+# passed on by a stage that has no more work
+_STOP = object()
+
+def pipeline_frames(frames, conversion, args, kwargs, workers=None, readers=2, writers=2, depth=None):
+    '''
+     convert a list of frames in a staged pipeline
+      - reader threads: read the frames ahead (input I/O)
+      - worker threads: read, transform and encode the frames
+      - writer threads: write the .sfrm files (output I/O)
+      - the stages are connected by queues of 'depth' frames,
+        default: 2 * workers, a full queue blocks the stage
+        before it (backpressure)
+      - frames: a list or any iterable, e.g. the frames of a
+        FrameWatcher (see watch.py) that are converted while
+        they are collected, frames are taken from the iterable
+        once the readers can accept them
+      - the threads use the disk cache settings of the start
+        (see diskcache.use_disk_cache)
+      - yields (fname, result) in order of completion
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if depth is None:
+        depth = 2 * workers
+    cache = disk_cache_settings()
+    todo = queue.Queue(maxsize=depth)
+    ready = queue.Queue(maxsize=depth)
+    encoded = queue.Queue(maxsize=depth)
+    results = queue.Queue()
+    stop = threading.Event()
+    
+    ########################
+    ##  pipeline_frames   ##
+    ##     FUNCTIONS      ##
+    ########################
+    def put(target, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    def get(source):
+        while not stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _STOP
+    
+    def start_stage(threads, source, work, target=None, target_threads=0):
+        '''
+         start 'threads' threads calling work(item) for all items
+         of 'source', the last one to finish stops the next stage
+        '''
+        running = [threads]
+        lock = threading.Lock()
+        def loop():
+            use_disk_cache(cache)
+            try:
+                while True:
+                    item = get(source)
+                    if item is _STOP:
+                        break
+                    work(item)
+            finally:
+                with lock:
+                    running[0] -= 1
+                    last = running[0] == 0
+                if last and target is not None:
+                    for _ in range(target_threads):
+                        put(target, _STOP)
+        for _ in range(threads):
+            threading.Thread(target=loop, daemon=True).start()
+    
+    def read(fname):
+        try:
+            read_ahead(fname)
+        except OSError:
+            # the conversion reports the error
+            pass
+        put(ready, fname)
+    
+    def convert(fname):
+        written = []
+        def write(outName, header, data):
+            chunks = encode_bruker_frame(header, data)
+            put(encoded, (fname, outName, chunks, frame_output(chunks)))
+            written.append(outName)
+        result = convert_frame_safe(conversion, fname, args, dict(kwargs, write=write))
+        # the writer reports written frames
+        if not (result and written):
+            results.put((fname, result))
+    
+    def write(job):
+        fname, outName, chunks, output = job
+        try:
+            with open(outName, 'wb') as brukerFrame:
+                brukerFrame.writelines(chunks)
+            results.put((fname, output))
+        except OSError as e:
+            logging.error('ERROR: Writing failed for {}: {}'.format(os.path.basename(outName), e))
+            results.put((fname, False))
+    
+    def feed():
+        try:
+            for fname in frames:
+                if stop.is_set():
+                    break
+                fed[0] += 1
+                put(todo, fname)
+        finally:
+            for _ in range(readers):
+                put(todo, _STOP)
+            feeding.clear()
+    ########################
+    ##  pipeline_frames   ##
+    ##   FUNCTIONS END    ##
+    ########################
+    
+    # number of frames fed, final once feeding is cleared
+    fed = [0]
+    feeding = threading.Event()
+    feeding.set()
+    threading.Thread(target=feed, daemon=True).start()
+    start_stage(readers, todo, read, ready, workers)
+    start_stage(workers, ready, convert, encoded, writers)
+    start_stage(writers, encoded, write)
+    try:
+        done = 0
+        while feeding.is_set() or done < fed[0]:
+            try:
+                item = results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            done += 1
+            yield item
+    finally:
+        stop.set()
+
+def convert_frames(frames, conversion, args, kwargs, workers=None, backend='thread', chunksize=None, depth=None):
+    '''
+     convert a list of frames using a pool of workers
+      - backend: 'thread', 'process' or 'pipeline'
+         - thread: one task per frame, shares the GIL
+         - process: persistent warm worker processes,
+           frames are submitted in chunks of 'chunksize'
+         - pipeline: reader, worker and writer threads connected
+           by bounded queues of 'depth' frames (see pipeline_frames)
+      - yields (fname, result) in order of completion
+      - result is False if the conversion failed or was skipped, else
+        the size and checksum of the written frame (see convert_frame_safe)
+    '''
+    if backend == 'thread':
+        # the threads keep the disk cache settings of the start
+        with ThreadPoolExecutor(max_workers=workers, initializer=use_disk_cache, initargs=(disk_cache_settings(),)) as pool:
+            futures = {pool.submit(convert_frame_safe, conversion, fname, args, kwargs):fname for fname in frames}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    elif backend == 'process':
+        pool = get_process_pool(workers)
+        # a few chunks per worker keep the load balanced
+        # while keeping the inter-process overhead small
+        if chunksize is None:
+            chunksize = max(1, min(16, len(frames) // (_PROCESS_POOL_WORKERS * 4)))
+        cache = disk_cache_settings()
+        futures = [pool.submit(convert_chunk, conversion, frames[i:i + chunksize], args, kwargs, cache) for i in range(0, len(frames), chunksize)]
+        for future in as_completed(futures):
+            for fname, result in future.result():
+                yield fname, result
+    elif backend == 'pipeline':
+        for fname, result in pipeline_frames(frames, conversion, args, kwargs, workers=workers, depth=depth):
+            yield fname, result
+    else:
+        raise ValueError('Unknown conversion backend: {}'.format(backend))
@@ -0,0 +1,148 @@
+import os
+import threading
+import collections
+
+##############################################
+##          Compressed frame files          ##
+##############################################
+def open_gz(fname):
+    import gzip
+    return gzip.open(fname, 'rb')
+
+def decompress_gz(data, size):
+    import zlib
+    # single member (the usual case), preallocated output
+    result = zlib.decompress(data, 31, size)
+    if len(result) < size:
+        import gzip
+        # multiple members
+        result = gzip.decompress(data)
+    return result
+
+def open_bz2(fname):
+    import bz2
+    return bz2.open(fname, 'rb')
+
+def decompress_bz2(data, size):
+    import bz2
+    return bz2.decompress(data)
+
+def open_xz(fname):
+    import lzma
+    return lzma.open(fname, 'rb')
+
+def decompress_xz(data, size):
+    import lzma
+    return lzma.decompress(data)
+
+def import_zstd():
+    '''
+     zstd is part of the standard library since Python 3.14,
+     the zstandard package is needed for older versions
+    '''
+    try:
+        from compression import zstd
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('Reading .zst files needs the zstandard package (pip install zstandard)')
+    return zstandard
+
+def open_zst(fname):
+    return import_zstd().open(fname, 'rb')
+
+def decompress_zst(data, size):
+    zstd = import_zstd()
+    if hasattr(zstd, 'ZstdDecompressor') and hasattr(zstd.ZstdDecompressor, 'copy_stream'):
+        # zstandard package
+        return zstd.ZstdDecompressor().decompress(data, max_output_size=size)
+    return zstd.decompress(data)
+
+#########################################
+##  Add new compression formats here!  ##
+#########################################
+# {extension: (open function, decompress function)}
+# - open(fname): returns a binary file object, used to
+#   decompress only the head of a file
+# - decompress(data, size): decompresses the whole file content,
+#   size is the expected decompressed size
+DECOMPRESSORS = {'.gz':(open_gz, decompress_gz),
+                 '.bz2':(open_bz2, decompress_bz2),
+                 '.xz':(open_xz, decompress_xz),
+                 '.zst':(open_zst, decompress_zst)}
+
+def compression_of(fname):
+    '''
+     return the compression extension of 'fname'
+     or None if the file is not compressed
+    '''
+    ext = os.path.splitext(fname)[1].lower()
+    if ext in DECOMPRESSORS:
+        return ext
+    return None
+
+def open_decompressed(fname):
+    '''
+     open a (compressed) file for reading
+      - uncompressed files are opened as they are
+    '''
+    ext = compression_of(fname)
+    if ext is None:
+        return open(fname, 'rb')
+    return DECOMPRESSORS[ext][0](fname)
+
+def read_decompressed(fname, size):
+    '''
+     read and decompress a (compressed) file in one go
+      - size: the expected decompressed size, the output
+        buffer is allocated once at that size (gz)
+      - zlib, bz2, lzma and zstd release the GIL while decompressing,
+        frames are decompressed in parallel by worker threads
+      - returns bytes
+    '''
+    with open(fname, 'rb') as f:
+        data = f.read()
+    ext = compression_of(fname)
+    if ext is None:
+        return data
+    return DECOMPRESSORS[ext][1](data, size)
+
+# decompressed file heads: {path: ((mtime, size), bytes)}
+_HEAD_CACHE = collections.OrderedDict()
+_HEAD_CACHE_LOCK = threading.Lock()
+_HEAD_CACHE_SIZE = 256
+_HEAD_SIZE = 4096
+
+def read_head(fname, size=_HEAD_SIZE):
+    '''
+     read the first 'size' bytes of a (compressed) file
+      - only the head of the file is decompressed
+      - heads of up to 4096 bytes are cached, keyed by path,
+        mtime and size, sniffing the format and reading the
+        collection date decompress a frame only once
+    '''
+    if size > _HEAD_SIZE:
+        with open_decompressed(fname) as f:
+            return f.read(size)
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _HEAD_CACHE_LOCK:
+        cached = _HEAD_CACHE.get(fname)
+        if cached is not None and cached[0] == key:
+            _HEAD_CACHE.move_to_end(fname)
+            return cached[1][:size]
+    with open_decompressed(fname) as f:
+        head = f.read(_HEAD_SIZE)
+    with _HEAD_CACHE_LOCK:
+        _HEAD_CACHE[fname] = (key, head)
+        _HEAD_CACHE.move_to_end(fname)
+        while len(_HEAD_CACHE) > _HEAD_CACHE_SIZE:
+            _HEAD_CACHE.popitem(last=False)
+    return head[:size]
+##############################################
+##        END Compressed frame files        ##
+##############################################
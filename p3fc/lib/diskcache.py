@@ -0,0 +1,193 @@
+import os
+import hashlib
+import logging
+import functools
+import threading
+
+##############################################
+##        On-disk decoded frame cache       ##
+##############################################
+# decoded frames are stored as .npy (data) and .hdr (raw header)
+# and memory mapped on a hit, the cache is enabled through the
+# environment, a conversion takes the settings it started with
+# to its threads and worker processes (see use_disk_cache)
+DISK_CACHE_ENV = 'P3FC_FRAME_CACHE'
+DISK_CACHE_SIZE_ENV = 'P3FC_FRAME_CACHE_SIZE'
+DISK_CACHE_NAME = '.p3fc_frames'
+DISK_CACHE_BYTES = 8 * 2**30
+
+# settings of a thread, see use_disk_cache
+_THREAD_SETTINGS = threading.local()
+
+# cached directory sizes: {path: bytes}, per process
+_DISK_USAGE = {}
+_DISK_USAGE_LOCK = threading.Lock()
+
+def disk_cache_path(path_output):
+    '''
+     default cache directory of a dataset: output directory/.p3fc_frames
+    '''
+    return os.path.join(os.path.abspath(path_output), DISK_CACHE_NAME)
+
+def enable_disk_cache(path, max_bytes=DISK_CACHE_BYTES):
+    '''
+     cache decoded frames in directory 'path'
+      - max_bytes: size cap, the least recently used
+        frames are removed once it is exceeded
+    '''
+    os.environ[DISK_CACHE_ENV] = os.path.abspath(path)
+    os.environ[DISK_CACHE_SIZE_ENV] = str(int(max_bytes))
+
+def disable_disk_cache():
+    os.environ.pop(DISK_CACHE_ENV, None)
+    os.environ.pop(DISK_CACHE_SIZE_ENV, None)
+
+def disk_cache_dir():
+    '''
+     the active cache directory, None if disabled
+    '''
+    return os.environ.get(DISK_CACHE_ENV) or None
+
+def disk_cache_settings():
+    '''
+     the cache settings of this process: (path, max_bytes)
+     or None if disabled, see use_disk_cache
+    '''
+    path = disk_cache_dir()
+    if path is None:
+        return None
+    return path, int(os.environ.get(DISK_CACHE_SIZE_ENV, DISK_CACHE_BYTES))
+
+def use_disk_cache(settings):
+    '''
+     the calling thread uses the settings of disk_cache_settings
+     from now on, whatever the process settings are changed to,
+     e.g. a conversion while the GUI opens another directory
+    '''
+    _THREAD_SETTINGS.settings = settings
+
+def _active_settings():
+    # the settings of the thread, else those of the process
+    try:
+        return _THREAD_SETTINGS.settings
+    except AttributeError:
+        return disk_cache_settings()
+
+def _cache_key(fname, stat, read):
+    # the read arguments (frame info) are fixed by the format
+    key = '\0'.join([os.path.abspath(fname), str(stat.st_mtime_ns), str(stat.st_size), read.__name__])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def _disk_usage(path):
+    '''
+     size of the cache directory, scanned once per process
+    '''
+    with _DISK_USAGE_LOCK:
+        if path not in _DISK_USAGE:
+            total = 0
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        total += entry.stat().st_size
+            _DISK_USAGE[path] = total
+        return _DISK_USAGE[path]
+
+def _add_usage(path, nbytes):
+    with _DISK_USAGE_LOCK:
+        if path in _DISK_USAGE:
+            _DISK_USAGE[path] += nbytes
+
+def evict(path, max_bytes):
+    '''
+     remove the least recently used frames (oldest mtime,
+     a hit touches the file) until the cache is at 90% of
+     'max_bytes', other processes may evict concurrently
+    '''
+    frames = []
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+            if entry.name.endswith('.npy'):
+                head = entry.path[:-4] + '.hdr'
+                size = stat.st_size + (os.path.getsize(head) if os.path.exists(head) else 0)
+                frames.append((stat.st_mtime_ns, entry.path, head, size))
+    frames.sort()
+    for _, data, head, size in frames:
+        if total <= 0.9 * max_bytes:
+            break
+        for name in (data, head):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+        total -= size
+    with _DISK_USAGE_LOCK:
+        _DISK_USAGE[path] = total
+
+def cached_read(path, max_bytes, read, fname, *args, dtype=None):
+    '''
+     read(fname, *args) through the cache in directory 'path'
+      - keyed by source path, mtime, size and read function
+      - a hit memory maps the stored array (read-only)
+      - a miss decodes the frame and stores it, written to
+        a temporary name and renamed, never seen half written
+      - dtype: the frames are stored and returned as dtype
+      - returns header, data like the read function
+    '''
+    import numpy as np
+    stat = os.stat(fname)
+    base = os.path.join(path, _cache_key(fname, stat, read))
+    try:
+        data = np.load(base + '.npy', mmap_mode='r')
+        with open(base + '.hdr', 'rb') as f:
+            header = f.read()
+        os.utime(base + '.npy')
+        return header, data
+    except (OSError, ValueError, EOFError):
+        pass
+    header, data = read(fname, *args)
+    if dtype is not None:
+        data = data.astype(dtype, copy=False)
+    try:
+        os.makedirs(path, exist_ok=True)
+        tmp = '{}.{}.{}'.format(base, os.getpid(), threading.get_ident())
+        with open(tmp + '.hdr', 'wb') as f:
+            f.write(header)
+        with open(tmp + '.npy', 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp + '.hdr', base + '.hdr')
+        os.replace(tmp + '.npy', base + '.npy')
+        _add_usage(path, len(header) + os.path.getsize(base + '.npy'))
+        if _disk_usage(path) > max_bytes:
+            evict(path, max_bytes)
+    except OSError as e:
+        logging.warning('WARNING: Caching {} failed: {}'.format(os.path.basename(fname), e))
+    return header, data
+
+def disk_cached(read=None, dtype=None):
+    '''
+     decorator: the frame read function 'read' hits the
+     disk cache if it is enabled (see enable_disk_cache)
+      - dtype: the dtype of the format (see formats.py) if
+        the read function returns a wider one
+    '''
+    if read is None:
+        return functools.partial(disk_cached, dtype=dtype)
+    @functools.wraps(read)
+    def wrapper(fname, *args):
+        settings = _active_settings()
+        if settings is None:
+            return read(fname, *args)
+        path, max_bytes = settings
+        return cached_read(path, max_bytes, read, fname, *args, dtype=dtype)
+    return wrapper
+##############################################
+##      END On-disk decoded frame cache     ##
+##############################################
@@ -0,0 +1,270 @@
+import os
+import re
+import fnmatch
+import threading
+import collections
+import numpy as np
+from p3fc.lib.utility import read_pilatus_cbf, read_pilatus_tif, read_pilatus_tif_gz, get_run_info
+from p3fc.lib.decompress import DECOMPRESSORS, compression_of, read_head
+
+##############################################
+##         Frame Format definitions         ##
+##############################################
+# A frame format is identified by
+#  - the file extension(s), compressed frames end on
+#    the extension plus a compression extension, e.g. .tif.gz
+#  - magic bytes the (decompressed) file starts with
+#  - a header signature (regular expression on the head)
+# 'info' holds the format info of all frames of the format:
+#  - 'info':     Frame info (rows, cols, offset, dtype)
+#  - 'read':     Frame read function (from utility)
+#  - 'rotate':   rotate the frame upon conversion?
+#  - 'detector': detector type for SAINT
+FrameFormat = collections.namedtuple('FrameFormat', ['site',          # Facility identifier
+                                                     'extensions',    # tuple of file extensions
+                                                     'magic',         # tuple of magic bytes, one has to match
+                                                     'signature',     # compiled regular expression (bytes)
+                                                     'info'])         # format info dict
+
+# magic bytes
+_MAGIC_TIF = (b'II*\x00', b'MM\x00*')
+_MAGIC_CBF = (b'###CBF',)
+
+# compressed tif: .tif.gz, .tif.bz2, ...
+_COMPRESSED_TIF = tuple('.tif' + ext for ext in DECOMPRESSORS)
+
+#########################################
+##  Add new format identifiers here!   ##
+#########################################
+# the first matching format is used
+AVAILABLE_FORMATS = [FrameFormat(site='SP8',
+                                 extensions=('.tif',),
+                                 magic=_MAGIC_TIF,
+                                 signature=re.compile(rb'S/N\s+10-0163'),
+                                 info={'info':(1043, 981, 4096, np.int32),
+                                       'read':read_pilatus_tif,
+                                       'rotate':True,
+                                       'detector':'PILATUS'}),
+                     FrameFormat(site='SP8_gz',
+                                 extensions=_COMPRESSED_TIF,
+                                 magic=_MAGIC_TIF,
+                                 signature=re.compile(rb'S/N\s+10-0163'),
+                                 info={'info':(1043, 981, 4096, np.int32),
+                                       'read':read_pilatus_tif_gz,
+                                       'rotate':True,
+                                       'detector':'PILATUS'}),
+                     FrameFormat(site='APS',
+                                 extensions=('.tif',),
+                                 magic=_MAGIC_TIF,
+                                 signature=re.compile(rb'S/N\s+10-0147'),
+                                 info={'info':(1043, 981, 4096, np.int32),
+                                       'read':read_pilatus_tif,
+                                       'rotate':True,
+                                       'detector':'PILATUS'}),
+                     FrameFormat(site='DLS',
+                                 extensions=('.cbf',),
+                                 magic=_MAGIC_CBF,
+                                 signature=re.compile(rb'_diffrn.id\s+DLS_I19-1\s'),
+                                 info={'info':(1679, 1475, 0, np.int32),
+                                       'read':read_pilatus_cbf,
+                                       'rotate':False,
+                                       'detector':'PILATUS'})]
+
+# Frame name patterns to search for
+# - extended by the formats of installed plugins
+FRAME_PATTERNS = ['*_*' + ext for ext in ('.tif', '.cbf') + _COMPRESSED_TIF]
+
+# third-party formats: entry points of the 'p3fc.formats' group,
+# returning a FrameFormat or a list of them, loaded on first use
+PLUGIN_GROUP = 'p3fc.formats'
+_PLUGINS_LOADED = False
+_PLUGINS_LOCK = threading.Lock()
+
+def register_format(fmt):
+    '''
+     add a FrameFormat to the registry
+      - its frame name patterns are added to FRAME_PATTERNS
+    '''
+    AVAILABLE_FORMATS.append(fmt)
+    for ext in fmt.extensions:
+        pattern = '*_*' + ext
+        if pattern not in FRAME_PATTERNS:
+            FRAME_PATTERNS.append(pattern)
+
+def load_plugins():
+    '''
+     register the formats of installed plugins, once
+      - a plugin failing to load is skipped
+    '''
+    global _PLUGINS_LOADED
+    with _PLUGINS_LOCK:
+        if _PLUGINS_LOADED:
+            return
+        _PLUGINS_LOADED = True
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return
+        try:
+            plugins = entry_points(group=PLUGIN_GROUP)
+        except TypeError:
+            # Python < 3.10
+            plugins = entry_points().get(PLUGIN_GROUP, [])
+        for plugin in plugins:
+            try:
+                formats = plugin.load()
+            except Exception as e:
+                import logging
+                logging.warning('WARNING: Frame format plugin {} failed to load: {}'.format(plugin.name, e))
+                continue
+            if isinstance(formats, FrameFormat):
+                formats = [formats]
+            for fmt in formats:
+                register_format(fmt)
+
+def list_frames(path, patterns=FRAME_PATTERNS):
+    '''
+     List all frames in a directory
+      - matches the file names against 'patterns'
+      - returns a sorted list of absolute paths
+    '''
+    # plugins extend FRAME_PATTERNS
+    load_plugins()
+    path = os.path.abspath(path)
+    with os.scandir(path) as entries:
+        frames = [entry.path for entry in entries if entry.is_file() and any(fnmatch.fnmatch(entry.name, p) for p in patterns)]
+    return sorted(frames)
+
+# directory listings: {(path, patterns): (mtime, frames)}
+_LISTING_CACHE = collections.OrderedDict()
+_LISTING_CACHE_LOCK = threading.Lock()
+_LISTING_CACHE_SIZE = 256
+
+def scan_frames(path, patterns=FRAME_PATTERNS, chunk=1000):
+    '''
+     List the frames of a directory in chunks
+      - yields lists of (unsorted) absolute paths while
+        os.scandir proceeds, e.g. to report the progress
+      - the listing is cached keyed by the directory mtime,
+        an unchanged directory yields the cached list at once
+      - directories changed within the last 2 s are not
+        cached (coarse mtime resolution, e.g. NFS)
+    '''
+    import time
+    load_plugins()
+    path = os.path.abspath(path)
+    key = (path, tuple(patterns))
+    mtime = os.stat(path).st_mtime_ns
+    with _LISTING_CACHE_LOCK:
+        cached = _LISTING_CACHE.get(key)
+        if cached is not None and cached[0] == mtime:
+            _LISTING_CACHE.move_to_end(key)
+            frames = cached[1]
+        else:
+            frames = None
+    if frames is not None:
+        yield list(frames)
+        return
+    frames = []
+    batch = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file() and any(fnmatch.fnmatch(entry.name, p) for p in patterns):
+                batch.append(entry.path)
+                if len(batch) >= chunk:
+                    frames.extend(batch)
+                    yield batch
+                    batch = []
+    frames.extend(batch)
+    yield batch
+    if time.time() - mtime / 1e9 > 2.0:
+        with _LISTING_CACHE_LOCK:
+            _LISTING_CACHE[key] = (mtime, sorted(frames))
+            while len(_LISTING_CACHE) > _LISTING_CACHE_SIZE:
+                _LISTING_CACHE.popitem(last=False)
+
+def split_frame_name(fname):
+    '''
+     split a frame name: any_name_rr_ffff.ext(.gz)
+      - returns basename, extension (incl. compression)
+    '''
+    name = os.path.basename(fname)
+    compression = compression_of(name) or ''
+    if compression:
+        name = name[:-len(compression)]
+    bname, ext = os.path.splitext(name)
+    return bname, ext + compression
+
+def sniff_format(fname):
+    '''
+     find the FrameFormat of a frame
+      - the head of the frame is read once (decompressed, cached
+        see decompress.read_head) and checked against the extension,
+        magic bytes and header signature of all formats
+      - returns None if the format is unknown
+    '''
+    _, ext = split_frame_name(fname)
+    candidates = [fmt for fmt in AVAILABLE_FORMATS if ext in fmt.extensions]
+    if not candidates:
+        return None
+    try:
+        head = read_head(fname)
+    except (OSError, EOFError):
+        return None
+    for fmt in candidates:
+        if fmt.magic and not head.startswith(fmt.magic):
+            continue
+        if fmt.signature is not None and fmt.signature.search(head) is None:
+            continue
+        return fmt
+    return None
+
+# sniffed formats: {(directory, stem, run, extension): FrameFormat}
+_FORMAT_CACHE = collections.OrderedDict()
+_FORMAT_CACHE_LOCK = threading.Lock()
+_FORMAT_CACHE_SIZE = 1024
+
+def detect_format(fname):
+    '''
+     Check the frame against all known formats
+      - the format is sniffed once per directory and run,
+        the other frames of a run only need their names
+      - returns the format info dict of the first match:
+         'run':   Run number
+         'stem':  Frame name up to the run number
+         'start': Number indicating start of a run
+         'site':  Facility identifier
+         and the FrameFormat info: 'info', 'read', 'rotate', 'detector'
+      - returns None if the format is unknown
+    '''
+    bname, ext = split_frame_name(fname)
+    try:
+        fstm, rnum, fnum, flen = get_run_info(bname)
+    except (ValueError, IndexError):
+        return None
+    key = (os.path.dirname(os.path.abspath(fname)), fstm, rnum, ext)
+    with _FORMAT_CACHE_LOCK:
+        fmt = _FORMAT_CACHE.get(key)
+        if fmt is not None:
+            _FORMAT_CACHE.move_to_end(key)
+    if fmt is None:
+        load_plugins()
+        fmt = sniff_format(fname)
+        if fmt is None:
+            return None
+        with _FORMAT_CACHE_LOCK:
+            _FORMAT_CACHE[key] = fmt
+            while len(_FORMAT_CACHE) > _FORMAT_CACHE_SIZE:
+                _FORMAT_CACHE.popitem(last=False)
+    ########################################
+    ## USE FNUM TO DEFINE START OF RUN!!! ##
+    ########################################
+    result = {'run':rnum,
+              'stem':fstm,
+              'start':'{:>0{w}}.'.format(1, w=flen),
+              'site':fmt.site}
+    result.update(fmt.info)
+    return result
+##############################################
+##       END Frame Format definitions       ##
+##############################################
@@ -0,0 +1,211 @@
+import os
+import logging
+import threading
+import collections
+import numpy as np
+from p3fc.lib.formats import detect_format
+
+##############################################
+##           Decoded frame cache            ##
+##############################################
+# default memory limit of the cache, ~20 DLS or
+# ~50 SP8/APS frames (int32 and display buffer)
+FRAME_CACHE_BYTES = 256 * 2**20
+
+# display buffer: uint8 index of a 256 entry lookup table,
+# index = intensity - DISPLAY_MIN, clipped to [0, 255]
+# the contrast (levels [DISPLAY_MIN, 1 ... 100]) is part of the
+# lookup table, changing it never touches the pixels
+DISPLAY_MIN = -2
+
+def load_frame(fname):
+    '''
+     read and decode a frame for display
+      - the format is detected (see formats.detect_format)
+      - rotated if the format asks for it
+      - returns a C-contiguous, read-only array, independent
+        of the file (tif frames are memory mapped)
+      - raises ValueError if the format is unknown
+    '''
+    fmt = detect_format(fname)
+    if fmt is None:
+        raise ValueError('Unknown frame format: {}'.format(os.path.basename(fname)))
+    _, data = fmt['read'](fname, *fmt['info'])
+    if fmt['rotate']:
+        data = np.rot90(data, k=1, axes=(1, 0))
+    data = np.ascontiguousarray(data)
+    data.setflags(write=False)
+    return data
+
+def display_buffer(data, flip=False):
+    '''
+     the contiguous uint8 display buffer of a frame
+      - flipped upside down if 'flip'
+      - shown through a lookup table (see display_lut)
+    '''
+    if flip:
+        data = data[::-1]
+    buffer = np.empty(data.shape, np.uint8)
+    np.subtract(np.clip(data, DISPLAY_MIN, DISPLAY_MIN + 255), DISPLAY_MIN, out=buffer, casting='unsafe')
+    return buffer
+
+def display_lut(cmap, level):
+    '''
+     lookup table of the display buffer for levels [DISPLAY_MIN, level]
+      - cmap: pyqtgraph ColorMap
+      - returns a (256, 3) uint8 array
+    '''
+    position = np.clip(np.arange(256) / float(level - DISPLAY_MIN), 0.0, 1.0)
+    return np.ascontiguousarray(cmap.map(position, mode='byte')[:, :3])
+
+class FrameCache(object):
+    '''
+     Memory-bounded LRU cache of decoded frames
+      - frames are decoded by load_frame and keyed by path,
+        an entry is valid as long as mtime and size match
+      - the least recently used frames are evicted once
+        the cached frames exceed 'max_bytes'
+      - the display buffers (see display_buffer) of a frame
+        are kept with it and count towards 'max_bytes'
+      - prefetch() decodes frames ahead of time in a worker
+        thread, a frame is never decoded twice at the same time
+    '''
+    def __init__(self, max_bytes=FRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        # {path: ((mtime, size), array, {flip: display buffer})}
+        self._frames = collections.OrderedDict()
+        # frames being decoded: {path: threading.Event}
+        self._loading = {}
+        self._lock = threading.Lock()
+        # prefetch requests, replaced by each prefetch() call
+        self._pending = []
+        self._wanted = threading.Condition()
+        self._worker = None
+        self._closed = False
+
+    def __contains__(self, fname):
+        with self._lock:
+            return os.path.abspath(fname) in self._frames
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, fname):
+        '''
+         the decoded frame, from the cache if possible
+          - waits for the worker if it is decoding the frame
+        '''
+        fname = os.path.abspath(fname)
+        while True:
+            stat = os.stat(fname)
+            key = (stat.st_mtime_ns, stat.st_size)
+            with self._lock:
+                cached = self._frames.get(fname)
+                if cached is not None and cached[0] == key:
+                    self._frames.move_to_end(fname)
+                    return cached[1]
+                loading = self._loading.get(fname)
+                if loading is None:
+                    loading = self._loading[fname] = threading.Event()
+                    break
+            # decoded by another thread, check again
+            loading.wait()
+        try:
+            data = load_frame(fname)
+            self._store(fname, key, data)
+        finally:
+            with self._lock:
+                del self._loading[fname]
+            loading.set()
+        return data
+
+    def display(self, fname, flip=False):
+        '''
+         the frame and its display buffer (see display_buffer)
+          - flipped upside down if 'flip'
+          - returns frame, buffer
+        '''
+        data = self.get(fname)
+        fname = os.path.abspath(fname)
+        with self._lock:
+            cached = self._frames.get(fname)
+            buffer = cached[2].get(flip) if cached is not None and cached[1] is data else None
+        if buffer is None:
+            buffer = display_buffer(data, flip)
+            with self._lock:
+                cached = self._frames.get(fname)
+                if cached is not None and cached[1] is data and flip not in cached[2]:
+                    cached[2][flip] = buffer
+                    self.nbytes += buffer.nbytes
+                    self._evict()
+        if flip:
+            data = data[::-1]
+        return data, buffer
+
+    @staticmethod
+    def _entry_bytes(entry):
+        return entry[1].nbytes + sum(buffer.nbytes for buffer in entry[2].values())
+
+    def _evict(self):
+        # the most recent frame stays
+        while self.nbytes > self.max_bytes and len(self._frames) > 1:
+            _, evicted = self._frames.popitem(last=False)
+            self.nbytes -= self._entry_bytes(evicted)
+
+    def _store(self, fname, key, data):
+        if data.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._frames.pop(fname, None)
+            if old is not None:
+                self.nbytes -= self._entry_bytes(old)
+            self._frames[fname] = (key, data, {})
+            self.nbytes += data.nbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def prefetch(self, frames, flip=False):
+        '''
+         decode 'frames' and prepare their display buffers
+         in the worker thread, in the given order
+          - pending requests of an earlier call are dropped,
+            the user already moved on
+        '''
+        with self._wanted:
+            if self._closed:
+                return
+            self._pending = [(os.path.abspath(f), flip) for f in frames]
+            self._wanted.notify()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._prefetch, daemon=True)
+                self._worker.start()
+
+    def _prefetch(self):
+        while True:
+            with self._wanted:
+                while not self._pending and not self._closed:
+                    self._wanted.wait()
+                if self._closed:
+                    return
+                fname, flip = self._pending.pop(0)
+            try:
+                self.display(fname, flip)
+            except (OSError, ValueError, EOFError) as e:
+                logging.debug('Prefetching {} failed: {}'.format(os.path.basename(fname), e))
+
+    def close(self):
+        '''
+         stop the prefetch worker
+        '''
+        with self._wanted:
+            self._closed = True
+            self._pending = []
+            self._wanted.notify()
+##############################################
+##         END Decoded frame cache          ##
+##############################################
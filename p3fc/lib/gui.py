@@ -149,6 +149,14 @@ class Ui_MainWindow(object):
         self.cb_mask_fname.setFrame(True)
         self.cb_mask_fname.setObjectName("cb_mask_fname")
         self.horizontalLayout_4.addWidget(self.cb_mask_fname)
+        self.cb_mask_image = QtWidgets.QComboBox(parent=self.gb_mask_top)
+        self.cb_mask_image.setSizeAdjustPolicy(QtWidgets.QComboBox.SizeAdjustPolicy.AdjustToContents)
+        self.cb_mask_image.setObjectName("cb_mask_image")
+        self.cb_mask_image.addItem("")
+        self.cb_mask_image.addItem("")
+        self.cb_mask_image.addItem("")
+        self.cb_mask_image.addItem("")
+        self.horizontalLayout_4.addWidget(self.cb_mask_image)
         spacerItem1 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Policy.Expanding, QtWidgets.QSizePolicy.Policy.Minimum)
         self.horizontalLayout_4.addItem(spacerItem1)
         self.verticalLayout_2.addWidget(self.gb_mask_top)
@@ -278,6 +286,8 @@ class Ui_MainWindow(object):
         self.actionAddRect.setObjectName("actionAddRect")
         self.action_rem_circle = QtGui.QAction(parent=MainWindow)
         self.action_rem_circle.setObjectName("action_rem_circle")
+        self.action_propose_mask = QtGui.QAction(parent=MainWindow)
+        self.action_propose_mask.setObjectName("action_propose_mask")
         self.actionRemRect = QtGui.QAction(parent=MainWindow)
         self.actionRemRect.setObjectName("actionRemRect")
         self.actionSave_npy = QtGui.QAction(parent=MainWindow)
@@ -318,18 +328,44 @@ class Ui_MainWindow(object):
         self.action_flip_image.setCheckable(True)
         self.action_flip_image.setChecked(False)
         self.action_flip_image.setObjectName("action_flip_image")
+        self.action_show_overlay = QtGui.QAction(parent=MainWindow)
+        self.action_show_overlay.setCheckable(True)
+        self.action_show_overlay.setChecked(True)
+        self.action_show_overlay.setObjectName("action_show_overlay")
+        self.action_use_processes = QtGui.QAction(parent=MainWindow)
+        self.action_use_processes.setCheckable(True)
+        self.action_use_processes.setChecked(False)
+        self.action_use_processes.setObjectName("action_use_processes")
+        self.action_watch_input = QtGui.QAction(parent=MainWindow)
+        self.action_watch_input.setCheckable(True)
+        self.action_watch_input.setChecked(False)
+        self.action_watch_input.setObjectName("action_watch_input")
+        self.action_disk_cache = QtGui.QAction(parent=MainWindow)
+        self.action_disk_cache.setCheckable(True)
+        self.action_disk_cache.setChecked(False)
+        self.action_disk_cache.setObjectName("action_disk_cache")
+        self.action_batch_convert = QtGui.QAction(parent=MainWindow)
+        self.action_batch_convert.setObjectName("action_batch_convert")
         self.menu_mask.addAction(self.action_add_circle)
         self.menu_mask.addAction(self.action_rem_circle)
+        self.menu_mask.addAction(self.action_propose_mask)
         self.menu_mask.addSeparator()
         self.menu_mask.addAction(self.action_write_bruker_sfrm)
         self.menu_mask.addAction(self.action_write_numpy_npy)
         self.menu_mask.addSeparator()
         self.menu_mask.addAction(self.action_use_padding)
         self.menu_mask.addAction(self.action_flip_image)
+        self.menu_mask.addAction(self.action_show_overlay)
         self.menu_mask.addSeparator()
         self.menu_mask.addAction(self.action_show_matplotlib)
         self.menu_options.addAction(self.action_set_wavelength)
         self.menu_options.addAction(self.action_set_twotheta)
+        self.menu_options.addSeparator()
+        self.menu_options.addAction(self.action_use_processes)
+        self.menu_options.addAction(self.action_watch_input)
+        self.menu_options.addAction(self.action_disk_cache)
+        self.menu_options.addSeparator()
+        self.menu_options.addAction(self.action_batch_convert)
         self.menubar.addAction(self.menu_options.menuAction())
         self.menubar.addAction(self.menu_mask.menuAction())
 
@@ -347,6 +383,10 @@ class Ui_MainWindow(object):
         self.label_2.setText(_translate("MainWindow", "Output Directory"))
         self.tb_convert.setText(_translate("MainWindow", "Convert 0 Image(s)"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.Image_Conversion), _translate("MainWindow", "Image Conversion"))
+        self.cb_mask_image.setItemText(0, _translate("MainWindow", "Frame"))
+        self.cb_mask_image.setItemText(1, _translate("MainWindow", "Maximum"))
+        self.cb_mask_image.setItemText(2, _translate("MainWindow", "Mean"))
+        self.cb_mask_image.setItemText(3, _translate("MainWindow", "Sum"))
         self.tb_mask_reset.setText(_translate("MainWindow", "Reset Mask"))
         self.label_4.setText(_translate("MainWindow", "Intensity:"))
         self.tb_mask_save.setText(_translate("MainWindow", "Save Mask"))
@@ -358,6 +398,7 @@ class Ui_MainWindow(object):
         self.action_add_circle.setText(_translate("MainWindow", "Add Circle"))
         self.actionAddRect.setText(_translate("MainWindow", "Rectangle"))
         self.action_rem_circle.setText(_translate("MainWindow", "Remove Circle"))
+        self.action_propose_mask.setText(_translate("MainWindow", "Propose Mask"))
         self.actionRemRect.setText(_translate("MainWindow", "Rectangle"))
         self.actionSave_npy.setText(_translate("MainWindow", "Save npy"))
         self.action_show_matplotlib.setText(_translate("MainWindow", "Show Matplotlib"))
@@ -370,4 +411,9 @@ class Ui_MainWindow(object):
         self.actionSet_Distance.setText(_translate("MainWindow", "Set Distance"))
         self.action_reset_patches.setText(_translate("MainWindow", "Reset Patches"))
         self.action_flip_image.setText(_translate("MainWindow", "Flip Image"))
+        self.action_show_overlay.setText(_translate("MainWindow", "Show Masked Pixels"))
+        self.action_use_processes.setText(_translate("MainWindow", "Convert using Processes"))
+        self.action_watch_input.setText(_translate("MainWindow", "Watch Input Directory"))
+        self.action_disk_cache.setText(_translate("MainWindow", "Cache Decoded Frames"))
+        self.action_batch_convert.setText(_translate("MainWindow", "Batch Conversion..."))
 from pyqtgraph import GraphicsLayoutWidget
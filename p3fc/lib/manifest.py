@@ -0,0 +1,236 @@
+import os
+import json
+import zlib
+import hashlib
+import collections
+from p3fc.lib.utility import get_sfrm_name
+from p3fc.lib.catalog import frame_name_info
+
+##############################################
+##           Conversion manifest            ##
+##############################################
+# stored in the output directory
+MANIFEST_NAME = '.p3fc_manifest.json'
+# records since the last save, one json line per frame
+MANIFEST_JOURNAL = '.p3fc_manifest.journal'
+MANIFEST_VERSION = 1
+
+# tables of the whole dataset, a frame only gets the value of its run
+RUN_TABLES = ('nframes', 'beamflux')
+
+# fingerprint of the settings and the tables (see frame_options)
+ConversionOptions = collections.namedtuple('ConversionOptions', ['fingerprint', 'nframes', 'beamflux'])
+
+def conversion_options(conversion, args, kwargs):
+    '''
+     fingerprint of the conversion settings
+      - a frame converted with different settings (e.g. tth_corr
+        or source_w) is converted again
+      - 'overwrite' and 'write' do not change the output
+      - the run tables (RUN_TABLES) are kept apart, a frame
+        added to a run must not change the other runs
+    '''
+    options = {k:v for k, v in kwargs.items() if k not in ('overwrite', 'write') + RUN_TABLES}
+    setting = json.dumps([conversion.__name__, [os.path.abspath(a) if isinstance(a, str) else a for a in args], options],
+                         sort_keys=True, default=str)
+    return ConversionOptions(hashlib.sha1(setting.encode()).hexdigest(), kwargs.get('nframes'), kwargs.get('beamflux'))
+
+def frame_options(options, fname):
+    '''
+     options of a frame: the fingerprint and the values of the
+     run tables the frame gets (NFRAMES of its run, its flux)
+    '''
+    if options.nframes is None and options.beamflux is None:
+        return options.fingerprint
+    stem, run, frame = frame_name_info(os.path.basename(fname))
+    values = [None, None]
+    if options.nframes is not None:
+        values[0] = options.nframes.get(stem, {}).get(run)
+    if options.beamflux is not None and frame is not None:
+        flux = options.beamflux.get(run, [])
+        if 0 < frame <= len(flux):
+            values[1] = flux[frame - 1]
+    return '{}:{}:{}'.format(options.fingerprint, *values)
+
+def file_checksum(fname):
+    '''
+     crc32 of a file
+    '''
+    crc = 0
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+# size and crc32 of a written frame
+FrameOutput = collections.namedtuple('FrameOutput', ['size', 'checksum'])
+
+def frame_output(chunks):
+    '''
+     size and crc32 of an encoded frame (see utility.encode_bruker_frame)
+      - computed by the conversion workers from the bytes they
+        write, the output is not read again to record it
+    '''
+    size, crc = 0, 0
+    for chunk in chunks:
+        size += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+    return FrameOutput(size, crc)
+
+class Manifest(object):
+    '''
+     Record of the converted frames of an output directory
+      - source path: size, mtime, conversion options,
+        output name, output size and output checksum
+      - a frame is only recorded after its output was written
+        completely, a frame that was interrupted (crash, kill)
+        is not recorded and converted again
+      - loaded once, the output directory is listed once with
+        a single scandir instead of a stat per frame
+      - new records are appended to the journal (flush), the
+        manifest is only rewritten once by save (compact)
+    '''
+    def __init__(self, path_output):
+        self.path = os.path.join(os.path.abspath(path_output), MANIFEST_NAME)
+        self.path_output = os.path.dirname(self.path)
+        self.journal = os.path.join(self.path_output, MANIFEST_JOURNAL)
+        self.frames = {}
+        self.changed = 0
+        self.journaled = False
+        self.new = []
+        try:
+            with open(self.path) as ofile:
+                manifest = json.load(ofile)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.frames = manifest['frames']
+        except (OSError, ValueError, KeyError):
+            pass
+        self.replay()
+
+    def replay(self):
+        '''
+         add the records of the journal (not saved yet, e.g. the
+         conversion was killed), a torn last line is skipped
+        '''
+        try:
+            with open(self.journal) as ofile:
+                for line in ofile:
+                    try:
+                        fname, entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.frames[fname] = entry
+        except OSError:
+            return
+        self.journaled = True
+
+    def list_output(self):
+        '''
+         {name: size} of all files in the output directory
+        '''
+        try:
+            with os.scandir(self.path_output) as entries:
+                return {entry.name:entry.stat().st_size for entry in entries if entry.is_file()}
+        except FileNotFoundError:
+            return {}
+
+    def pending(self, frames, options, verify=False, overwrite=True):
+        '''
+         frames that need to be converted:
+          - new frames or frames that changed (size, mtime)
+          - frames converted with different options
+          - frames whose output is missing or has the wrong size
+          - verify: compare the output checksums as well
+          - overwrite: False keeps existing outputs of frames
+            that are not recorded (e.g. converted before)
+        '''
+        outputs = self.list_output()
+        todo = []
+        for fname in frames:
+            fname = os.path.abspath(fname)
+            entry = self.frames.get(fname)
+            if entry is None:
+                if overwrite or get_sfrm_name(fname) not in outputs:
+                    todo.append(fname)
+                continue
+            if entry['options'] != frame_options(options, fname):
+                todo.append(fname)
+                continue
+            stat = os.stat(fname)
+            if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+                todo.append(fname)
+                continue
+            if outputs.get(entry['output']) != entry['output_size']:
+                todo.append(fname)
+                continue
+            if verify and file_checksum(os.path.join(self.path_output, entry['output'])) != entry['checksum']:
+                todo.append(fname)
+        return todo
+
+    def missing(self, frames):
+        '''
+         frames without output, existing ones are skipped
+         (not overwritten) instead of failing the conversion
+        '''
+        outputs = self.list_output()
+        return [os.path.abspath(fname) for fname in frames if get_sfrm_name(fname) not in outputs]
+
+    def record(self, fname, options, written=None):
+        '''
+         record a successfully converted frame
+          - written: FrameOutput of the frame (see frame_output),
+            if None the output file is read
+        '''
+        fname = os.path.abspath(fname)
+        stat = os.stat(fname)
+        output = get_sfrm_name(fname)
+        if written is None:
+            path_output = os.path.join(self.path_output, output)
+            written = FrameOutput(os.path.getsize(path_output), file_checksum(path_output))
+        self.frames[fname] = {'size':stat.st_size,
+                              'mtime':stat.st_mtime_ns,
+                              'options':frame_options(options, fname),
+                              'output':output,
+                              'output_size':written.size,
+                              'checksum':written.checksum}
+        self.new.append(fname)
+        self.changed += 1
+
+    def flush(self):
+        '''
+         append the new records to the journal
+          - cost of the new records only, the manifest
+            is not rewritten (see save)
+        '''
+        if not self.new:
+            return
+        with open(self.journal, 'a') as ofile:
+            ofile.write(''.join(json.dumps([fname, self.frames[fname]]) + '\n' for fname in self.new))
+        self.new = []
+        self.changed = 0
+        self.journaled = True
+
+    def save(self):
+        '''
+         write the manifest (atomic, write and replace)
+          - compacts the journal into the manifest, the
+            journal is removed after the manifest is replaced
+          - once at the end of a conversion, use flush
+            to keep the progress during a conversion
+        '''
+        if not self.changed and not self.journaled:
+            return
+        temp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp, 'w') as ofile:
+            json.dump({'version':MANIFEST_VERSION, 'frames':self.frames}, ofile)
+        os.replace(temp, self.path)
+        try:
+            os.remove(self.journal)
+        except FileNotFoundError:
+            pass
+        self.new = []
+        self.changed = 0
+        self.journaled = False
+##############################################
+##         END Conversion manifest          ##
+##############################################
@@ -0,0 +1,448 @@
+import os
+import pickle
+import shutil
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from p3fc.lib.utility import pilatus_pad, write_bruker_frame, bruker_header
+from p3fc.lib.formats import detect_format
+from p3fc.lib.framecache import load_frame
+
+##############################################
+##             Mask rasterizer              ##
+##############################################
+# Patches are given in image coordinates (x: column, y: row),
+# as the ROIs of the mask viewer (pyqtgraph):
+#  - pos:   origin of the patch
+#  - size:  width, height of the patch
+#  - angle: rotation (degrees) about the origin
+# 'rect' covers the rotated rectangle, 'circ' the ellipse
+# inscribed in it. A pixel is covered if its center is.
+# Both shapes are convex: a row of pixels is covered from
+# column lo to hi (exclusive), a patch is a list of spans.
+
+def _slab(coef, const, lower, upper):
+    '''
+     dx interval of lower <= coef * dx + const <= upper
+      - const: array (one value per row)
+      - returns the bounds, empty if a > b
+    '''
+    if abs(coef) < 1e-12:
+        inside = (const >= lower) & (const <= upper)
+        return np.where(inside, -np.inf, np.inf), np.where(inside, np.inf, -np.inf)
+    a = (lower - const) / coef
+    b = (upper - const) / coef
+    return np.minimum(a, b), np.maximum(a, b)
+
+def _rect_interval(dy, size, angle):
+    '''
+     dx interval (relative to the origin) of a rotated
+     rectangle in the rows at dy, see patch_spans
+    '''
+    w, h = float(size[0]), float(size[1])
+    a = np.deg2rad(angle)
+    ca, sa = np.cos(a), np.sin(a)
+    # local x = dx * ca + dy * sa in [0, w]
+    # local y = dy * ca - dx * sa in [0, h]
+    xa, xb = _slab(ca, dy * sa, min(0.0, w), max(0.0, w))
+    ya, yb = _slab(-sa, dy * ca, min(0.0, h), max(0.0, h))
+    return np.maximum(xa, ya), np.minimum(xb, yb)
+
+def _rect_extent(size, angle):
+    w, h = float(size[0]), float(size[1])
+    a = np.deg2rad(angle)
+    ys = np.array([0.0, w, 0.0, w]) * np.sin(a) + np.array([0.0, 0.0, h, h]) * np.cos(a)
+    return ys.min(), ys.max()
+
+def _ellipse_interval(dy, size, angle):
+    '''
+     dx interval (relative to the origin) of the ellipse
+     inscribed in a rotated rectangle in the rows at dy
+    '''
+    w, h = float(size[0]), float(size[1])
+    ra, rb = abs(w) / 2.0, abs(h) / 2.0
+    a = np.deg2rad(angle)
+    ca, sa = np.cos(a), np.sin(a)
+    # relative to the center
+    dy = dy - (w / 2.0 * sa + h / 2.0 * ca)
+    cx = w / 2.0 * ca - h / 2.0 * sa
+    # (u / ra)^2 + (v / rb)^2 <= 1 is quadratic in dx
+    # u = dx * ca + dy * sa, v = dy * ca - dx * sa
+    qa = ca**2 / ra**2 + sa**2 / rb**2
+    qb = 2.0 * dy * ca * sa * (1.0 / ra**2 - 1.0 / rb**2)
+    qc = dy**2 * (sa**2 / ra**2 + ca**2 / rb**2) - 1.0
+    disc = qb**2 - 4.0 * qa * qc
+    root = np.sqrt(np.maximum(disc, 0.0))
+    empty = disc < 0.0
+    xa = np.where(empty, np.inf, (-qb - root) / (2.0 * qa) + cx)
+    xb = np.where(empty, -np.inf, (-qb + root) / (2.0 * qa) + cx)
+    return xa, xb
+
+def _ellipse_extent(size, angle):
+    w, h = float(size[0]), float(size[1])
+    ra, rb = abs(w) / 2.0, abs(h) / 2.0
+    a = np.deg2rad(angle)
+    cy = w / 2.0 * np.sin(a) + h / 2.0 * np.cos(a)
+    ey = np.sqrt((ra * np.sin(a))**2 + (rb * np.cos(a))**2)
+    return cy - ey, cy + ey
+
+#########################################
+##     Add new patch shapes here!      ##
+#########################################
+# name: (dx interval in rows, y extent relative to the origin)
+PATCH_SHAPES = {'rect':(_rect_interval, _rect_extent),
+                'circ':(_ellipse_interval, _ellipse_extent)}
+
+def patch_spans(shape, name, pos, size, angle=0.0):
+    '''
+     pixels covered by a patch
+      - shape: shape of the mask (rows, cols)
+      - returns (first row, lo, hi): the columns lo[i] to hi[i]
+        (exclusive) of row first + i are covered, clipped to
+        the mask, or None if the patch is outside the mask
+    '''
+    try:
+        interval, extent = PATCH_SHAPES[name]
+    except KeyError:
+        raise ValueError('Unknown patch shape: {}'.format(name))
+    if float(size[0]) == 0.0 or float(size[1]) == 0.0:
+        return None
+    y_min, y_max = extent(size, angle)
+    # rows whose center is within the extent
+    first = max(0, int(np.ceil(pos[1] + y_min - 0.5)))
+    last = min(shape[0], int(np.floor(pos[1] + y_max - 0.5)) + 1)
+    if first >= last:
+        return None
+    dy = np.arange(first, last) + 0.5 - pos[1]
+    xa, xb = interval(dy, size, angle)
+    # columns whose center is within [xa, xb]
+    with np.errstate(invalid='ignore'):
+        lo = np.clip(np.ceil(pos[0] + xa - 0.5), 0, shape[1])
+        hi = np.clip(np.floor(pos[0] + xb - 0.5) + 1, 0, shape[1])
+    hi = np.maximum(lo, hi)
+    return first, lo.astype(np.intp), hi.astype(np.intp)
+
+def fill_spans(mask, spans, value):
+    '''
+     set the pixels of 'spans' (see patch_spans) to 'value'
+      - consecutive rows with the same span are set at once
+    '''
+    first, lo, hi = spans
+    change = np.flatnonzero((lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])) + 1
+    starts = np.concatenate(([0], change))
+    stops = np.concatenate((change, [len(lo)]))
+    for start, stop, a, b in zip(starts.tolist(), stops.tolist(), lo[starts].tolist(), hi[starts].tolist()):
+        if a < b:
+            mask[first + start:first + stop, a:b] = value
+
+def rasterize_patch(mask, name, pos, size, angle, value):
+    '''
+     set the pixels of 'mask' covered by a patch to 'value'
+    '''
+    spans = patch_spans(mask.shape, name, pos, size, angle)
+    if spans is not None:
+        fill_spans(mask, spans, value)
+
+def rasterize_patches(shape, patches):
+    '''
+     the mask of a list of patches: (name, pos, size, angle, value)
+      - later patches are drawn over earlier ones
+      - returns a bool array, True: pixel is used
+    '''
+    mask = np.ones(shape, dtype=bool)
+    for name, pos, size, angle, value in patches:
+        rasterize_patch(mask, name, pos, size, angle, value)
+    return mask
+
+def patch_bounds(shape, name, pos, size, angle=0.0):
+    '''
+     bounding box of the pixels covered by a patch
+      - returns (row start, row stop, col start, col stop)
+        or None if no pixel is covered
+    '''
+    return _spans_bounds(patch_spans(shape, name, pos, size, angle))
+
+def _spans_bounds(spans):
+    if spans is None:
+        return None
+    first, lo, hi = spans
+    used = np.flatnonzero(hi > lo)
+    if len(used) == 0:
+        return None
+    return first + int(used[0]), first + int(used[-1]) + 1, int(lo[used].min()), int(hi[used].max())
+
+def _merge_boxes(boxes):
+    # overlapping boxes are replaced by their union
+    merged = []
+    for box in boxes:
+        while True:
+            for idx, other in enumerate(merged):
+                if box[0] < other[1] and other[0] < box[1] and box[2] < other[3] and other[2] < box[3]:
+                    box = (min(box[0], other[0]), max(box[1], other[1]), min(box[2], other[2]), max(box[3], other[3]))
+                    del merged[idx]
+                    break
+            else:
+                break
+        merged.append(box)
+    return merged
+
+def _clip_spans(spans, box):
+    # spans (see patch_spans) within a box, relative to it
+    first, lo, hi = spans
+    r0, r1, c0, c1 = box
+    start, stop = max(first, r0), min(first + len(lo), r1)
+    if start >= stop:
+        return None
+    lo = np.clip(lo[start - first:stop - first], c0, c1) - c0
+    hi = np.clip(hi[start - first:stop - first], c0, c1) - c0
+    return start - r0, lo, hi
+
+class MaskRaster(object):
+    '''
+     Persistent mask of a list of patches
+      - update() compares the patches to the ones of the
+        last call and redraws the bounding boxes of the
+        changed patches only, at their old and new place
+      - the spans of a patch are computed once, on the
+        whole mask, a redrawn box equals a full redraw
+      - mask: bool array, True: pixel is used
+    '''
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.mask = np.ones(self.shape, dtype=bool)
+        self.patches = []
+        # {patch: spans}
+        self._spans = {}
+
+    def spans(self, patch):
+        if patch not in self._spans:
+            self._spans[patch] = patch_spans(self.shape, *patch[:4])
+        return self._spans[patch]
+
+    def update(self, patches):
+        '''
+         patches: list of (name, pos, size, angle, value),
+                  later patches are drawn over earlier ones
+         returns the redrawn boxes, see patch_bounds
+        '''
+        patches = [(name, (float(pos[0]), float(pos[1])), (float(size[0]), float(size[1])), float(angle), int(value))
+                   for name, pos, size, angle, value in patches]
+        dirty = []
+        for idx in range(max(len(patches), len(self.patches))):
+            old = self.patches[idx] if idx < len(self.patches) else None
+            new = patches[idx] if idx < len(patches) else None
+            if old == new:
+                continue
+            for patch in (old, new):
+                if patch is not None:
+                    box = _spans_bounds(self.spans(patch))
+                    if box is not None:
+                        dirty.append(box)
+        self.patches = patches
+        self._spans = {patch:self.spans(patch) for patch in patches}
+        dirty = _merge_boxes(dirty)
+        for box in dirty:
+            # all patches, clipped to the box
+            r0, r1, c0, c1 = box
+            view = self.mask[r0:r1, c0:c1]
+            view.fill(True)
+            for patch in patches:
+                spans = self.spans(patch)
+                if spans is not None:
+                    spans = _clip_spans(spans, box)
+                    if spans is not None:
+                        fill_spans(view, spans, patch[4])
+        return dirty
+
+def mask_frame(mask, frame=None, pad=False):
+    '''
+     the mask as it is written
+      - pixels of 'frame' below zero are masked
+      - padded with zeros (see utility.pilatus_pad) if 'pad'
+      - returns a new array, 1: pixel is used
+    '''
+    mask = np.array(mask)
+    if frame is not None:
+        mask[frame < 0] = 0
+    if pad:
+        mask, offset_rows, offset_cols = pilatus_pad(mask, fill=0)
+    return mask
+
+def overlay_buffer(mask, dead=None, pad=False):
+    '''
+     uint8 buffer of the masked pixels (1) of a mask as it
+     is written (see mask_frame), for display
+      - dead: bool array of pixels masked anyway (negative)
+      - the border added by padding is masked
+      - returns buffer, (row offset, col offset) of the mask
+    '''
+    buffer = np.zeros(mask.shape, dtype=np.uint8)
+    offset = (0, 0)
+    if pad:
+        buffer, offset_rows, offset_cols = pilatus_pad(buffer, fill=1)
+        buffer = buffer.astype(np.uint8)
+        offset = (offset_rows, offset_cols)
+    update_overlay(buffer, offset, mask, dead, [(0, mask.shape[0], 0, mask.shape[1])])
+    return buffer, offset
+
+def update_overlay(buffer, offset, mask, dead, boxes):
+    '''
+     redraw the boxes (see patch_bounds) of an overlay buffer
+    '''
+    for r0, r1, c0, c1 in boxes:
+        view = buffer[offset[0] + r0:offset[0] + r1, offset[1] + c0:offset[1] + c1]
+        np.logical_not(mask[r0:r1, c0:c1], out=view, casting='unsafe')
+        if dead is not None:
+            view |= dead[r0:r1, c0:c1]
+
+def write_mask(path_mask, mask, detector_type, wavelength=None, sfrm=True, npy=False):
+    '''
+     write a mask (see mask_frame) for SAINT
+      - sfrm: as Bruker frame 'path_mask'
+      - npy:  as numpy array, next to it
+      - the mask is flipped upside down
+    '''
+    header = bruker_header()
+    # fill known header entries
+    header['NCOLS']       = [mask.shape[1]]                 # Number of pixels per row; number of mosaic tiles in X; dZ/dX
+    header['NROWS']       = [mask.shape[0]]                 # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
+    #header['CCDPARM'][:] = [1.47398, 36.60, 359.8295, 0.0, 163810.0] # readnoise, electronsperadu, electronsperphoton, bruker_bias, bruker_fullscale
+    #header['DETTYPE'][:] = ['CMOS-PHOTONII', 37.037037, 1.004, 0, 0.425, 0.035, 1]
+    header['DETTYPE'][:]  = [detector_type, 10.0, 1.0, 0, 0.0, 0.0, 1] # dettype pix512percm cmtogrid circular brassspacing windowthickness accuratetime
+    #header['SITE']       = ['Aarhus Huber Diffractometer']           # Site name
+    #header['MODEL']      = ['Microfocus X-ray Source']               # Diffractometer model
+    #header['TARGET']     = ['Ag Ka']                                 # X-ray target material)
+    #header['SOURCEK']    = [50.0]                                    # X-ray source kV
+    #header['SOURCEM']    = [0.880]                                   # Source milliamps
+    #header['WAVELEN'][:] = [0.560860, 0.559420, 0.563810]            # Wavelengths (average, a1, a2)
+    if wavelength is not None:
+        header['WAVELEN'][:] = [wavelength, wavelength, wavelength] # Wavelengths (average, a1, a2)
+    else:
+        header['WAVELEN'][:] = [1.0, 1.0, 1.0]                        # Wavelengths (average, a1, a2)
+    #header['CORRECT']    = ['INTERNAL, s/n: A110247']                # Flood correction filename
+    #header['DARK']       = ['INTERNAL, s/n: A110247']                # Dark current frame name
+    #header['WARPFIL']    = ['LINEAR']                                # Spatial correction filename
+    #header['LINEAR'][:]  = [1.00, 0.00]                              # bruker_linearscale, bruker_linearoffset
+    #header['PHD'][:]     = [0.68, 0.051]                             # Phosphor efficiency, phosphor thickness
+    #header['OCTMASK'][:] = [0, 0, 0, 767, 767, 1791, 1023, 1023]
+
+    # write the frame
+    if sfrm:
+        write_bruker_frame(path_mask, header, np.flipud(mask))
+    
+    # save mask as numpy npy file
+    if npy:
+        np.save(os.path.splitext(path_mask)[0], np.flipud(mask))
+##############################################
+##           END Mask rasterizer            ##
+##############################################
+
+##############################################
+##          Batch mask generation           ##
+##############################################
+def mask_paths(path_output, stem, run):
+    '''
+     mask (.sfrm) and patches (.msk) file of a run
+    '''
+    base = os.path.join(os.path.abspath(path_output), '{}_xa_{:>02}_0001'.format(stem, int(run)))
+    return base + '.sfrm', base + '.msk'
+
+def _point(*args):
+    return tuple(float(a) for a in args)
+
+class _PatchUnpickler(pickle.Unpickler):
+    # the mask viewer stores pyqtgraph Points,
+    # they are read as tuples, no Qt needed
+    def find_class(self, module, name):
+        if module.split('.')[0] == 'pyqtgraph' and name == 'Point':
+            return _point
+        return super().find_class(module, name)
+
+def load_patches(fname):
+    '''
+     the patches stored by the mask viewer (.msk)
+      - returns the list of (name, pos, size, angle, value)
+        in drawing order: circles, then the base patches
+    '''
+    with open(fname, 'rb') as rf:
+        patches = _PatchUnpickler(rf).load()
+    return [tuple(patch) for patch in patches.get('circles', [])] +\
+           [tuple(patch) for patch in patches.get('base', [])]
+
+def write_run_mask(fname, patches, path_mask, flip=False, negative=True, pad=True, wavelength=None, sfrm=True, npy=False):
+    '''
+     write the mask of a run as the mask viewer does
+      - fname: the first frame of the run, sets the shape
+        and its negative pixels are masked if 'negative'
+      - flip: the patches were drawn on the flipped frame
+      - see mask_frame and write_mask
+    '''
+    fmt = detect_format(fname)
+    if fmt is None:
+        raise ValueError('Unknown frame format: {}'.format(os.path.basename(fname)))
+    frame = load_frame(fname)
+    if flip:
+        frame = frame[::-1]
+    mask = mask_frame(rasterize_patches(frame.shape, patches), frame if negative else None, pad)
+    write_mask(path_mask, mask, fmt['detector'], wavelength, sfrm, npy)
+
+def mask_runs(path_input, path_output, template=None, force=False, workers=None, **kwargs):
+    '''
+     write the masks of all runs of a directory
+      - the patches of a run are read from its .msk file in
+        'path_output', runs without one are skipped
+      - template: a .msk file used for the runs without one,
+        it is copied to them, force: used for all runs, the
+        .msk files of the runs are overwritten
+      - the runs are written by a pool of threads
+      - kwargs: see write_run_mask
+      - yields (stem, run, path_mask, error) as the runs
+        are done, error is '' on success
+    '''
+    from p3fc.lib.catalog import FrameCatalog
+    path_output = os.path.abspath(path_output)
+    with FrameCatalog(path_input) as catalog:
+        catalog.update()
+        runs = catalog.runs()
+    if template is not None:
+        template = os.path.abspath(template)
+        patches = load_patches(template)
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+
+    ########################
+    ##     mask_runs      ##
+    ##     FUNCTIONS      ##
+    ########################
+    def write(stem, run, fname):
+        path_mask, path_patches = mask_paths(path_output, stem, run)
+        if template is None or (not force and os.path.exists(path_patches)):
+            run_patches = load_patches(path_patches)
+        else:
+            run_patches = patches
+            if os.path.abspath(path_patches) != template:
+                shutil.copyfile(template, path_patches)
+        write_run_mask(fname, run_patches, path_mask, **kwargs)
+    ########################
+    ##     mask_runs      ##
+    ##   FUNCTIONS END    ##
+    ########################
+
+    os.makedirs(path_output, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {}
+        for stem, run, fname, _, _, _ in runs:
+            path_mask, path_patches = mask_paths(path_output, stem, run)
+            if template is None and not os.path.exists(path_patches):
+                yield stem, run, path_mask, 'No patches ({})'.format(os.path.basename(path_patches))
+                continue
+            futures[pool.submit(write, stem, run, fname)] = (stem, run, path_mask)
+        for future in as_completed(futures):
+            stem, run, path_mask = futures[future]
+            try:
+                future.result()
+                yield stem, run, path_mask, ''
+            except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+                yield stem, run, path_mask, str(e)
+##############################################
+##        END Batch mask generation         ##
+##############################################
@@ -0,0 +1,161 @@
+import os
+import hashlib
+import logging
+import threading
+import collections
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from p3fc.lib.catalog import user_cache_dir
+from p3fc.lib.framecache import load_frame
+
+##############################################
+##             Run projections              ##
+##############################################
+# projections of a run that can be displayed
+PROJECTIONS = ('max', 'mean', 'sum')
+
+# maximum and sum of the frames of a run
+# - the frames as displayed (rotated, see framecache.load_frame)
+# - 'signature' identifies the frames it was made of
+RunProjection = collections.namedtuple('RunProjection', ['max', 'sum', 'number', 'signature'])
+
+def projection_image(projection, mode):
+    '''
+     the image of a projection: 'max', 'mean' or 'sum'
+    '''
+    if mode == 'max':
+        return projection.max
+    if mode == 'sum':
+        return projection.sum
+    if mode == 'mean':
+        return projection.sum / float(max(projection.number, 1))
+    raise ValueError('Unknown projection: {}'.format(mode))
+
+def frames_signature(frames):
+    '''
+     number, total size and latest mtime of the frames
+    '''
+    size, mtime = 0, 0
+    for fname in frames:
+        stat = os.stat(fname)
+        size += stat.st_size
+        mtime = max(mtime, stat.st_mtime_ns)
+    return np.array([len(frames), size, mtime], dtype=np.int64)
+
+def project_frames(frames, workers=None, read=load_frame, progress=None, stop=None):
+    '''
+     maximum and sum of 'frames', streamed
+      - every worker thread reduces the frames it takes into
+        its own maximum and sum, one frame at a time, the stack
+        is never loaded, memory: workers * (2 images + 1 frame)
+      - the partial results are merged at the end
+      - progress(done, total) is called by the workers
+      - stop: threading.Event, returns None if it is set
+      - returns a RunProjection
+    '''
+    frames = list(frames)
+    if not frames:
+        raise ValueError('No frames to project')
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    workers = max(1, min(workers, len(frames)))
+    todo = iter(frames)
+    done = [0]
+    lock = threading.Lock()
+
+    ########################
+    ##   project_frames   ##
+    ##     FUNCTIONS      ##
+    ########################
+    def reduce():
+        vmax, vsum = None, None
+        while stop is None or not stop.is_set():
+            with lock:
+                fname = next(todo, None)
+            if fname is None:
+                break
+            data = read(fname)
+            if vmax is None:
+                vmax = np.array(data)
+                vsum = data.astype(np.int64)
+            else:
+                np.maximum(vmax, data, out=vmax)
+                vsum += data
+            with lock:
+                done[0] += 1
+                number = done[0]
+            if progress is not None:
+                progress(number, len(frames))
+        return vmax, vsum
+    ########################
+    ##   project_frames   ##
+    ##   FUNCTIONS END    ##
+    ########################
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = [future.result() for future in [pool.submit(reduce) for _ in range(workers)]]
+    if stop is not None and stop.is_set():
+        return None
+    results = [(vmax, vsum) for vmax, vsum in results if vmax is not None]
+    vmax, vsum = results[0]
+    for pmax, psum in results[1:]:
+        np.maximum(vmax, pmax, out=vmax)
+        vsum += psum
+    return RunProjection(max=vmax, sum=vsum, number=len(frames), signature=frames_signature(frames))
+
+def projection_path(path, stem, run):
+    '''
+     file of the stored projections of a run in the user
+     cache (~/.cache/p3fc/projections), the raw data
+     directory is left alone
+    '''
+    name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(user_cache_dir('projections'), '{}_{}_{:>02}.npz'.format(name, stem, run))
+
+# projections: {(path, stem, run): RunProjection}
+_PROJECTION_CACHE = collections.OrderedDict()
+_PROJECTION_CACHE_LOCK = threading.Lock()
+_PROJECTION_CACHE_SIZE = 8
+
+def run_projection(path, stem, run, frames, workers=None, progress=None, stop=None):
+    '''
+     the projections of a run, made once
+      - cached in memory and stored compressed in the user
+        cache, valid as long as the frames are unchanged
+      - see project_frames
+    '''
+    path = os.path.abspath(path)
+    key = (path, stem, run)
+    signature = frames_signature(frames)
+    with _PROJECTION_CACHE_LOCK:
+        cached = _PROJECTION_CACHE.get(key)
+        if cached is not None and np.array_equal(cached.signature, signature):
+            _PROJECTION_CACHE.move_to_end(key)
+            return cached
+    fname = projection_path(path, stem, run)
+    projection = None
+    try:
+        with np.load(fname) as stored:
+            if np.array_equal(stored['signature'], signature):
+                projection = RunProjection(max=stored['max'], sum=stored['sum'], number=int(signature[0]), signature=signature)
+    except (OSError, KeyError, ValueError):
+        pass
+    if projection is None:
+        projection = project_frames(frames, workers=workers, progress=progress, stop=stop)
+        if projection is None:
+            return None
+        try:
+            tmp = '{}.{}.npz'.format(fname, os.getpid())
+            np.savez_compressed(tmp, max=projection.max, sum=projection.sum, signature=projection.signature)
+            os.replace(tmp, fname)
+        except OSError as e:
+            logging.warning('WARNING: Storing the projection of run {} failed: {}'.format(run, e))
+    with _PROJECTION_CACHE_LOCK:
+        _PROJECTION_CACHE[key] = projection
+        _PROJECTION_CACHE.move_to_end(key)
+        while len(_PROJECTION_CACHE) > _PROJECTION_CACHE_SIZE:
+            _PROJECTION_CACHE.popitem(last=False)
+    return projection
+##############################################
+##           END Run projections            ##
+##############################################
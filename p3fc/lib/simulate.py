@@ -0,0 +1,55 @@
+import os
+import time
+import shutil
+import logging
+from p3fc.lib.formats import list_frames
+
+##############################################
+##          Frame writer simulator          ##
+##############################################
+def write_slowly(source, target, duration, chunks=4):
+    '''
+     copy 'source' to 'target' in 'chunks' parts
+     spread over 'duration' seconds, like a detector
+     that is still writing the frame
+    '''
+    with open(source, 'rb') as f:
+        data = f.read()
+    size = -(-len(data) // chunks)
+    with open(target, 'wb') as f:
+        for start in range(0, len(data), size):
+            f.write(data[start:start + size])
+            f.flush()
+            time.sleep(duration / chunks)
+
+def simulate_collection(path_input, path_output, rate=1.0, chunks=4, number=None):
+    '''
+     simulate a data collection to test the watch mode
+      - copies the frames of 'path_input' to 'path_output'
+        at 'rate' frames per second
+      - every frame is written in 'chunks' parts during
+        half of the frame period (partially written frames)
+      - all other files (.inf, _flux.txt) are copied first
+      - number: number of frames to write, default: all
+      - returns the number of frames written
+    '''
+    os.makedirs(path_output, exist_ok=True)
+    frames = list_frames(path_input)
+    for entry in os.scandir(path_input):
+        if entry.is_file() and entry.path not in frames:
+            shutil.copy(entry.path, path_output)
+    if number is not None:
+        frames = frames[:number]
+    period = 1.0 / rate
+    t0 = time.monotonic()
+    for num, fname in enumerate(frames):
+        # keep the rate, even if writing is slow
+        delay = t0 + num * period - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        write_slowly(fname, os.path.join(path_output, os.path.basename(fname)), period / 2.0, chunks)
+        logging.info('{:>{w}}/{} {}'.format(num + 1, len(frames), os.path.basename(fname), w=len(str(len(frames)))))
+    return len(frames)
+##############################################
+##        END Frame writer simulator        ##
+##############################################
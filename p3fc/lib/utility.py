@@ -1,3 +1,9 @@
+import re
+import threading
+import collections
+import collections.abc
+from p3fc.lib.diskcache import disk_cached
+
 def kappa_to_euler(k_omg, kappa, alpha, k_phi):
     '''
      converts kappa to eulerian geometry
@@ -23,21 +29,97 @@ def read_photon2_raw(fname, dim1, dim2, bytecode):
      Read a PHOTON-II raw image file
       - endianness unchecked
       - no header, pure data
+      - the file is memory mapped, a read-only
+        view on the mapped file is returned
     '''
+    import mmap
     import numpy as np
-    # translate the bytecode to the bytes per pixel
-    bpp = len(np.array(0, bytecode).tostring())
-    # determine the image size
-    size = dim1 * dim2 * bpp
-    # open the file
+    # open and map the file
     with open(fname, 'rb') as f:
-        # read the image (bytestream)
-        rawData = f.read(size)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
     # reshape the image into 2d array (dim1, dim2)
     # dtype = bytecode
-    data = np.frombuffer(rawData, bytecode).reshape((dim1, dim2))
+    data = np.frombuffer(mapped, bytecode, count=dim1 * dim2).reshape((dim1, dim2))
     return data
 
+# SPring-8 .inf file information
+SP8Info = collections.namedtuple('SP8Info', ['beam_x', 'beam_y',            # CCD_SPATIAL_BEAM_POSITION
+                                             'saturation',                  # SATURATED_VALUE
+                                             'wavelength',                  # SCAN_WAVELENGTH
+                                             'amperage', 'voltage',         # SOURCE_AMPERAGE, SOURCE_VOLTAGE
+                                             'omega', 'chi', 'phi',         # CRYSTAL_GONIO_VALUES
+                                             'tth', 'distance',             # SCAN_DET_RELZERO
+                                             'axis',                        # ROTATION_AXIS_NAME
+                                             'nframes',                     # SCAN_SEQ_INFO
+                                             'scan_start', 'scan_end',      # SCAN_ROTATION
+                                             'scan_inc', 'scan_exp'])
+
+# all 'KEY=VALUE;' entries of an .inf file
+_INF_ENTRY = re.compile(r'^\s*(\w+)\s*=\s*([^;]*);', re.MULTILINE)
+
+# parsed .inf files: {path: ((mtime, size), SP8Info)}
+_INF_CACHE = collections.OrderedDict()
+_INF_CACHE_LOCK = threading.Lock()
+_INF_CACHE_SIZE = 4096
+
+def parse_sp8_inf(text):
+    '''
+     Parse the content of a SPring-8 .inf file
+     - single pass over the text, returns a SP8Info record
+     - raises KeyError if an entry is missing
+    '''
+    entries = dict(_INF_ENTRY.findall(text))
+    def values(key):
+        return entries[key].split()
+    beam_x, beam_y = map(float, values('CCD_SPATIAL_BEAM_POSITION')[:2])
+    omega, chi, phi = map(float, values('CRYSTAL_GONIO_VALUES')[:3])
+    _, tth, distance = map(float, values('SCAN_DET_RELZERO')[:3])
+    scan_start, scan_end, scan_inc, scan_exp = map(float, values('SCAN_ROTATION')[:4])
+    return SP8Info(beam_x=beam_x,
+                   beam_y=beam_y,
+                   saturation=int(values('SATURATED_VALUE')[0]),
+                   wavelength=float(values('SCAN_WAVELENGTH')[0]),
+                   amperage=float(values('SOURCE_AMPERAGE')[0]),
+                   voltage=float(values('SOURCE_VOLTAGE')[0]),
+                   omega=omega,
+                   chi=chi,
+                   phi=phi,
+                   tth=tth,
+                   distance=distance,
+                   axis=values('ROTATION_AXIS_NAME')[0],
+                   nframes=int(values('SCAN_SEQ_INFO')[2]),
+                   scan_start=scan_start,
+                   scan_end=scan_end,
+                   scan_inc=scan_inc,
+                   scan_exp=scan_exp)
+
+def read_sp8_inf(fname):
+    '''
+     Read a SPring-8 .inf file
+     - each file is parsed once and cached, keyed by path,
+       the cached entry is valid as long as mtime and size match
+     - thread-safe, worker processes keep their own cache
+     - returns a SP8Info record
+     - raises FileNotFoundError if the file is missing
+    '''
+    import os
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _INF_CACHE_LOCK:
+        cached = _INF_CACHE.get(fname)
+        if cached is not None and cached[0] == key:
+            _INF_CACHE.move_to_end(fname)
+            return cached[1]
+    with open(fname) as rFile:
+        info = parse_sp8_inf(rFile.read())
+    with _INF_CACHE_LOCK:
+        _INF_CACHE[fname] = (key, info)
+        _INF_CACHE.move_to_end(fname)
+        while len(_INF_CACHE) > _INF_CACHE_SIZE:
+            _INF_CACHE.popitem(last=False)
+    return info
+
 def read_sfrm(fname):
     import re
     import numpy as np
@@ -99,11 +181,15 @@ def read_sfrm(fname):
 
 def decByteOffset_np(stream, dtype="int64"):
     '''
-    The following code is taken from the FabIO package:
+    Vectorized version of the FabIO byte-offset decoder:
     Version: fabio-0.9.0
     Home-page: http://github.com/silx-kit/fabio
     Author: Henning Sorensen, Erik Knudsen, Jon Wright, Regis Perdreau,
             Jérôme Kieffer, Gael Goret, Brian Pauw, Valentin Valls
+    
+     - all escape markers (0x80) are located at once
+     - the stream is never sliced/copied per exception
+     - the output is identical to the FabIO implementation
     '''
     """
     Analyze a stream of char with any length of exception:
@@ -114,93 +200,245 @@ def decByteOffset_np(stream, dtype="int64"):
     @return: 1D-ndarray
     """
     import numpy as np
-    listnpa = []
-    key16 = b"\x80"
-    key32 = b"\x00\x80"
-    key64 = b"\x00\x00\x00\x80"
-    shift = 1
-    while True:
-        idx = stream.find(key16)
-        if idx == -1:
-            listnpa.append(np.frombuffer(stream, dtype="int8"))
-            break
-        listnpa.append(np.frombuffer(stream[:idx], dtype="int8"))
-
-        if stream[idx + 1:idx + 3] == key32:
-            if stream[idx + 3:idx + 7] == key64:
-                # 64 bits int
-                res = np.frombuffer(stream[idx + 7:idx + 15], dtype="int64")
-                listnpa.append(res)
-                shift = 15
+    raw = np.frombuffer(stream, dtype=np.uint8)
+    size = raw.size
+    # candidates for escape markers
+    cand = np.flatnonzero(raw == 0x80)
+    if cand.size == 0:
+        return raw.view(np.int8).astype(dtype).cumsum(dtype=dtype)
+    
+    # classify the exceptions, assuming all candidates are markers
+    # key16: 0x80, key32: 0x80 0x00 0x80, key64: 0x80 0x00 0x80 0x00 0x00 0x00 0x80
+    def byte_is(offset, value):
+        idx = cand + offset
+        return (idx < size) & (raw[np.minimum(idx, size - 1)] == value)
+    is32 = byte_is(1, 0x00) & byte_is(2, 0x80)
+    is64 = is32 & byte_is(3, 0x00) & byte_is(4, 0x00) & byte_is(5, 0x00) & byte_is(6, 0x80)
+    shift = np.where(is64, 15, np.where(is32, 7, 3))
+    end = cand + shift
+    
+    # a 0x80 byte within the value of a preceding exception is no marker
+    # - only candidates covered by the range of an earlier candidate are ambiguous
+    # - resolve those (rare) ones in order, earlier ones are already final
+    covered = np.zeros(cand.size, dtype=bool)
+    covered[1:] = np.maximum.accumulate(end)[:-1] > cand[1:]
+    if covered.any():
+        valid = (~covered).tolist()
+        c = cand.tolist()
+        e = end.tolist()
+        for i in np.flatnonzero(covered).tolist():
+            j = i - 1
+            while j >= 0 and c[i] - c[j] < 15:
+                if valid[j] and e[j] > c[i]:
+                    break
+                j -= 1
             else:
-                # 32 bits int
-                res = np.frombuffer(stream[idx + 3:idx + 7], dtype="int32")
-                listnpa.append(res)
-                shift = 7
-        else:  # int16
-            res = np.frombuffer(stream[idx + 1:idx + 3], dtype="int16")
-            listnpa.append(res)
-            shift = 3
-        stream = stream[idx + shift:]
-    return np.ascontiguousarray(np.hstack(listnpa), dtype).cumsum()
+                valid[i] = True
+        valid = np.array(valid, dtype=bool)
+        cand, shift, end, is32, is64 = cand[valid], shift[valid], end[valid], is32[valid], is64[valid]
+    
+    # the deltas, exceptions are replaced at the marker position
+    delta = raw.view(np.int8).astype(dtype)
+    for sel, first, width, dt in ((~is32, 1, 2, '<i2'), (is32 & ~is64, 3, 4, '<i4'), (is64, 7, 8, '<i8')):
+        pos = cand[sel]
+        if pos.size:
+            values = raw[pos[:, None] + np.arange(first, first + width)]
+            delta[pos] = np.ascontiguousarray(values).view(dt)[:, 0]
+    
+    # drop the bytes following a marker
+    drop = np.zeros(size + 1, dtype=np.int8)
+    drop[cand + 1] = 1
+    drop[np.minimum(end, size)] -= 1
+    keep = np.cumsum(drop[:size]) == 0
+    return delta[keep].cumsum(dtype=dtype)
+
+# all '# Key value unit' lines of a PILATUS header
+_PILATUS_ENTRY = re.compile(rb'#[ \t]*([A-Za-z][\w/-]*):?[ \t]+([^\r\n\x00]*)')
+_PILATUS_TOKEN = re.compile(rb'[\s,()]+')
+
+class PilatusHeader(collections.abc.Mapping):
+    '''
+     PILATUS header, all '# Key value unit' lines
+     - values are converted on first access:
+       - leading number(s) are returned as float or tuple of floats
+         e.g. Omega -30.0000 deg. -> -30.0
+              Beam_xy (487.00, 516.00) pixels -> (487.0, 516.0)
+       - anything else is returned as string
+    '''
+    def __init__(self, entries):
+        self._raw = entries
+        self._typed = {}
+    
+    def __getitem__(self, key):
+        try:
+            return self._typed[key]
+        except KeyError:
+            value = self._typed[key] = self._convert(self._raw[key])
+            return value
+    
+    def __iter__(self):
+        return iter(self._raw)
+    
+    def __len__(self):
+        return len(self._raw)
+    
+    @staticmethod
+    def _convert(raw):
+        numbers = []
+        for token in _PILATUS_TOKEN.split(raw.strip()):
+            if not token:
+                continue
+            try:
+                numbers.append(float(token))
+            except ValueError:
+                break
+        if not numbers:
+            return raw.decode('ascii', 'replace').strip()
+        if len(numbers) == 1:
+            return numbers[0]
+        return tuple(numbers)
 
+def parse_pilatus_header(head):
+    '''
+     Tokenize a PILATUS (tif/cbf) header
+     - single pass with a precompiled pattern
+     - works on bytes, bytearray or memoryview, no str() round trip
+     - returns a PilatusHeader (lazily typed mapping)
+    '''
+    return PilatusHeader({bytes(k).decode('ascii'):bytes(v) for k, v in _PILATUS_ENTRY.findall(head)})
+
+# CBF binary section info
+_CBF_SIZE = re.compile(rb'X-Binary-Size:\s+(\d+)')
+_CBF_DIM1 = re.compile(rb'X-Binary-Size-Fastest-Dimension:\s+(\d+)')
+_CBF_DIM2 = re.compile(rb'X-Binary-Size-Second-Dimension:\s+(\d+)')
+
+# the decoder returns int64, the frames are int32
+@disk_cached(dtype='int32')
 def read_pilatus_cbf(fname, *args):
     '''
-     
+     Read a PILATUS byte-offset compressed .cbf
+     - the header is returned as raw bytes (see parse_pilatus_header)
+     - hits the disk cache of decoded frames if enabled (see diskcache.py)
     '''
-    import numpy as np
-    import re
     with open(fname, 'rb') as f:
         stream = f.read()
     start = stream.find(b'\x0c\x1a\x04\xd5') +4
-    head = str(stream[:start])
-    size = int(re.search(r'X-Binary-Size:\s+(\d+)', head).group(1))
-    dim1 = int(re.search(r'X-Binary-Size-Fastest-Dimension:\s+(\d+)', head).group(1))
-    dim2 = int(re.search(r'X-Binary-Size-Second-Dimension:\s+(\d+)', head).group(1))
+    head = stream[:start]
+    size = int(_CBF_SIZE.search(head).group(1))
+    dim1 = int(_CBF_DIM1.search(head).group(1))
+    dim2 = int(_CBF_DIM2.search(head).group(1))
     data = decByteOffset_np(stream[start:start+size]).reshape((dim2, dim1))
     return head, data
 
+# tif baseline tags needed to locate the image data
+_TIF_TAGS = {256:'width',
+             257:'length',
+             258:'bits',
+             259:'compression',
+             273:'strip_offsets',
+             279:'strip_byte_counts'}
+
+def read_tif_ifd(buffer):
+    '''
+     Parse the first image file directory (IFD) of a tif
+     - buffer: bytes-like, e.g. a memory mapped file
+     - returns the byte order ('<' or '>') and a dict of
+       the _TIF_TAGS entries: {name: tuple of values}
+     - raises ValueError if the buffer is not a tif
+    '''
+    import struct
+    if buffer[:4] == b'II*\x00':
+        order = '<'
+    elif buffer[:4] == b'MM\x00*':
+        order = '>'
+    else:
+        raise ValueError('Not a tif file!')
+    sizes = {3:'H', 4:'I'}
+    try:
+        ifd, = struct.unpack_from(order + 'I', buffer, 4)
+        entries, = struct.unpack_from(order + 'H', buffer, ifd)
+        tags = {}
+        for pos in range(ifd + 2, ifd + 2 + entries * 12, 12):
+            tag, kind, count = struct.unpack_from(order + 'HHI', buffer, pos)
+            if tag not in _TIF_TAGS or kind not in sizes:
+                continue
+            fmt = '{}{}{}'.format(order, count, sizes[kind])
+            # values that do not fit 4 bytes are stored elsewhere
+            if struct.calcsize(fmt) <= 4:
+                tags[_TIF_TAGS[tag]] = struct.unpack_from(fmt, buffer, pos + 8)
+            else:
+                at, = struct.unpack_from(order + 'I', buffer, pos + 8)
+                tags[_TIF_TAGS[tag]] = struct.unpack_from(fmt, buffer, at)
+    except struct.error:
+        raise ValueError('Corrupt tif file!')
+    return order, tags
+
+def locate_tif_image(buffer, rows, cols, offset, dtype):
+    '''
+     Locate the image data of a tif via its IFD
+     - returns the offset and dtype (byte order) of the image data
+     - the given 'offset' is returned if there is no readable IFD
+     - raises ValueError for compressed tifs or unexpected dimensions
+    '''
+    try:
+        order, tags = read_tif_ifd(buffer)
+    except ValueError:
+        return offset, dtype
+    if 'strip_offsets' not in tags:
+        return offset, dtype
+    if tags.get('compression', (1,))[0] != 1:
+        raise ValueError('Compressed tif files are not supported!')
+    if (tags.get('length', (rows,))[0], tags.get('width', (cols,))[0]) != (rows, cols):
+        raise ValueError('Unexpected frame dimensions: {}x{}!'.format(tags['length'][0], tags['width'][0]))
+    return tags['strip_offsets'][0], dtype.newbyteorder(order)
+
 def read_pilatus_tif(fname, rows, cols, offset, bytecode):
     '''
-     
+     Read a PILATUS .tif
+     - the file is memory mapped, the frame is a read-only
+       view on the mapped file, no copy is made
+     - the image data is located via the tif IFD, 'offset'
+       is only used if the file has no readable IFD
+     - the header is returned as raw bytes (see parse_pilatus_header)
     '''
+    import mmap
     import numpy as np
-    # translate the bytecode to the bytes per pixel
-    bpp = len(np.array(0, bytecode).tostring())
-    # determine the image size
-    size = rows * cols * bpp
-    # open the file
+    # open and map the file
     with open(fname, 'rb') as f:
-        # read the header
-        h = f.read(offset)    
-        # read the image (bytestream)
-        rawData = f.read(size)
-    header = str(h)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # locate the image data
+    offset, dtype = locate_tif_image(mapped, rows, cols, offset, np.dtype(bytecode))
+    # read the header
+    header = mapped[:offset]
     # reshape the image into 2d array (rows, cols)
     # dtype = bytecode
-    data = np.frombuffer(rawData, bytecode).reshape((rows, cols))
+    data = np.frombuffer(mapped, dtype, count=rows * cols, offset=offset).reshape((rows, cols))
     return header, data
 
+@disk_cached
 def read_pilatus_tif_gz(fname, rows, cols, offset, bytecode):
     '''
-     
+     Read a compressed PILATUS .tif (.gz, .bz2, .xz, .zst)
+     - decompressed in one go into a buffer of the expected size
+       (header + rows * cols * bpp), see decompress.DECOMPRESSORS
+     - the image data is located via the tif IFD
+     - the header is returned as raw bytes (see parse_pilatus_header)
+     - hits the disk cache of decoded frames if enabled (see diskcache.py)
     '''
-    import gzip
     import numpy as np
-    # translate the bytecode to the bytes per pixel
-    bpp = len(np.array(0, bytecode).tostring())
+    from p3fc.lib.decompress import read_decompressed
+    dtype = np.dtype(bytecode)
     # determine the image size
-    size = rows * cols * bpp
-    # open the file
-    with gzip.open(fname, 'rb') as f:
-        # read the header
-        h = f.read(offset)    
-        # read the image (bytestream)
-        rawData = f.read(size)
-    header = str(h)
+    size = rows * cols * dtype.itemsize
+    # decompress the file
+    raw = read_decompressed(fname, offset + size)
+    # locate the image data
+    start, dtype = locate_tif_image(raw, rows, cols, offset, dtype)
+    # read the header
+    header = raw[:start]
     # reshape the image into 2d array (rows, cols)
     # dtype = bytecode
-    data = np.frombuffer(rawData, bytecode).reshape((rows, cols))
+    data = np.frombuffer(raw, dtype, count=rows * cols, offset=start).reshape((rows, cols))
     return header, data
 
 def pilatus_pad(data, fill=-2, pad=8):
@@ -219,6 +457,103 @@ def pilatus_pad(data, fill=-2, pad=8):
     padded[offset_rows:offset_rows + rows, offset_cols:offset_cols + cols] = data
     return padded, offset_rows, offset_cols
 
+# statistics of a transformed frame, needed for the Bruker header
+FrameStats = collections.namedtuple('FrameStats', ['maximum',              # MAXIMUM
+                                                   'maxxy',                # MAXXY, (row, col) of the first maximum
+                                                   'minimum',              # MINIMUM
+                                                   'counts',               # NCOUNTS, total frame counts
+                                                   'nover64'])             # NOVER64, number of pixels > 64000
+
+# per-thread output buffers of frame_transform: {shape: array}
+_TRANSFORM_BUFFERS = threading.local()
+
+def frame_transform(data, rotate=True, pad=8, block=64):
+    '''
+     Get the frame saint ready in one go
+      - pad to a multiple of 'pad' pixels, the border is 0
+      - rotate by 90 degrees (clockwise) if 'rotate'
+      - dead areas (-1) and bad pixels (-2) are set to 0
+      - scale the data to avoid underflow tables
+      - collects the header statistics on the way
+     the frame is written block-wise (cache sized) into a buffer that is
+     reused by the calling thread, i.e. it is valid until the next call
+     returns frame, offset_rows, offset_cols, baseline_offset, FrameStats
+      - the offsets refer to the unrotated frame (see pilatus_pad)
+    '''
+    import numpy as np
+    (rows, cols) = data.shape
+    pad_rows = -(-rows // pad) * pad
+    pad_cols = -(-cols // pad) * pad
+    offset_rows = (pad_rows - rows) // 2
+    offset_cols = (pad_cols - cols) // 2
+    if rotate:
+        source = np.rot90(data, k=1, axes=(1, 0))
+        shape = (pad_cols, pad_rows)
+        r0, c0 = offset_cols, pad_rows - rows - offset_rows
+    else:
+        source = data
+        shape = (pad_rows, pad_cols)
+        r0, c0 = offset_rows, offset_cols
+
+    # reuse the buffer of this thread
+    buffers = _TRANSFORM_BUFFERS.__dict__
+    frame = buffers.get(shape)
+    if frame is None:
+        frame = buffers[shape] = np.empty(shape, dtype=np.int32)
+
+    # only the border is filled
+    h, w = source.shape
+    frame[:r0] = 0
+    frame[r0 + h:] = 0
+    frame[r0:r0 + h, :c0] = 0
+    frame[r0:r0 + h, c0 + w:] = 0
+    interior = frame[r0:r0 + h, c0:c0 + w]
+
+    # copy, clean and reduce one block of rows at a time
+    f_max, f_pos, f_min, f_sum, f_o64 = None, None, 0 if frame.size > interior.size else None, 0, 0
+    for start in range(0, h, block):
+        chunk = interior[start:start + block]
+        np.copyto(chunk, source[start:start + block], casting='unsafe')
+        c_min = chunk.min()
+        if c_min < 0:
+            if c_min >= -2:
+                # -1 and -2 are the only negatives
+                np.maximum(chunk, 0, out=chunk)
+                c_min = 0
+            else:
+                chunk[(chunk == -1) | (chunk == -2)] = 0
+                c_min = chunk.min()
+        c_pos = np.unravel_index(chunk.argmax(), chunk.shape)
+        c_max = chunk[c_pos]
+        if f_max is None or c_max > f_max:
+            f_max, f_pos = c_max, (r0 + start + c_pos[0], c0 + c_pos[1])
+        if f_min is None or c_min < f_min:
+            f_min = c_min
+        f_sum += int(chunk.sum(dtype=np.int64))
+        f_o64 += int(np.count_nonzero(chunk > 64000))
+
+    # an empty frame, the first maximum might be on the border
+    if f_max <= 0:
+        f_max = frame.max()
+        f_pos = np.unravel_index(frame.argmax(), frame.shape)
+
+    # scale the data to avoid underflow tables
+    # should yield zero for Pilatus3 images!
+    baseline_offset = -1 * int(f_min)
+    if baseline_offset != 0:
+        frame += baseline_offset
+        f_max += baseline_offset
+        f_min += baseline_offset
+        f_sum += baseline_offset * frame.size
+        f_o64 = int(np.count_nonzero(frame > 64000))
+
+    stats = FrameStats(maximum=int(f_max),
+                       maxxy=(int(f_pos[0]), int(f_pos[1])),
+                       minimum=int(f_min),
+                       counts=f_sum,
+                       nover64=f_o64)
+    return frame, offset_rows, offset_cols, baseline_offset, stats
+
 def bruker_header():
     '''
      default Bruker header
@@ -317,9 +652,207 @@ def bruker_header():
     header['CFR']     = ['']
     return header
     
-def write_bruker_frame(fname, fheader, fdata):
+# Bruker header line formats: {(number of values, dtype): format}
+_BRUKER_FORMATS = {(1,   'int64'): '{:<71d} ',
+                   (2,   'int64'): '{:<35d} {:<35d} ',
+                   (3,   'int64'): '{:<23d} {:<23d} {:<23d} ',
+                   (4,   'int64'): '{:<17d} {:<17d} {:<17d} {:<17d} ',
+                   (5,   'int64'): '{:<13d} {:<13d} {:<13d} {:<13d} {:<13d}   ',
+                   (6,   'int64'): '{:<11d} {:<11d} {:<11d} {:<11d} {:<11d} {:<11d} ',
+                   (1,   'int32'): '{:<71d} ',
+                   (2,   'int32'): '{:<35d} {:<35d} ',
+                   (3,   'int32'): '{:<23d} {:<23d} {:<23d} ',
+                   (4,   'int32'): '{:<17d} {:<17d} {:<17d} {:<17d} ',
+                   (5,   'int32'): '{:<13d} {:<13d} {:<13d} {:<13d} {:<13d}   ',
+                   (6,   'int32'): '{:<11d} {:<11d} {:<11d} {:<11d} {:<11d} {:<11d} ',
+                   (1, 'float64'): '{:<71f} ',
+                   (2, 'float64'): '{:<35f} {:<35f} ',
+                   (3, 'float64'): '{:<23f} {:<23f} {:<23f} ',
+                   (4, 'float64'): '{:<17f} {:<17f} {:<17f} {:<17f} ',
+                   (5, 'float64'): '{:<13f} {:<13f} {:<13f} {:<13f} {:<15f} '}
+
+def format_bruker_entry(name, entry):
     '''
-     write a bruker image
+     format a single Bruker header entry
+      - returns a list of 80 character lines
+    '''
+    import numpy as np
+    headers = []
+    # TITLE has multiple lines
+    if name == 'TITLE':
+        name = '{:<7}:'.format(name)
+        number = len(entry)
+        for line in range(8):
+            if number < line:
+                headers.append(''.join((name, '{:<72}'.format(entry[line]))))
+            else:
+                headers.append(''.join((name, '{:<72}'.format(' '))))
+        return headers
+
+    # DETTYPE Mixes Entry Types
+    if name == 'DETTYPE':
+        name = '{:<7}:'.format(name)
+        string = '{:<20s} {:<11f} {:<11f} {:<1d} {:<11f} {:<10f} {:<1d} '.format(*entry)
+        headers.append(''.join((name, string)))
+        return headers
+
+    # format the name
+    name = '{:<7}:'.format(name)
+
+    # pad entries
+    if type(entry) == list or type(entry) == str:
+        headers.append(''.join(name + '{:<72}'.format(entry[0])))
+        return headers
+
+    # fill empty fields
+    if entry.shape[0] == 0:
+        headers.append(name + '{:72}'.format(' '))
+        return headers
+
+    # if line has too many entries e.g.
+    # OCTMASK(8): np.int64
+    # CELL(6), MATRIX(9), DETPAR(6), ESDCELL(6): np.float64
+    # write the first 6 (np.int64) / 5 (np.float64) entries
+    # and the remainder in a new line/entry
+    if entry.shape[0] > 6 and entry.dtype == np.int64:
+        while entry.shape[0] > 6:
+            format_string = _BRUKER_FORMATS[(6, str(entry.dtype))]
+            headers.append(''.join(name + format_string.format(*entry[:6])))
+            entry = entry[6:]
+    elif entry.shape[0] > 5 and entry.dtype == np.float64:
+        while entry.shape[0] > 5:
+            format_string = _BRUKER_FORMATS[(5, str(entry.dtype))]
+            headers.append(''.join(name + format_string.format(*entry[:5])))
+            entry = entry[5:]
+
+    # format line
+    format_string = _BRUKER_FORMATS[(entry.shape[0], str(entry.dtype))]
+    headers.append(''.join(name + format_string.format(*entry)))
+    return headers
+
+def format_bruker_end(lines):
+    '''
+     Bruker header ending
+      - pads a header of 'lines' lines to a multiple of 512 bytes
+      - returns a list of lines
+    '''
+    headers = []
+    padding = 512 - (lines * 80 % 512)
+    end = '\x1a\x04'
+    if padding <= 80:
+        start = 'CFR: HDR: IMG: '
+        padding -= len(start) + 2
+        dots = ''.join(['.'] * padding)
+        headers.append(start + dots + end)
+    else:
+        while padding > 80:
+            headers.append(end + ''.join(['.'] * 78))
+            padding -= 80
+        if padding != 0:
+            headers.append(end + ''.join(['.'] * (padding - 2)))
+    return headers
+
+class BrukerHeader(object):
+    '''
+     Rendered Bruker header
+      - all entries are formatted once into a byte buffer,
+        the offset and size of every entry is kept
+      - setting an entry formats only that entry and patches
+        its lines in place, the number of lines must not change
+      - values follow the bruker_header() conventions: a list
+        is written as its first item, an array by its dtype
+      - do not change the returned arrays in place, use fill()
+    '''
+    def __init__(self, fheader):
+        self._entries = collections.OrderedDict(fheader)
+        self._offsets = {}
+        last = next(reversed(self._entries))
+        headers = []
+        for name, entry in self._entries.items():
+            # a trailing CFR entry is replaced by the header ending
+            if name == 'CFR' and name == last:
+                continue
+            lines = format_bruker_entry(name, entry)
+            self._offsets[name] = (len(headers) * 80, len(lines) * 80)
+            headers.extend(lines)
+        headers.extend(format_bruker_end(len(headers)))
+        self._buffer = bytearray(''.join(headers).encode('ASCII'))
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __setitem__(self, key, value):
+        start, size = self._offsets[key]
+        lines = ''.join(format_bruker_entry(key, value)).encode('ASCII')
+        if len(lines) != size:
+            raise ValueError('Bruker header entry {} must not change its number of lines!'.format(key))
+        self._buffer[start:start + size] = lines
+        self._entries[key] = value
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        return self._entries.keys()
+
+    def items(self):
+        return self._entries.items()
+
+    def fill(self, key, value, index=slice(None)):
+        '''
+         set (part of) an array entry, the dtype is kept
+          - header.fill(key, value, index) replaces header[key][index] = value
+        '''
+        import numpy as np
+        entry = np.array(self._entries[key])
+        entry[index] = value
+        self[key] = entry
+
+    def copy(self):
+        '''
+         copy of the rendered header, the offsets are shared
+        '''
+        new = BrukerHeader.__new__(BrukerHeader)
+        new._entries = self._entries.copy()
+        new._offsets = self._offsets
+        new._buffer = self._buffer[:]
+        return new
+
+    def tobytes(self):
+        return bytes(self._buffer)
+
+# rendered headers of the current runs: {key: BrukerHeader}
+_BRUKER_TEMPLATES = collections.OrderedDict()
+_BRUKER_TEMPLATES_LOCK = threading.Lock()
+_BRUKER_TEMPLATES_SIZE = 64
+
+def bruker_header_template(key, build):
+    '''
+     Rendered Bruker header with the static entries of a run
+      - key: hashable, identifies the static entries
+        e.g. site, frame shape, beam center, wavelength, ...
+      - build: returns the header dict, only called once per key
+      - returns a copy of the cached BrukerHeader, only the
+        entries that change from frame to frame need to be set
+    '''
+    with _BRUKER_TEMPLATES_LOCK:
+        template = _BRUKER_TEMPLATES.get(key)
+        if template is not None:
+            _BRUKER_TEMPLATES.move_to_end(key)
+            return template.copy()
+    template = BrukerHeader(build())
+    with _BRUKER_TEMPLATES_LOCK:
+        _BRUKER_TEMPLATES[key] = template
+        while len(_BRUKER_TEMPLATES) > _BRUKER_TEMPLATES_SIZE:
+            _BRUKER_TEMPLATES.popitem(last=False)
+    return template.copy()
+
+def encode_bruker_frame(fheader, fdata):
+    '''
+     encode a bruker image
+      - fheader: header dict (see bruker_header) or BrukerHeader
+      - fdata is clipped in place (overflow tables)
+      - returns the file content as a list of bytes
     '''
     import numpy as np
     
@@ -335,98 +868,6 @@ def write_bruker_frame(fname, fheader, fdata):
         padded[:table.size] = table
         return padded
         
-    def format_bruker_header(fheader):
-        '''
-         
-        '''
-        format_dict = {(1,   'int64'): '{:<71d} ',
-                       (2,   'int64'): '{:<35d} {:<35d} ',
-                       (3,   'int64'): '{:<23d} {:<23d} {:<23d} ',
-                       (4,   'int64'): '{:<17d} {:<17d} {:<17d} {:<17d} ',
-                       (5,   'int64'): '{:<13d} {:<13d} {:<13d} {:<13d} {:<13d}   ',
-                       (6,   'int64'): '{:<11d} {:<11d} {:<11d} {:<11d} {:<11d} {:<11d} ',
-                       (1,   'int32'): '{:<71d} ',
-                       (2,   'int32'): '{:<35d} {:<35d} ',
-                       (3,   'int32'): '{:<23d} {:<23d} {:<23d} ',
-                       (4,   'int32'): '{:<17d} {:<17d} {:<17d} {:<17d} ',
-                       (5,   'int32'): '{:<13d} {:<13d} {:<13d} {:<13d} {:<13d}   ',
-                       (6,   'int32'): '{:<11d} {:<11d} {:<11d} {:<11d} {:<11d} {:<11d} ',
-                       (1, 'float64'): '{:<71f} ',
-                       (2, 'float64'): '{:<35f} {:<35f} ',
-                       (3, 'float64'): '{:<23f} {:<23f} {:<23f} ',
-                       (4, 'float64'): '{:<17f} {:<17f} {:<17f} {:<17f} ',
-                       (5, 'float64'): '{:<13f} {:<13f} {:<13f} {:<13f} {:<15f} '}
-    
-        headers = []
-        for name, entry in fheader.items():
-            # TITLE has multiple lines
-            if name == 'TITLE':
-                name = '{:<7}:'.format(name)
-                number = len(entry)
-                for line in range(8):
-                    if number < line:
-                        headers.append(''.join((name, '{:<72}'.format(entry[line]))))
-                    else:
-                        headers.append(''.join((name, '{:<72}'.format(' '))))
-                continue
-    
-            # DETTYPE Mixes Entry Types
-            if name == 'DETTYPE':
-                name = '{:<7}:'.format(name)
-                string = '{:<20s} {:<11f} {:<11f} {:<1d} {:<11f} {:<10f} {:<1d} '.format(*entry)
-                headers.append(''.join((name, string)))
-                continue
-            
-            # format the name
-            name = '{:<7}:'.format(name)
-            
-            # pad entries
-            if type(entry) == list or type(entry) == str:
-                headers.append(''.join(name + '{:<72}'.format(entry[0])))
-                continue
-            
-            # fill empty fields
-            if entry.shape[0] == 0:
-                headers.append(name + '{:72}'.format(' '))
-                continue
-            
-            # if line has too many entries e.g.
-            # OCTMASK(8): np.int64
-            # CELL(6), MATRIX(9), DETPAR(6), ESDCELL(6): np.float64
-            # write the first 6 (np.int64) / 5 (np.float64) entries
-            # and the remainder in a new line/entry
-            if entry.shape[0] > 6 and entry.dtype == np.int64:
-                while entry.shape[0] > 6:
-                    format_string = format_dict[(6, str(entry.dtype))]
-                    headers.append(''.join(name + format_string.format(*entry[:6])))
-                    entry = entry[6:]
-            elif entry.shape[0] > 5 and entry.dtype == np.float64:
-                while entry.shape[0] > 5:
-                    format_string = format_dict[(5, str(entry.dtype))]
-                    headers.append(''.join(name + format_string.format(*entry[:5])))
-                    entry = entry[5:]
-            
-            # format line
-            format_string = format_dict[(entry.shape[0], str(entry.dtype))]
-            headers.append(''.join(name + format_string.format(*entry)))
-    
-        # add header ending
-        if headers[-1][:3] == 'CFR':
-            headers = headers[:-1]
-        padding = 512 - (len(headers) * 80 % 512)
-        end = '\x1a\x04'
-        if padding <= 80:
-            start = 'CFR: HDR: IMG: '
-            padding -= len(start) + 2
-            dots = ''.join(['.'] * padding)
-            headers.append(start + dots + end)
-        else:
-            while padding > 80:
-                headers.append(end + ''.join(['.'] * 78))
-                padding -= 80
-            if padding != 0:
-                headers.append(end + ''.join(['.'] * (padding - 2)))
-        return ''.join(headers)
     ########################
     ## write_bruker_frame ##
     ##   FUNCTIONS END    ##
@@ -446,45 +887,67 @@ def write_bruker_frame(fname, fheader, fdata):
                  -2: np.int16,
                  -4: np.int32}
     
+    # the header is rendered once, only the
+    # overflow counts are patched in
+    if not isinstance(fheader, BrukerHeader):
+        fheader = BrukerHeader(fheader)
+    
     # read the bytes per pixel
     # frame data (bpp), underflow table (bpp_u)
     bpp, bpp_u = fheader['NPIXELB']
+    noverfl = list(fheader['NOVERFL'])
     
     # generate underflow table
     # does not work as APEXII reads the data as uint8/16/32!
-    if fheader['NOVERFL'][0] >= 0:
+    if noverfl[0] >= 0:
         data_underflow = fdata[fdata <= 0]
-        fheader['NOVERFL'][0] = data_underflow.shape[0]
+        noverfl[0] = data_underflow.shape[0]
         table_underflow = pad_table(data_underflow, -1 * bpp_u)
         fdata[fdata < 0] = 0
 
-    # generate 32 bit overflow table
+    # generate the overflow tables
+    # - a single pass finds all pixels that do not fit
+    #   the main image, the tables are built from those
+    flat = fdata.reshape(-1)
     if bpp < 4:
-        data_over_uint16 = fdata[fdata >= 65535]
+        limit = 255 if bpp < 2 else 65535
+        over = np.flatnonzero(flat >= limit)
+        data_over = flat[over]
+        
+        # generate 32 bit overflow table
+        data_over_uint16 = data_over[data_over >= 65535]
         table_data_uint32 = pad_table(data_over_uint16, 4)
-        fheader['NOVERFL'][2] = data_over_uint16.shape[0]
-        fdata[fdata >= 65535] = 65535
-
-    # generate 16 bit overflow table
-    if bpp < 2:
-        data_over_uint8 = fdata[fdata >= 255]
-        table_data_uint16 = pad_table(data_over_uint8, 2)
-        fheader['NOVERFL'][1] = data_over_uint8.shape[0]
-        fdata[fdata >= 255] = 255
+        noverfl[2] = data_over_uint16.shape[0]
+        
+        # generate 16 bit overflow table
+        if bpp < 2:
+            data_over_uint8 = np.minimum(data_over, 65535)
+            table_data_uint16 = pad_table(data_over_uint8, 2)
+            noverfl[1] = data_over_uint8.shape[0]
+        flat[over] = limit
+    fheader.fill('NOVERFL', noverfl)
 
     # shrink data to desired bpp
-    fdata = fdata.astype(_BPP_TO_DT[bpp])
-    
-    # write frame
+    fdata = flat.astype(_BPP_TO_DT[bpp])
+    
+    # encode frame
+    chunks = [fheader.tobytes(), fdata.tobytes()]
+    if noverfl[0] >= 0:
+        chunks.append(table_underflow.tobytes())
+    if bpp < 2 and noverfl[1] > 0:
+        chunks.append(table_data_uint16.tobytes())
+    if bpp < 4 and noverfl[2] > 0:
+        chunks.append(table_data_uint32.tobytes())
+    return chunks
+
+def write_bruker_frame(fname, fheader, fdata):
+    '''
+     write a bruker image
+      - fheader: header dict (see bruker_header) or BrukerHeader
+    '''
+    chunks = encode_bruker_frame(fheader, fdata)
     with open(fname, 'wb') as brukerFrame:
-        brukerFrame.write(format_bruker_header(fheader).encode('ASCII'))
-        brukerFrame.write(fdata.tobytes())
-        if fheader['NOVERFL'][0] >= 0:
-            brukerFrame.write(table_underflow.tobytes())
-        if bpp < 2 and fheader['NOVERFL'][1] > 0:
-            brukerFrame.write(table_data_uint16.tobytes())
-        if bpp < 4 and fheader['NOVERFL'][2] > 0:
-            brukerFrame.write(table_data_uint32.tobytes())
+        brukerFrame.writelines(chunks)
 
 def fix_bad_pixel(data, flag, bad_int=-2, sat_val=2**20):
     '''
@@ -568,11 +1031,25 @@ def get_run_info(basename):
     stem = basename[:-6]
     return stem, runNum, frmNum, 3
     
-def convert_frame_APS_Bruker(fname, path_sfrm, rows=1043, cols=981, offset=4096, overwrite=True, beamflux=None):
+def get_sfrm_name(fname):
+    '''
+     output file name of a frame: some_name_rr_ffff.sfrm
+      - compression extensions (.gz, .bz2, ...) are ignored
+    '''
+    import os
+    from p3fc.lib.decompress import compression_of
+    frame_name = os.path.basename(fname)
+    if compression_of(frame_name) is not None:
+        frame_name = os.path.splitext(frame_name)[0]
+    basename, ext = os.path.splitext(frame_name)
+    frame_stem, frame_run, frame_num, _ = get_run_info(basename)
+    return '{}_{:>02}_{:>04}.sfrm'.format(frame_stem, frame_run, frame_num)
+
+def convert_frame_APS_Bruker(fname, path_sfrm, rows=1043, cols=981, offset=4096, overwrite=True, beamflux=None, nframes=None, write=write_bruker_frame):
     '''
     
     '''
-    import os, re
+    import os
     import numpy as np
     from datetime import datetime as dt
     
@@ -582,7 +1059,7 @@ def convert_frame_APS_Bruker(fname, path_sfrm, rows=1043, cols=981, offset=4096,
     frame_stem, frame_run, frame_num, _ = get_run_info(basename)
     
     # output file format: some_name_rr_ffff.sfrm
-    outName = os.path.join(path_to, path_sfrm, '{}_{:>02}_{:>04}.sfrm'.format(frame_stem, frame_run, frame_num))
+    outName = os.path.join(path_to, path_sfrm, get_sfrm_name(frame_name))
 
     # check if file exists and overwrite flag
     if os.path.exists(outName) and overwrite == False:
@@ -591,36 +1068,26 @@ def convert_frame_APS_Bruker(fname, path_sfrm, rows=1043, cols=981, offset=4096,
     # read in the frame
     header, data = read_pilatus_tif(fname, rows, cols, offset, np.int32)
     
-    # get the frame saint ready 
+    # get the frame saint ready in one go
     # - pad with zeros
-    data, offset_rows, offset_cols = pilatus_pad(data)
-    
-    # the frame has to be rotated by 90 degrees
-    data = np.rot90(data, k=1, axes=(1, 0))
-    
-    # the dead areas are flagged -1
-    data[data == -1] = 0
-    # bad pixels are flagged -2
-    data[data == -2] = 0
-    
-    # scale the data to avoid underflow tables
-    # should yield zero for Pilatus3 images!
-    baseline_offset = -1 * data.min()
-    data += baseline_offset
+    # - the frame has to be rotated by 90 degrees
+    # - the dead areas (-1) and bad pixels (-2) are set to 0
+    # - scale the data to avoid underflow tables
+    data, offset_rows, offset_cols, baseline_offset, stats = frame_transform(data, rotate=True)
     
     # extract scan info from tif header
-    scan_flx = float(re.search(r'Flux\s+(\d+\.\d+)', header).groups()[0])
-    scan_ext = float(re.search(r'Exposure_time\s+(\d+\.\d+)\s+s', header).groups()[0])
-    scan_exp = float(re.search(r'Exposure_period\s+(\d+\.\d+)\s+s', header).groups()[0])
-    goni_dxt = float(re.search(r'Detector_distance\s+(\d+\.\d+)\s+m', header).groups()[0]) * 1000.0
-    source_w = float(re.search(r'Wavelength\s+(\d+\.\d+)\s+A', header).groups()[0])
-    goni_omg = float(re.search(r'Omega\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    goni_kap = float(re.search(r'Kappa\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    goni_phi = float(re.search(r'Phi\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    goni_alp = float(re.search(r'Alpha\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    scan_inc = float(re.search(r'Phi_increment\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    temp     = re.search(r'Beam_xy\s+\((\d+\.\d+),\s+(\d+\.\d+)\)\s+pixels', header).groups()
-    p_x, p_y = float(temp[0]), float(temp[1])
+    header = parse_pilatus_header(header)
+    scan_flx = header['Flux']
+    scan_ext = header['Exposure_time']
+    scan_exp = header['Exposure_period']
+    goni_dxt = header['Detector_distance'] * 1000.0
+    source_w = header['Wavelength']
+    goni_omg = header['Omega']
+    goni_kap = header['Kappa']
+    goni_phi = header['Phi']
+    goni_alp = header['Alpha']
+    scan_inc = header['Phi_increment']
+    p_x, p_y = header['Beam_xy']
     
     # convert Kappa to Euler geometry
     goni_omg, goni_chi, goni_phi = kappa_to_euler(goni_omg, goni_kap, goni_alp, goni_phi)
@@ -650,64 +1117,78 @@ def convert_frame_APS_Bruker(fname, path_sfrm, rows=1043, cols=981, offset=4096,
         except IndexError:
             print('WARNING: Beamflux not found for {}!'.format(basename))
     
-    # default bruker header
-    header = bruker_header()
-    
-    # fill known header items
-    header['NCOLS']      = [data.shape[1]]                           # Number of pixels per row; number of mosaic tiles in X; dZ/dX
-    header['NROWS']      = [data.shape[0]]                           # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
-    header['CENTER'][:]  = [beam_x, beam_y, beam_x, beam_y]          # 
-    header['CCDPARM'][:] = [0.00, 1.00, 1.00, 1.00, 1169523]
-    header['DETPAR'][:]  = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-    header['DETTYPE'][:] = ['PILATUS3-1M', pix_per_512, 0.00, 0, 0.001, 0.0, 0]
-    header['SITE']       = ['ANL/APS/15ID-D']                        # Site name
-    header['MODEL']      = ['Synchrotron']                           # Diffractometer model
-    header['TARGET']     = ['Undulator']                             # X-ray target material)
-    header['USER']       = ['USER']                                  # Username
-    header['SOURCEK']    = ['?']                                     # X-ray source kV
-    header['SOURCEM']    = ['?']                                     # Source milliamps
-    header['WAVELEN'][:] = [source_w, source_w, source_w]            # Wavelengths (average, a1, a2)
+    # number of frames in the series: {stem: {run: frames}} (see catalog.py)
+    scan_num = '?'
+    if nframes is not None:
+        scan_num = nframes.get(frame_stem, {}).get(frame_run, '?')
+    
+    # the static entries are rendered once per run
+    def static_header():
+        # default bruker header
+        header = bruker_header()
+        
+        # fill known header items
+        header['NCOLS']      = [data.shape[1]]                           # Number of pixels per row; number of mosaic tiles in X; dZ/dX
+        header['NROWS']      = [data.shape[0]]                           # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
+        header['CENTER'][:]  = [beam_x, beam_y, beam_x, beam_y]          # 
+        header['CCDPARM'][:] = [0.00, 1.00, 1.00, 1.00, 1169523]
+        header['DETPAR'][:]  = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+        header['DETTYPE'][:] = ['PILATUS3-1M', pix_per_512, 0.00, 0, 0.001, 0.0, 0]
+        header['SITE']       = ['ANL/APS/15ID-D']                        # Site name
+        header['MODEL']      = ['Synchrotron']                           # Diffractometer model
+        header['TARGET']     = ['Undulator']                             # X-ray target material)
+        header['USER']       = ['USER']                                  # Username
+        header['SOURCEK']    = ['?']                                     # X-ray source kV
+        header['SOURCEM']    = ['?']                                     # Source milliamps
+        header['WAVELEN'][:] = [source_w, source_w, source_w]            # Wavelengths (average, a1, a2)
+        header['CUMULAT']    = [scan_exp]                                # Accumulated exposure time in real hours
+        header['ELAPSDR']    = [scan_ext]                                # Requested time for this frame in seconds
+        header['ELAPSDA']    = [scan_exp]                                # Actual time for this frame in seconds
+        header['TYPE']       = ['Generic Phi Scan']                      # String indicating kind of data in the frame
+        header['DISTANC']    = [goni_dxt / 10.0]                         # Sample-detector distance, cm
+        header['RANGE']      = [abs(scan_inc)]                           # Magnitude of scan range in decimal degrees
+        header['INCREME']    = [scan_inc]                                # Signed scan angle increment between frames
+        header['NFRAMES']    = [scan_num]                                # Number of frames in the series
+        header['AXIS'][:]    = [3]                                       # Scan axis (1=2-theta, 2=omega, 3=phi, 4=chi)
+        header['LOWTEMP'][:] = [1, int((-273.15 + 20.0) * 100.0), -6000] # Low temp flag; experiment temperature*100; detector temp*100
+        header['NPIXELB'][:] = [1, 1]                                    # bytes/pixel in main image, bytes/pixel in underflow table
+        header['NSTEPS']     = [1]                                       # steps or oscillations in this frame
+        header['COMPRES']    = ['NONE']                                  # compression scheme if any
+        header['TRAILER']    = [0]                                       # byte pointer to trailer info
+        header['LINEAR'][:]  = [1.00, 0.00]     
+        header['PHD'][:]     = [1.00, 0.00]
+        header['OCTMASK'][:] = [0, 0, 0, 1023, 1023, 2046, 1023, 1023]
+        header['DISPLIM'][:] = [0.0, 63.0]                               # Recommended display contrast window settings
+        header['FILTER2'][:] = [90.0, 0.0, 0.0, 1.0]                     # Monochromator 2-theta, roll (both deg)
+        return header
+    
+    # header with the static entries of this run
+    header = bruker_header_template(('APS', data.shape, beam_x, beam_y, pix_per_512, source_w, scan_ext, scan_exp, goni_dxt, scan_inc, scan_num), static_header)
+    
+    # fill the frame specific header items
     header['FILENAM']    = [basename]
-    header['CUMULAT']    = [scan_exp]                                # Accumulated exposure time in real hours
-    header['ELAPSDR']    = [scan_ext]                                # Requested time for this frame in seconds
-    header['ELAPSDA']    = [scan_exp]                                # Actual time for this frame in seconds
-    header['START'][:]   = scan_sta                                  # Starting scan angle value, decimal deg
-    header['ANGLES'][:]  = [goni_tth, goni_omg, scan_sta, goni_chi]  # Diffractometer setting angles, deg. (2Th, omg, phi, chi)
-    header['ENDING'][:]  = [goni_tth, goni_omg, scan_end, goni_chi]  # Setting angles read at end of scan
-    header['TYPE']       = ['Generic Phi Scan']                      # String indicating kind of data in the frame
-    header['DISTANC']    = [goni_dxt / 10.0]                         # Sample-detector distance, cm
-    header['RANGE']      = [abs(scan_inc)]                           # Magnitude of scan range in decimal degrees
-    header['INCREME']    = [scan_inc]                                # Signed scan angle increment between frames
-    header['NUMBER']     = [frame_num]                               # Number of this frame in series (zero-based)
-    header['NFRAMES']    = ['?']                                     # Number of frames in the series
-    header['AXIS'][:]    = [3]                                       # Scan axis (1=2-theta, 2=omega, 3=phi, 4=chi)
-    header['LOWTEMP'][:] = [1, int((-273.15 + 20.0) * 100.0), -6000] # Low temp flag; experiment temperature*100; detector temp*100
-    header['NEXP'][2]    = baseline_offset
-    header['MAXXY']      = np.array(np.where(data == data.max()), float)[:, 0]
-    header['MAXIMUM']    = [np.max(data)]
-    header['MINIMUM']    = [np.min(data)]
-    header['NCOUNTS'][:] = [data.sum(), scan_flx]
-    header['NPIXELB'][:] = [1, 1]                                    # bytes/pixel in main image, bytes/pixel in underflow table
-    header['NOVER64'][:] = [data[data > 64000].shape[0], 0, 0]
-    header['NSTEPS']     = [1]                                       # steps or oscillations in this frame
-    header['COMPRES']    = ['NONE']                                  # compression scheme if any
-    header['TRAILER']    = [0]                                       # byte pointer to trailer info
-    header['LINEAR'][:]  = [1.00, 0.00]     
-    header['PHD'][:]     = [1.00, 0.00]
-    header['OCTMASK'][:] = [0, 0, 0, 1023, 1023, 2046, 1023, 1023]
-    header['DISPLIM'][:] = [0.0, 63.0]                               # Recommended display contrast window settings
-    header['FILTER2'][:] = [90.0, 0.0, 0.0, 1.0]                     # Monochromator 2-theta, roll (both deg)
+    header.fill('START', scan_sta)                                          # Starting scan angle value, decimal deg
+    header.fill('ANGLES', [goni_tth, goni_omg, scan_sta, goni_chi])         # Diffractometer setting angles, deg. (2Th, omg, phi, chi)
+    header.fill('ENDING', [goni_tth, goni_omg, scan_end, goni_chi])         # Setting angles read at end of scan
+    header['NUMBER']     = [frame_num]                                      # Number of this frame in series (zero-based)
+    header.fill('NEXP', baseline_offset, 2)
+    header['MAXXY']      = np.array(stats.maxxy, float)
+    header['MAXIMUM']    = [stats.maximum]
+    header['MINIMUM']    = [stats.minimum]
+    header.fill('NCOUNTS', [stats.counts, scan_flx])
+    header.fill('NOVER64', [stats.nover64, 0, 0])
     header['CREATED']    = [dt.fromtimestamp(os.path.getmtime(fname)).strftime('%Y-%m-%d %H:%M:%S')]# use creation time of raw data!
     
     # write the frame
-    write_bruker_frame(outName, header, data)
+    # - write_bruker_frame or a pipeline writer stage (see convert.py)
+    write(outName, header, data)
     return True
 
-def convert_frame_SP8_Bruker(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=981, offset=4096, overwrite=True, source_w=None):
+def convert_frame_SP8_Bruker(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=981, offset=4096, overwrite=True, source_w=None, write=write_bruker_frame):
     '''
      
     '''
-    import os, re
+    import os
     import numpy as np
     from datetime import datetime as dt
     
@@ -717,7 +1198,7 @@ def convert_frame_SP8_Bruker(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=981
     frame_stem, frame_run, frame_num, _ = get_run_info(basename)
     
     # output file format: some_name_rr_ffff.sfrm
-    outName = os.path.join(path_to, path_sfrm, '{}_{:>02}_{:>04}.sfrm'.format(frame_stem, frame_run, frame_num))
+    outName = os.path.join(path_to, path_sfrm, get_sfrm_name(frame_name))
 
     # check if file exists and overwrite flag
     if os.path.exists(outName) and overwrite == False:
@@ -726,52 +1207,34 @@ def convert_frame_SP8_Bruker(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=981
     # read in the frame
     _, data = read_pilatus_tif(fname, rows, cols, offset, np.int32)
     
-    # get the frame saint ready
+    # get the frame saint ready in one go
     # - pad with zeros
-    data, offset_rows, offset_cols = pilatus_pad(data)
-    
-    # the frame has to be rotated by 90 degrees
-    data = np.rot90(data, k=1, axes=(1, 0))
-
-    # sloppy simulation of a detector drift
-    #data = np.roll(data, (frame_run//2, frame_run), axis=(0,1))
-    
-    # the dead areas are flagged -1
-    data[data == -1] = 0
-    
-    # bad pixels are flagged -2
-    data[data == -2] = 0
-    
-    # scale the data to avoid underflow tables
-    # should yield zero for Pilatus3 images!
-    baseline_offset = -1 * data.min()
-    data += baseline_offset
+    # - the frame has to be rotated by 90 degrees
+    # - the dead areas (-1) and bad pixels (-2) are set to 0
+    # - scale the data to avoid underflow tables
+    data, offset_rows, offset_cols, baseline_offset, stats = frame_transform(data, rotate=True)
     
     # info file name
     infFile = os.path.join(path_to, basename + '.inf')
     
-    # check if info file exists
-    if not os.path.isfile(infFile):
+    # extract header information
+    # - the .inf files are parsed once and cached
+    try:
+        inf = read_sp8_inf(infFile)
+    except FileNotFoundError:
         print('ERROR: Info file is missing for: {}'.format(frame_name))
         return False
-    
-    # extract header information
-    with open(infFile) as rFile:
-        infoFile = rFile.read()
-        #det_dim_x = int(re.search(r'SIZE1\s*=\s*(\d+)\s*;', infoFile).groups()[0])
-        #det_dim_y = int(re.search(r'SIZE2\s*=\s*(\d+)\s*;', infoFile).groups()[0])
-        #det_size_x, det_size_y = [float(i) for i in re.search(r'CCD_DETECTOR_SIZE\s*=\s*(\d+\.\d+)\s*(\d+\.\d+)\s*;', infoFile).groups()]
-        det_beam_x, det_beam_y = [float(i) for i in re.search(r'CCD_SPATIAL_BEAM_POSITION\s*=\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*;', infoFile).groups()]
-        det_maxv = int(re.search(r'SATURATED_VALUE\s*=\s*(\d+)\s*;', infoFile).groups()[0])
-        if source_w is None:
-            source_w = float(re.search(r'SCAN_WAVELENGTH\s*=\s*(\d+\.\d+)\s*;', infoFile).groups()[0])
-        source_a = float(re.search(r'SOURCE_AMPERAGE\s*=\s*(\d+\.\d+)\s*mA\s*;', infoFile).groups()[0])
-        source_v = float(re.search(r'SOURCE_VOLTAGE\s*=\s*(\d+\.\d+)\s*GeV\s*;', infoFile).groups()[0])
-        goni_omg, goni_chi, goni_phi = [float(i) for i in re.search(r'CRYSTAL_GONIO_VALUES\s*=\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*;', infoFile).groups()]
-        goni_tth, goni_dxt = [float(i) for i in re.search(r'SCAN_DET_RELZERO\s*=\s*-*\d+\.\d+\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*;', infoFile).groups()]
-        scan_rax = str(re.search(r'ROTATION_AXIS_NAME\s*=\s*(\w+)\s*;', infoFile).groups()[0])
-        scan_num = float(re.search(r'SCAN_SEQ_INFO\s*=\s*\d+\s*\d+\s*(\d+)\s*;', infoFile).groups()[0])
-        scan_sta, scan_end, scan_inc, scan_exp = [float(i) for i in re.search(r'SCAN_ROTATION\s*=\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*-*\d+\.\d+\s*-*\d+\.\d+\s*-*\d+\.\d+\s*-*\d+\.\d+\s*-*\d+\.\d+\s*-*\d+\.\d+\s*;', infoFile).groups()]
+    det_beam_x, det_beam_y = inf.beam_x, inf.beam_y
+    det_maxv = inf.saturation
+    if source_w is None:
+        source_w = inf.wavelength
+    source_a = inf.amperage
+    source_v = inf.voltage
+    goni_omg, goni_chi, goni_phi = inf.omega, inf.chi, inf.phi
+    goni_tth, goni_dxt = inf.tth, inf.distance
+    scan_rax = inf.axis
+    scan_num = inf.nframes
+    scan_sta, scan_end, scan_inc, scan_exp = inf.scan_start, inf.scan_end, inf.scan_inc, inf.scan_exp
     
     # For some reason the distance is missing for some runs.
     # At SPring-8 the detector distance 'cannot' be changed.
@@ -804,70 +1267,79 @@ def convert_frame_SP8_Bruker(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=981
     axis_end = [goni_tth, goni_omg, goni_phi, goni_chi]
     axis_end[ax_name_to_num[scan_rax]-1] = scan_end
     
-    # default bruker header
-    header = bruker_header()
-    
-    # fill known header items
-    header['NROWS'][:]   = [data.shape[0], 2]                                   # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
-    header['NCOLS'][:]   = [data.shape[1], 5]                                   # Number of pixels per row; number of mosaic tiles in X; dZ/dX
-    header['CENTER'][:]  = [beam_x, beam_y, beam_x, beam_y]                     # adjust the beam center for the filling/cutting of the frame
-    header['CCDPARM'][:] = [1.00, 1.00, 1.00, 0.00, det_maxv]                   # readnoise, electronsperadu, electronsperphoton, bruker_bias, bruker_fullscale
-    header['DETPAR'][:]  = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]                       # Detector position corrections (Xc, Yc, Dist, Pitch, Roll, Yaw)
-    header['DETTYPE'][:] = ['PILATUS3-1M', pix_per_512, 0.001, 0, 0.001, 0.001, 1]
-    header['SITE']       = ['SPring-8/BL02B1']                                  # Site name
-    header['MODEL']      = ['Synchrotron']                                      # Diffractometer model
-    header['TARGET']     = ['Bending Magnet']                                   # X-ray target material)
-    header['USER']       = ['USER']                                             # Username
-    header['SOURCEK']    = [source_v]                                           # X-ray source kV
-    header['SOURCEM']    = [source_a]                                           # Source milliamps
-    header['WAVELEN'][:] = [source_w, source_w, source_w]                       # Wavelengths (average, a1, a2)
+    # the static entries are rendered once per run
+    def static_header():
+        # default bruker header
+        header = bruker_header()
+        
+        # fill known header items
+        header['NROWS'][:]   = [data.shape[0], 2]                                   # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
+        header['NCOLS'][:]   = [data.shape[1], 5]                                   # Number of pixels per row; number of mosaic tiles in X; dZ/dX
+        header['CENTER'][:]  = [beam_x, beam_y, beam_x, beam_y]                     # adjust the beam center for the filling/cutting of the frame
+        header['CCDPARM'][:] = [1.00, 1.00, 1.00, 0.00, det_maxv]                   # readnoise, electronsperadu, electronsperphoton, bruker_bias, bruker_fullscale
+        header['DETPAR'][:]  = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]                       # Detector position corrections (Xc, Yc, Dist, Pitch, Roll, Yaw)
+        header['DETTYPE'][:] = ['PILATUS3-1M', pix_per_512, 0.001, 0, 0.001, 0.001, 1]
+        header['SITE']       = ['SPring-8/BL02B1']                                  # Site name
+        header['MODEL']      = ['Synchrotron']                                      # Diffractometer model
+        header['TARGET']     = ['Bending Magnet']                                   # X-ray target material)
+        header['USER']       = ['USER']                                             # Username
+        header['SOURCEK']    = [source_v]                                           # X-ray source kV
+        header['SOURCEM']    = [source_a]                                           # Source milliamps
+        header['WAVELEN'][:] = [source_w, source_w, source_w]                       # Wavelengths (average, a1, a2)
+        header['CUMULAT']    = [scan_exp]                                           # Accumulated exposure time in real hours
+        header['ELAPSDR']    = [scan_exp]                                           # Requested time for this frame in seconds
+        header['ELAPSDA']    = [scan_exp]                                           # Actual time for this frame in seconds
+        header['TYPE']       = ['Generic {} Scan'.format(scan_rax)]                 # String indicating kind of data in the frame
+        header['DISTANC']    = [float(goni_dxt) / 10.0]                             # Sample-detector distance, cm
+        header['RANGE']      = [abs(scan_inc)]                                      # Magnitude of scan range in decimal degrees
+        header['INCREME']    = [scan_inc]                                           # Signed scan angle increment between frames
+        header['NFRAMES']    = [int(scan_num)]                                      # Number of frames in the series
+        header['AXIS'][:]    = [ax_name_to_num[scan_rax]]                           # Scan axis (1=2-theta, 2=omega, 3=phi, 4=chi)
+        header['LOWTEMP'][:] = [1, int((-273.15 + 20.0) * 100.0), -6000]            # Low temp flag; experiment temperature*100; detector temp*100
+        header['NSTEPS']     = [1]                                                  # steps or oscillations in this frame
+        header['NPIXELB'][:] = [1, 1]                                               # bytes/pixel in main image, bytes/pixel in underflow table
+        header['COMPRES']    = ['NONE']                                             # compression scheme if any
+        header['TRAILER']    = [-1]                                                 # byte pointer to trailer info
+        header['LINEAR'][:]  = [1.00, 0.00]                                         # bruker_linearscale, bruker_linearoffset
+        header['PHD'][:]     = [1.00, 0.10]                                         # Phosphor efficiency, phosphor thickness
+        header['PREAMP']     = [1]                                                  # Preamp gain setting
+        header['CORRECT']    = ['INTERNAL']                                         # Flood correction filename
+        header['DARK']       = ['INTERNAL']                                         # Dark current frame name
+        header['WARPFIL']    = ['LINEAR']                                           # Spatial correction filename
+        ox = data.shape[1]
+        oy = data.shape[0]
+        header['OCTMASK'][:] = [0, 0, 0, ox-1, ox-1, ox+oy-1, oy-1, oy-1]           # Octagon mask parameters (GADDS) #min x, min x+y, min y, max x-y, max x, max x+y, max y, max y-x
+        header['DISPLIM'][:] = [0.0, 100.0]                                         # Recommended display contrast window settings
+        header['FILTER2'][:] = [90.0, 0.0, 0.0, 1.0]                                # Monochromator 2-theta, roll (both deg)
+        return header
+    
+    # header with the static entries of this run
+    header = bruker_header_template(('SP8', data.shape, beam_x, beam_y, det_maxv, pix_per_512, source_v, source_a, source_w, scan_exp, scan_rax, goni_dxt, scan_inc, scan_num), static_header)
+    
+    # fill the frame specific header items
     header['FILENAM']    = [basename]
-    header['CUMULAT']    = [scan_exp]                                           # Accumulated exposure time in real hours
-    header['ELAPSDR']    = [scan_exp]                                           # Requested time for this frame in seconds
-    header['ELAPSDA']    = [scan_exp]                                           # Actual time for this frame in seconds
-    header['START'][:]   = scan_sta                                             # Starting scan angle value, decimal deg
-    header['ANGLES'][:]  = axis_start                                           # Diffractometer setting angles, deg. (2Th, omg, phi, chi)
-    header['ENDING'][:]  = axis_end                                             # Setting angles read at end of scan
-    header['TYPE']       = ['Generic {} Scan'.format(scan_rax)]                 # String indicating kind of data in the frame
-    header['DISTANC']    = [float(goni_dxt) / 10.0]                             # Sample-detector distance, cm
-    header['RANGE']      = [abs(scan_inc)]                                      # Magnitude of scan range in decimal degrees
-    header['INCREME']    = [scan_inc]                                           # Signed scan angle increment between frames
-    header['NUMBER']     = [frame_num]                                          # Number of this frame in series (zero-based)
-    header['NFRAMES']    = [int(scan_num)]                                      # Number of frames in the series
-    header['AXIS'][:]    = [ax_name_to_num[scan_rax]]                           # Scan axis (1=2-theta, 2=omega, 3=phi, 4=chi)
-    header['LOWTEMP'][:] = [1, int((-273.15 + 20.0) * 100.0), -6000]            # Low temp flag; experiment temperature*100; detector temp*100
-    header['NEXP'][2]    = baseline_offset
-    header['MAXXY']      = np.array(np.where(data == data.max()), float)[:, 0]
-    header['MAXIMUM']    = [np.max(data)]
-    header['MINIMUM']    = [np.min(data)]
-    header['NCOUNTS'][:] = [data.sum(), 0]
-    header['NOVER64'][:] = [data[data > 64000].shape[0], 0, 0]
-    header['NSTEPS']     = [1]                                                  # steps or oscillations in this frame
-    header['NPIXELB'][:] = [1, 1]                                               # bytes/pixel in main image, bytes/pixel in underflow table
-    header['COMPRES']    = ['NONE']                                             # compression scheme if any
-    header['TRAILER']    = [-1]                                                 # byte pointer to trailer info
-    header['LINEAR'][:]  = [1.00, 0.00]                                         # bruker_linearscale, bruker_linearoffset
-    header['PHD'][:]     = [1.00, 0.10]                                         # Phosphor efficiency, phosphor thickness
-    header['PREAMP']     = [1]                                                  # Preamp gain setting
-    header['CORRECT']    = ['INTERNAL']                                         # Flood correction filename
-    header['DARK']       = ['INTERNAL']                                         # Dark current frame name
-    header['WARPFIL']    = ['LINEAR']                                           # Spatial correction filename
-    ox = data.shape[1]
-    oy = data.shape[0]
-    header['OCTMASK'][:] = [0, 0, 0, ox-1, ox-1, ox+oy-1, oy-1, oy-1]           # Octagon mask parameters (GADDS) #min x, min x+y, min y, max x-y, max x, max x+y, max y, max y-x
-    header['DISPLIM'][:] = [0.0, 100.0]                                         # Recommended display contrast window settings
-    header['FILTER2'][:] = [90.0, 0.0, 0.0, 1.0]                                # Monochromator 2-theta, roll (both deg)
+    header.fill('START', scan_sta)                                          # Starting scan angle value, decimal deg
+    header.fill('ANGLES', axis_start)                                       # Diffractometer setting angles, deg. (2Th, omg, phi, chi)
+    header.fill('ENDING', axis_end)                                         # Setting angles read at end of scan
+    header['NUMBER']     = [frame_num]                                      # Number of this frame in series (zero-based)
+    header.fill('NEXP', baseline_offset, 2)
+    header['MAXXY']      = np.array(stats.maxxy, float)
+    header['MAXIMUM']    = [stats.maximum]
+    header['MINIMUM']    = [stats.minimum]
+    header.fill('NCOUNTS', [stats.counts, 0])
+    header.fill('NOVER64', [stats.nover64, 0, 0])
     header['CREATED']    = [dt.fromtimestamp(os.path.getmtime(fname)).strftime('%Y-%m-%d %H:%M:%S')]# use creation time of raw data!
     
     # write the frame
-    write_bruker_frame(outName, header, data)
+    # - write_bruker_frame or a pipeline writer stage (see convert.py)
+    write(outName, header, data)
     return True
 
-def convert_frame_SP8_Bruker_gz(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=981, offset=4096, overwrite=True, source_w=None):
+def convert_frame_SP8_Bruker_gz(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=981, offset=4096, overwrite=True, source_w=None, write=write_bruker_frame):
     '''
      
     '''
-    import os, re
+    import os
     import numpy as np
     from datetime import datetime as dt
     
@@ -878,7 +1350,7 @@ def convert_frame_SP8_Bruker_gz(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=
     frame_stem, frame_run, frame_num, _ = get_run_info(basename)
     
     # output file format: some_name_rr_ffff.sfrm
-    outName = os.path.join(path_to, path_sfrm, '{}_{:>02}_{:>04}.sfrm'.format(frame_stem, frame_run, frame_num))
+    outName = os.path.join(path_to, path_sfrm, get_sfrm_name(frame_name))
 
     # check if file exists and overwrite flag
     if os.path.exists(outName) and overwrite == False:
@@ -887,52 +1359,34 @@ def convert_frame_SP8_Bruker_gz(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=
     # read in the frame
     _, data = read_pilatus_tif_gz(fname, rows, cols, offset, np.int32)
     
-    # get the frame saint ready
+    # get the frame saint ready in one go
     # - pad with zeros
-    data, offset_rows, offset_cols = pilatus_pad(data)
-    
-    # the frame has to be rotated by 90 degrees
-    data = np.rot90(data, k=1, axes=(1, 0))
-
-    # sloppy simulation of a detector drift
-    #data = np.roll(data, (frame_run//2, frame_run), axis=(0,1))
-    
-    # the dead areas are flagged -1
-    data[data == -1] = 0
-    
-    # bad pixels are flagged -2
-    data[data == -2] = 0
-    
-    # scale the data to avoid underflow tables
-    # should yield zero for Pilatus3 images!
-    baseline_offset = -1 * data.min()
-    data += baseline_offset
+    # - the frame has to be rotated by 90 degrees
+    # - the dead areas (-1) and bad pixels (-2) are set to 0
+    # - scale the data to avoid underflow tables
+    data, offset_rows, offset_cols, baseline_offset, stats = frame_transform(data, rotate=True)
     
     # info file name
     infFile = os.path.join(path_to, basename + '.inf')
     
-    # check if info file exists
-    if not os.path.isfile(infFile):
+    # extract header information
+    # - the .inf files are parsed once and cached
+    try:
+        inf = read_sp8_inf(infFile)
+    except FileNotFoundError:
         print('ERROR: Info file is missing for: {}'.format(frame_name))
         return False
-    
-    # extract header information
-    with open(infFile) as rFile:
-        infoFile = rFile.read()
-        #det_dim_x = int(re.search(r'SIZE1\s*=\s*(\d+)\s*;', infoFile).groups()[0])
-        #det_dim_y = int(re.search(r'SIZE2\s*=\s*(\d+)\s*;', infoFile).groups()[0])
-        #det_size_x, det_size_y = [float(i) for i in re.search(r'CCD_DETECTOR_SIZE\s*=\s*(\d+\.\d+)\s*(\d+\.\d+)\s*;', infoFile).groups()]
-        det_beam_x, det_beam_y = [float(i) for i in re.search(r'CCD_SPATIAL_BEAM_POSITION\s*=\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*;', infoFile).groups()]
-        det_maxv = int(re.search(r'SATURATED_VALUE\s*=\s*(\d+)\s*;', infoFile).groups()[0])
-        if source_w is None:
-            source_w = float(re.search(r'SCAN_WAVELENGTH\s*=\s*(\d+\.\d+)\s*;', infoFile).groups()[0])
-        source_a = float(re.search(r'SOURCE_AMPERAGE\s*=\s*(\d+\.\d+)\s*mA\s*;', infoFile).groups()[0])
-        source_v = float(re.search(r'SOURCE_VOLTAGE\s*=\s*(\d+\.\d+)\s*GeV\s*;', infoFile).groups()[0])
-        goni_omg, goni_chi, goni_phi = [float(i) for i in re.search(r'CRYSTAL_GONIO_VALUES\s*=\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*;', infoFile).groups()]
-        goni_tth, goni_dxt = [float(i) for i in re.search(r'SCAN_DET_RELZERO\s*=\s*-*\d+\.\d+\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*;', infoFile).groups()]
-        scan_rax = str(re.search(r'ROTATION_AXIS_NAME\s*=\s*(\w+)\s*;', infoFile).groups()[0])
-        scan_num = float(re.search(r'SCAN_SEQ_INFO\s*=\s*\d+\s*\d+\s*(\d+)\s*;', infoFile).groups()[0])
-        scan_sta, scan_end, scan_inc, scan_exp = [float(i) for i in re.search(r'SCAN_ROTATION\s*=\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*(-*\d+\.\d+)\s*-*\d+\.\d+\s*-*\d+\.\d+\s*-*\d+\.\d+\s*-*\d+\.\d+\s*-*\d+\.\d+\s*-*\d+\.\d+\s*;', infoFile).groups()]
+    det_beam_x, det_beam_y = inf.beam_x, inf.beam_y
+    det_maxv = inf.saturation
+    if source_w is None:
+        source_w = inf.wavelength
+    source_a = inf.amperage
+    source_v = inf.voltage
+    goni_omg, goni_chi, goni_phi = inf.omega, inf.chi, inf.phi
+    goni_tth, goni_dxt = inf.tth, inf.distance
+    scan_rax = inf.axis
+    scan_num = inf.nframes
+    scan_sta, scan_end, scan_inc, scan_exp = inf.scan_start, inf.scan_end, inf.scan_inc, inf.scan_exp
     
     # For some reason the distance is missing for some runs.
     # At SPring-8 the detector distance 'cannot' be changed.
@@ -965,70 +1419,79 @@ def convert_frame_SP8_Bruker_gz(fname, path_sfrm, tth_corr=0.0, rows=1043, cols=
     axis_end = [goni_tth, goni_omg, goni_phi, goni_chi]
     axis_end[ax_name_to_num[scan_rax]-1] = scan_end
     
-    # default bruker header
-    header = bruker_header()
-    
-    # fill known header items
-    header['NROWS'][:]   = [data.shape[0], 2]                                   # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
-    header['NCOLS'][:]   = [data.shape[1], 5]                                   # Number of pixels per row; number of mosaic tiles in X; dZ/dX
-    header['CENTER'][:]  = [beam_x, beam_y, beam_x, beam_y]                     # adjust the beam center for the filling/cutting of the frame
-    header['CCDPARM'][:] = [1.00, 1.00, 1.00, 0.00, det_maxv]                   # readnoise, electronsperadu, electronsperphoton, bruker_bias, bruker_fullscale
-    header['DETPAR'][:]  = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]                       # Detector position corrections (Xc, Yc, Dist, Pitch, Roll, Yaw)
-    header['DETTYPE'][:] = ['PILATUS3-1M', pix_per_512, 0.001, 0, 0.001, 0.001, 1]
-    header['SITE']       = ['SPring-8/BL02B1']                                  # Site name
-    header['MODEL']      = ['Synchrotron']                                      # Diffractometer model
-    header['TARGET']     = ['Bending Magnet']                                   # X-ray target material)
-    header['USER']       = ['USER']                                             # Username
-    header['SOURCEK']    = [source_v]                                           # X-ray source kV
-    header['SOURCEM']    = [source_a]                                           # Source milliamps
-    header['WAVELEN'][:] = [source_w, source_w, source_w]                       # Wavelengths (average, a1, a2)
+    # the static entries are rendered once per run
+    def static_header():
+        # default bruker header
+        header = bruker_header()
+        
+        # fill known header items
+        header['NROWS'][:]   = [data.shape[0], 2]                                   # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
+        header['NCOLS'][:]   = [data.shape[1], 5]                                   # Number of pixels per row; number of mosaic tiles in X; dZ/dX
+        header['CENTER'][:]  = [beam_x, beam_y, beam_x, beam_y]                     # adjust the beam center for the filling/cutting of the frame
+        header['CCDPARM'][:] = [1.00, 1.00, 1.00, 0.00, det_maxv]                   # readnoise, electronsperadu, electronsperphoton, bruker_bias, bruker_fullscale
+        header['DETPAR'][:]  = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]                       # Detector position corrections (Xc, Yc, Dist, Pitch, Roll, Yaw)
+        header['DETTYPE'][:] = ['PILATUS3-1M', pix_per_512, 0.001, 0, 0.001, 0.001, 1]
+        header['SITE']       = ['SPring-8/BL02B1']                                  # Site name
+        header['MODEL']      = ['Synchrotron']                                      # Diffractometer model
+        header['TARGET']     = ['Bending Magnet']                                   # X-ray target material)
+        header['USER']       = ['USER']                                             # Username
+        header['SOURCEK']    = [source_v]                                           # X-ray source kV
+        header['SOURCEM']    = [source_a]                                           # Source milliamps
+        header['WAVELEN'][:] = [source_w, source_w, source_w]                       # Wavelengths (average, a1, a2)
+        header['CUMULAT']    = [scan_exp]                                           # Accumulated exposure time in real hours
+        header['ELAPSDR']    = [scan_exp]                                           # Requested time for this frame in seconds
+        header['ELAPSDA']    = [scan_exp]                                           # Actual time for this frame in seconds
+        header['TYPE']       = ['Generic {} Scan'.format(scan_rax)]                 # String indicating kind of data in the frame
+        header['DISTANC']    = [float(goni_dxt) / 10.0]                             # Sample-detector distance, cm
+        header['RANGE']      = [abs(scan_inc)]                                      # Magnitude of scan range in decimal degrees
+        header['INCREME']    = [scan_inc]                                           # Signed scan angle increment between frames
+        header['NFRAMES']    = [int(scan_num)]                                      # Number of frames in the series
+        header['AXIS'][:]    = [ax_name_to_num[scan_rax]]                           # Scan axis (1=2-theta, 2=omega, 3=phi, 4=chi)
+        header['LOWTEMP'][:] = [1, int((-273.15 + 20.0) * 100.0), -6000]            # Low temp flag; experiment temperature*100; detector temp*100
+        header['NSTEPS']     = [1]                                                  # steps or oscillations in this frame
+        header['NPIXELB'][:] = [1, 1]                                               # bytes/pixel in main image, bytes/pixel in underflow table
+        header['COMPRES']    = ['NONE']                                             # compression scheme if any
+        header['TRAILER']    = [-1]                                                 # byte pointer to trailer info
+        header['LINEAR'][:]  = [1.00, 0.00]                                         # bruker_linearscale, bruker_linearoffset
+        header['PHD'][:]     = [1.00, 0.10]                                         # Phosphor efficiency, phosphor thickness
+        header['PREAMP']     = [1]                                                  # Preamp gain setting
+        header['CORRECT']    = ['INTERNAL']                                         # Flood correction filename
+        header['DARK']       = ['INTERNAL']                                         # Dark current frame name
+        header['WARPFIL']    = ['LINEAR']                                           # Spatial correction filename
+        ox = data.shape[1]
+        oy = data.shape[0]
+        header['OCTMASK'][:] = [0, 0, 0, ox-1, ox-1, ox+oy-1, oy-1, oy-1]           # Octagon mask parameters (GADDS) #min x, min x+y, min y, max x-y, max x, max x+y, max y, max y-x
+        header['DISPLIM'][:] = [0.0, 100.0]                                         # Recommended display contrast window settings
+        header['FILTER2'][:] = [90.0, 0.0, 0.0, 1.0]                                # Monochromator 2-theta, roll (both deg)
+        return header
+    
+    # header with the static entries of this run
+    header = bruker_header_template(('SP8', data.shape, beam_x, beam_y, det_maxv, pix_per_512, source_v, source_a, source_w, scan_exp, scan_rax, goni_dxt, scan_inc, scan_num), static_header)
+    
+    # fill the frame specific header items
     header['FILENAM']    = [basename]
-    header['CUMULAT']    = [scan_exp]                                           # Accumulated exposure time in real hours
-    header['ELAPSDR']    = [scan_exp]                                           # Requested time for this frame in seconds
-    header['ELAPSDA']    = [scan_exp]                                           # Actual time for this frame in seconds
-    header['START'][:]   = scan_sta                                             # Starting scan angle value, decimal deg
-    header['ANGLES'][:]  = axis_start                                           # Diffractometer setting angles, deg. (2Th, omg, phi, chi)
-    header['ENDING'][:]  = axis_end                                             # Setting angles read at end of scan
-    header['TYPE']       = ['Generic {} Scan'.format(scan_rax)]                 # String indicating kind of data in the frame
-    header['DISTANC']    = [float(goni_dxt) / 10.0]                             # Sample-detector distance, cm
-    header['RANGE']      = [abs(scan_inc)]                                      # Magnitude of scan range in decimal degrees
-    header['INCREME']    = [scan_inc]                                           # Signed scan angle increment between frames
-    header['NUMBER']     = [frame_num]                                          # Number of this frame in series (zero-based)
-    header['NFRAMES']    = [int(scan_num)]                                      # Number of frames in the series
-    header['AXIS'][:]    = [ax_name_to_num[scan_rax]]                           # Scan axis (1=2-theta, 2=omega, 3=phi, 4=chi)
-    header['LOWTEMP'][:] = [1, int((-273.15 + 20.0) * 100.0), -6000]            # Low temp flag; experiment temperature*100; detector temp*100
-    header['NEXP'][2]    = baseline_offset
-    header['MAXXY']      = np.array(np.where(data == data.max()), float)[:, 0]
-    header['MAXIMUM']    = [np.max(data)]
-    header['MINIMUM']    = [np.min(data)]
-    header['NCOUNTS'][:] = [data.sum(), 0]
-    header['NOVER64'][:] = [data[data > 64000].shape[0], 0, 0]
-    header['NSTEPS']     = [1]                                                  # steps or oscillations in this frame
-    header['NPIXELB'][:] = [1, 1]                                               # bytes/pixel in main image, bytes/pixel in underflow table
-    header['COMPRES']    = ['NONE']                                             # compression scheme if any
-    header['TRAILER']    = [-1]                                                 # byte pointer to trailer info
-    header['LINEAR'][:]  = [1.00, 0.00]                                         # bruker_linearscale, bruker_linearoffset
-    header['PHD'][:]     = [1.00, 0.10]                                         # Phosphor efficiency, phosphor thickness
-    header['PREAMP']     = [1]                                                  # Preamp gain setting
-    header['CORRECT']    = ['INTERNAL']                                         # Flood correction filename
-    header['DARK']       = ['INTERNAL']                                         # Dark current frame name
-    header['WARPFIL']    = ['LINEAR']                                           # Spatial correction filename
-    ox = data.shape[1]
-    oy = data.shape[0]
-    header['OCTMASK'][:] = [0, 0, 0, ox-1, ox-1, ox+oy-1, oy-1, oy-1]           # Octagon mask parameters (GADDS) #min x, min x+y, min y, max x-y, max x, max x+y, max y, max y-x
-    header['DISPLIM'][:] = [0.0, 100.0]                                         # Recommended display contrast window settings
-    header['FILTER2'][:] = [90.0, 0.0, 0.0, 1.0]                                # Monochromator 2-theta, roll (both deg)
+    header.fill('START', scan_sta)                                          # Starting scan angle value, decimal deg
+    header.fill('ANGLES', axis_start)                                       # Diffractometer setting angles, deg. (2Th, omg, phi, chi)
+    header.fill('ENDING', axis_end)                                         # Setting angles read at end of scan
+    header['NUMBER']     = [frame_num]                                      # Number of this frame in series (zero-based)
+    header.fill('NEXP', baseline_offset, 2)
+    header['MAXXY']      = np.array(stats.maxxy, float)
+    header['MAXIMUM']    = [stats.maximum]
+    header['MINIMUM']    = [stats.minimum]
+    header.fill('NCOUNTS', [stats.counts, 0])
+    header.fill('NOVER64', [stats.nover64, 0, 0])
     header['CREATED']    = [dt.fromtimestamp(os.path.getmtime(fname)).strftime('%Y-%m-%d %H:%M:%S')]# use creation time of raw data!
     
     # write the frame
-    write_bruker_frame(outName, header, data)
+    # - write_bruker_frame or a pipeline writer stage (see convert.py)
+    write(outName, header, data)
     return True
 
-def convert_frame_DLS_Bruker(fname, path_sfrm, rows=1679, cols=1475, offset=0, overwrite=True):
+def convert_frame_DLS_Bruker(fname, path_sfrm, rows=1679, cols=1475, offset=0, overwrite=True, nframes=None, write=write_bruker_frame):
     '''
     
     '''
-    import os, re
+    import os
     import numpy as np
     from datetime import datetime as dt
     
@@ -1038,7 +1501,7 @@ def convert_frame_DLS_Bruker(fname, path_sfrm, rows=1679, cols=1475, offset=0, o
     frame_stem, frame_run, frame_num, _ = get_run_info(basename)
     
     # output file format: some_name_rr_ffff.sfrm
-    outName = os.path.join(path_to, path_sfrm, '{}_{:>02}_{:>04}.sfrm'.format(frame_stem, frame_run, frame_num))
+    outName = os.path.join(path_to, path_sfrm, get_sfrm_name(frame_name))
 
     # check if file exists and overwrite flag
     if os.path.exists(outName) and overwrite == False:
@@ -1047,34 +1510,26 @@ def convert_frame_DLS_Bruker(fname, path_sfrm, rows=1679, cols=1475, offset=0, o
     # read in the frame
     header, data = read_pilatus_cbf(fname)
     
-    # get the frame saint ready 
-    # - multiple of 128x128 pixels
+    # get the frame saint ready in one go
     # - pad with zeros
-    data, offset_rows, offset_cols = pilatus_pad(data)
-    
-    # the dead areas are flagged -1
-    data[data == -1] = 0
-    # bad pixels are flagged -2
-    data[data == -2] = 0
-    
-    # scale the data to avoid underflow tables
-    baseline_offset = -1 * data.min()
-    data += baseline_offset
-    
-    # extract scan info from tif header
-    sca_ext = float(re.search(r'Exposure_time\s+(\d+\.\d+)\s+s', header).groups()[0])
-    sca_exp = float(re.search(r'Exposure_period\s+(\d+\.\d+)\s+s', header).groups()[0])
-    gon_dxt = float(re.search(r'Detector_distance\s+(\d+\.\d+)\s+m', header).groups()[0]) * 1000.0
-    src_wav = float(re.search(r'Wavelength\s+(\d+\.\d+)\s+A', header).groups()[0])
-    sta_phi = float(re.search(r'Phi\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    inc_phi = float(re.search(r'Phi_increment\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    sta_chi = float(re.search(r'Chi\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    inc_chi = float(re.search(r'Chi_increment\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    sta_omg = float(re.search(r'Omega\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    inc_omg = float(re.search(r'Omega_increment\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    sta_tth = float(re.search(r'Detector_2theta\s+(-*\d+\.\d+)\s+deg.', header).groups()[0])
-    pil_x   = float(re.search(r'Beam_xy\s+\((\d+\.\d+),\s+(\d+\.\d+)\)\s+pixels', header).groups()[0])
-    pil_y   = float(re.search(r'Beam_xy\s+\((\d+\.\d+),\s+(\d+\.\d+)\)\s+pixels', header).groups()[1])
+    # - the dead areas (-1) and bad pixels (-2) are set to 0
+    # - scale the data to avoid underflow tables
+    data, offset_rows, offset_cols, baseline_offset, stats = frame_transform(data, rotate=False)
+    
+    # extract scan info from cbf header
+    header = parse_pilatus_header(header)
+    sca_ext = header['Exposure_time']
+    sca_exp = header['Exposure_period']
+    gon_dxt = header['Detector_distance'] * 1000.0
+    src_wav = header['Wavelength']
+    sta_phi = header['Phi']
+    inc_phi = header['Phi_increment']
+    sta_chi = header['Chi']
+    inc_chi = header['Chi_increment']
+    sta_omg = header['Omega']
+    inc_omg = header['Omega_increment']
+    sta_tth = header['Detector_2theta']
+    pil_x, pil_y = header['Beam_xy']
     
     # initial frame dimensions are needed to calculate
     # the beamcenter of the reshaped frame and
@@ -1108,55 +1563,69 @@ def convert_frame_DLS_Bruker(fname, path_sfrm, rows=1679, cols=1475, offset=0, o
     # PILATUS3 pixel size is 0.172 mm 
     pix_per_512 = round((10.0 / 0.172) * (512.0 / cols), 6)
     
-    # default bruker header
-    header = bruker_header()
-    
-    # fill known header items
-    header['NCOLS']      = [data.shape[1]]                           # Number of pixels per row; number of mosaic tiles in X; dZ/dX
-    header['NROWS']      = [data.shape[0]]                           # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
-    header['CENTER'][:]  = [beam_x, beam_y, beam_x, beam_y]          # 
-    header['CCDPARM'][:] = [0.00, 1.00, 1.00, 1.00, 1169523]
-    header['DETPAR'][:]  = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-    header['DETTYPE'][:] = ['PILATUS3-2M', pix_per_512, 0.00, 0, 0.001, 0.0, 0]
-    header['SITE']       = ['DLS/I19-1']                             # Site name
-    header['MODEL']      = ['Synchrotron']                           # Diffractometer model
-    header['TARGET']     = ['Undulator']                             # X-ray target material)
-    header['USER']       = ['?']                                     # Username
-    header['SOURCEK']    = ['?']                                     # X-ray source kV
-    header['SOURCEM']    = ['?']                                     # Source milliamps
-    header['WAVELEN'][:] = [src_wav, src_wav, src_wav]               # Wavelengths (average, a1, a2)
+    # number of frames in the series: {stem: {run: frames}} (see catalog.py)
+    scan_num = '?'
+    if nframes is not None:
+        scan_num = nframes.get(frame_stem, {}).get(frame_run, '?')
+    
+    # the static entries are rendered once per run
+    def static_header():
+        # default bruker header
+        header = bruker_header()
+        
+        # fill known header items
+        header['NCOLS']      = [data.shape[1]]                           # Number of pixels per row; number of mosaic tiles in X; dZ/dX
+        header['NROWS']      = [data.shape[0]]                           # Number of rows in frame; number of mosaic tiles in Y; dZ/dY value
+        header['CENTER'][:]  = [beam_x, beam_y, beam_x, beam_y]          # 
+        header['CCDPARM'][:] = [0.00, 1.00, 1.00, 1.00, 1169523]
+        header['DETPAR'][:]  = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+        header['DETTYPE'][:] = ['PILATUS3-2M', pix_per_512, 0.00, 0, 0.001, 0.0, 0]
+        header['SITE']       = ['DLS/I19-1']                             # Site name
+        header['MODEL']      = ['Synchrotron']                           # Diffractometer model
+        header['TARGET']     = ['Undulator']                             # X-ray target material)
+        header['USER']       = ['?']                                     # Username
+        header['SOURCEK']    = ['?']                                     # X-ray source kV
+        header['SOURCEM']    = ['?']                                     # Source milliamps
+        header['WAVELEN'][:] = [src_wav, src_wav, src_wav]               # Wavelengths (average, a1, a2)
+        header['CUMULAT']    = [sca_exp]                                 # Accumulated exposure time in real hours
+        header['ELAPSDR']    = [sca_ext]                                 # Requested time for this frame in seconds
+        header['ELAPSDA']    = [sca_exp]                                 # Actual time for this frame in seconds
+        header['TYPE']       = ['Generic {} Scan'.format(sca_nam)]       # String indicating kind of data in the frame
+        header['DISTANC']    = [float(gon_dxt) / 10.0]                   # Sample-detector distance, cm
+        header['RANGE']      = [abs(sca_inc)]                            # Magnitude of scan range in decimal degrees
+        header['INCREME']    = [sca_inc]                                 # Signed scan angle increment between frames
+        header['NFRAMES']    = [scan_num]                                # Number of frames in the series
+        header['AXIS'][:]    = [sca_axs]                                 # Scan axis (1=2-theta, 2=omega, 3=phi, 4=chi)
+        header['LOWTEMP'][:] = [1, 0, 0]                                 # Low temp flag; experiment temperature*100; detector temp*100
+        header['NPIXELB'][:] = [1, 1]                                    # bytes/pixel in main image, bytes/pixel in underflow table
+        header['NSTEPS']     = [1]                                       # steps or oscillations in this frame
+        header['COMPRES']    = ['NONE']                                  # compression scheme if any
+        header['TRAILER']    = [0]                                       # byte pointer to trailer info
+        header['LINEAR'][:]  = [1.00, 0.00]     
+        header['PHD'][:]     = [1.00, 0.00]
+        header['OCTMASK'][:] = [0, 0, 0, 1023, 1023, 2046, 1023, 1023]
+        header['DISPLIM'][:] = [0.0, 63.0]                               # Recommended display contrast window settings
+        header['FILTER2'][:] = [90.0, 0.0, 0.0, 1.0]                     # Monochromator 2-theta, roll (both deg)
+        return header
+    
+    # header with the static entries of this run
+    header = bruker_header_template(('DLS', data.shape, beam_x, beam_y, pix_per_512, src_wav, sca_ext, sca_exp, sca_nam, sca_axs, gon_dxt, sca_inc, scan_num), static_header)
+    
+    # fill the frame specific header items
     header['FILENAM']    = [basename]
-    header['CUMULAT']    = [sca_exp]                                 # Accumulated exposure time in real hours
-    header['ELAPSDR']    = [sca_ext]                                 # Requested time for this frame in seconds
-    header['ELAPSDA']    = [sca_exp]                                 # Actual time for this frame in seconds
-    header['START'][:]   = sca_sta                                   # Starting scan angle value, decimal deg
-    header['ANGLES'][:]  = [sta_tth, sta_omg, sta_phi, sta_chi]      # Diffractometer setting angles, deg. (2Th, omg, phi, chi)
-    header['ENDING'][:]  = [end_tth, end_omg, end_phi, end_chi]      # Setting angles read at end of scan
-    header['TYPE']       = ['Generic {} Scan'.format(sca_nam)]       # String indicating kind of data in the frame
-    header['DISTANC']    = [float(gon_dxt) / 10.0]                   # Sample-detector distance, cm
-    header['RANGE']      = [abs(sca_inc)]                            # Magnitude of scan range in decimal degrees
-    header['INCREME']    = [sca_inc]                                 # Signed scan angle increment between frames
-    header['NUMBER']     = [frame_num]                               # Number of this frame in series (zero-based)
-    header['NFRAMES']    = ['?']                                     # Number of frames in the series
-    header['AXIS'][:]    = [sca_axs]                                 # Scan axis (1=2-theta, 2=omega, 3=phi, 4=chi)
-    header['LOWTEMP'][:] = [1, 0, 0]                                 # Low temp flag; experiment temperature*100; detector temp*100
-    header['NEXP'][2]    = baseline_offset
-    header['MAXXY']      = np.array(np.where(data == data.max()), float)[:, 0]
-    header['MAXIMUM']    = [np.max(data)]
-    header['MINIMUM']    = [np.min(data)]
-    header['NCOUNTS'][:] = [data.sum(), 0]
-    header['NPIXELB'][:] = [1, 1]                                    # bytes/pixel in main image, bytes/pixel in underflow table
-    header['NOVER64'][:] = [data[data > 64000].shape[0], 0, 0]
-    header['NSTEPS']     = [1]                                       # steps or oscillations in this frame
-    header['COMPRES']    = ['NONE']                                  # compression scheme if any
-    header['TRAILER']    = [0]                                       # byte pointer to trailer info
-    header['LINEAR'][:]  = [1.00, 0.00]     
-    header['PHD'][:]     = [1.00, 0.00]
-    header['OCTMASK'][:] = [0, 0, 0, 1023, 1023, 2046, 1023, 1023]
-    header['DISPLIM'][:] = [0.0, 63.0]                               # Recommended display contrast window settings
-    header['FILTER2'][:] = [90.0, 0.0, 0.0, 1.0]                     # Monochromator 2-theta, roll (both deg)
+    header.fill('START', sca_sta)                                           # Starting scan angle value, decimal deg
+    header.fill('ANGLES', [sta_tth, sta_omg, sta_phi, sta_chi])             # Diffractometer setting angles, deg. (2Th, omg, phi, chi)
+    header.fill('ENDING', [end_tth, end_omg, end_phi, end_chi])             # Setting angles read at end of scan
+    header['NUMBER']     = [frame_num]                                      # Number of this frame in series (zero-based)
+    header.fill('NEXP', baseline_offset, 2)
+    header['MAXXY']      = np.array(stats.maxxy, float)
+    header['MAXIMUM']    = [stats.maximum]
+    header['MINIMUM']    = [stats.minimum]
+    header.fill('NCOUNTS', [stats.counts, 0])
+    header.fill('NOVER64', [stats.nover64, 0, 0])
     header['CREATED']    = [dt.fromtimestamp(os.path.getmtime(fname)).strftime('%Y-%m-%d %H:%M:%S')]# use creation time of raw data!
     
     # write the frame
-    write_bruker_frame(outName, header, data)
+    # - write_bruker_frame or a pipeline writer stage (see convert.py)
+    write(outName, header, data)
     return True
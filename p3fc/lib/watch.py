@@ -0,0 +1,153 @@
+import os
+import re
+import time
+import fnmatch
+import threading
+from p3fc.lib.formats import FRAME_PATTERNS
+from p3fc.lib.decompress import compression_of
+
+##############################################
+##        Watch a collecting directory      ##
+##############################################
+# cbf binary section: start marker and size
+_CBF_START = b'\x0c\x1a\x04\xd5'
+_CBF_SIZE = re.compile(rb'X-Binary-Size:\s*(\d+)')
+
+def expected_frame_size(fname, info):
+    '''
+     minimum size of a completely written frame
+      - info: frame info (rows, cols, offset, dtype), see formats.py
+      - tif: offset + rows * cols * bytes per pixel
+      - cbf: end of the binary section given in the header
+      - returns None if the size is unknown, e.g. compressed
+        frames or a cbf header that is not yet written
+    '''
+    import numpy as np
+    if info is None or compression_of(fname) is not None:
+        return None
+    if fname.endswith('.cbf'):
+        with open(fname, 'rb') as f:
+            head = f.read(4096)
+        start = head.find(_CBF_START)
+        size = _CBF_SIZE.search(head)
+        if start < 0 or size is None:
+            return None
+        return start + len(_CBF_START) + int(size.group(1))
+    rows, cols, offset, dtype = info
+    return offset + rows * cols * np.dtype(dtype).itemsize
+
+class FrameWatcher(object):
+    '''
+     Watch a directory for frames written during data collection
+      - the directory is polled with a single scandir
+      - a frame is complete if it has (at least) its expected
+        size (see expected_frame_size) and its size and mtime
+        did not change since the last poll
+      - frames of unknown size need to be stable for 'settle' seconds
+      - frames are yielded once, in order of completion
+      - 'known' frames (e.g. already converted) are ignored
+    '''
+    def __init__(self, path, info=None, patterns=FRAME_PATTERNS, known=(), interval=0.2, settle=1.0):
+        self.path = os.path.abspath(path)
+        self.info = info
+        self.patterns = patterns
+        self.interval = interval
+        self.settle = settle
+        self.seen = set(os.path.abspath(f) for f in known)
+        # growing frames: {path: ((size, mtime), stable since)}
+        self._growing = {}
+        self._stop = threading.Event()
+
+    def stop(self):
+        '''
+         stop watching, frames() returns after the current poll
+        '''
+        self._stop.set()
+
+    def stopped(self):
+        return self._stop.is_set()
+
+    def poll(self):
+        '''
+         scan the directory once
+          - returns a sorted list of the newly completed frames
+        '''
+        now = time.monotonic()
+        complete = []
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.path in self.seen or not any(fnmatch.fnmatch(entry.name, p) for p in self.patterns):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    key = (stat.st_size, stat.st_mtime_ns)
+                    last = self._growing.get(entry.path)
+                    if last is None or last[0] != key:
+                        self._growing[entry.path] = (key, now)
+                        continue
+                    try:
+                        expected = expected_frame_size(entry.path, self.info)
+                    except OSError:
+                        continue
+                    if expected is None:
+                        if now - last[1] < self.settle:
+                            continue
+                    elif stat.st_size < expected:
+                        continue
+                    complete.append(entry.path)
+        except FileNotFoundError:
+            pass
+        for fname in complete:
+            self.seen.add(fname)
+            del self._growing[fname]
+        return sorted(complete)
+
+    def wait(self, idle=None):
+        '''
+         poll until new frames are completed
+          - returns a sorted list of the completed frames
+          - returns an empty list after 'idle' seconds
+            without a new frame or if stop() is called
+        '''
+        start = time.monotonic()
+        while not self._stop.is_set():
+            complete = self.poll()
+            if complete:
+                return complete
+            if idle is not None and time.monotonic() - start >= idle:
+                break
+            self._stop.wait(self.interval)
+        return []
+
+    def first(self, idle=None):
+        '''
+         wait for the first complete frame, e.g. to detect the format
+          - without 'info' a frame is complete once it settled,
+            the other frames completed by then are checked again
+            (expected size) once 'info' is set
+          - returns None after 'idle' seconds or if stop() is called
+        '''
+        complete = self.wait(idle)
+        if not complete:
+            return None
+        self.seen.difference_update(complete[1:])
+        return complete[0]
+
+    def frames(self, idle=None):
+        '''
+         yield the completed frames until stop() is called
+          - idle: stop after 'idle' seconds without a new frame,
+            None: watch until stop() is called
+        '''
+        while True:
+            complete = self.wait(idle)
+            if not complete:
+                return
+            for fname in complete:
+                yield fname
+##############################################
+##      END Watch a collecting directory    ##
+##############################################
@@ -0,0 +1,215 @@
+def convert_batch(opts):
+    '''
+     Headless conversion of several datasets
+      - p3fc-convert dir_1 dir_2 ... [-o output_root]
+      - p3fc-convert -R tree: all directories containing frames
+      - the frames of all datasets share one pool of workers,
+        see batch.py
+    '''
+    import os
+    import time
+    import logging
+    from p3fc.lib.batch import find_datasets, ConversionJob, run_batch
+    from p3fc.lib.diskcache import enable_disk_cache, disk_cache_path
+
+    datasets = find_datasets(opts.input, recursive=opts.recursive)
+    if not datasets:
+        logging.error('ERROR: No suitable image files found in {}'.format(', '.join(opts.input)))
+        return 1
+
+    # output: next to the input or mirrored below output_root
+    if opts.output is not None:
+        root = os.path.commonpath(datasets)
+        if len(datasets) == 1:
+            root = os.path.dirname(root)
+    jobs = []
+    for path_input in datasets:
+        if opts.output is None:
+            path_output = path_input + '_sfrm'
+        else:
+            path_output = os.path.join(os.path.abspath(opts.output), os.path.relpath(path_input, root)) + '_sfrm'
+        jobs.append(ConversionJob(path_input, path_output))
+
+    # one cache for all datasets, below the common output directory
+    if opts.cache is not None:
+        path_cache = os.path.commonpath([job.path_output for job in jobs])
+        enable_disk_cache(opts.cache or disk_cache_path(path_cache), opts.cache_size * 2**30)
+
+    for num, job in enumerate(jobs, start=1):
+        job.prepare(overwrite=not opts.skip_existing, resume=opts.resume, verify=opts.verify,
+                    tth_corr=opts.tth_corr, source_w=opts.wavelength)
+        logging.info('[{}/{}] {}: {} frames, {} -> {}'.format(num, len(jobs), job.site or '?', job.total, job.path_input, job.path_output))
+        if job.status == 'failed':
+            logging.error('ERROR: {}: {}'.format(job.path_input, job.message))
+
+    t0 = time.time()
+    total = sum(job.total for job in jobs)
+    number = {job:num for num, job in enumerate(jobs, start=1)}
+    for num, (job, fname, result) in enumerate(run_batch(jobs, workers=opts.jobs, backend=opts.backend, depth=opts.depth), start=1):
+        if job.status == 'done':
+            logging.info('[{}/{}] {}'.format(number[job], len(jobs), job))
+        else:
+            logging.debug('{:>{w}}/{} {}'.format(num, total, os.path.basename(fname), w=len(str(total))))
+
+    logging.info('Summary:')
+    for num, job in enumerate(jobs, start=1):
+        logging.info('[{}/{}] {}'.format(num, len(jobs), job))
+    converted = sum(job.converted for job in jobs)
+    elapsed = time.time() - t0
+    logging.info('Successfully converted {} images of {} datasets in {:.1f} s ({:.1f} frames/s)'.format(converted, len(jobs), elapsed, converted / elapsed if elapsed > 0 else 0.0))
+    return 1 if any(job.status == 'failed' or job.failed for job in jobs) else 0
+
+def main():
+    '''
+     Headless frame conversion, no Qt is imported
+      - p3fc-convert input_dir [-o output_dir]
+      - p3fc-convert input_dir --watch: convert the frames
+        while they are collected (see watch.py)
+      - several input directories or -R: batch conversion
+        (see convert_batch)
+    '''
+    import os
+    import time
+    import itertools
+    import logging
+    import argparse
+    import p3fc
+    from p3fc.lib.formats import list_frames, detect_format
+    from p3fc.lib.convert import get_conversion, convert_frames
+    from p3fc.lib.manifest import Manifest, conversion_options
+    from p3fc.lib.watch import FrameWatcher
+    from p3fc.lib.diskcache import enable_disk_cache, disk_cache_path, DISK_CACHE_NAME, DISK_CACHE_BYTES
+
+    parser = argparse.ArgumentParser(prog='p3fc-convert', description='Convert PILATUS3 frames to the Bruker .sfrm format.')
+    parser.add_argument('input', nargs='+', help='input directory containing the frames, several directories are converted as a batch')
+    parser.add_argument('-o', '--output', default=None, help='output directory, default: input directory + _sfrm, batch: output root directory, the input tree is mirrored')
+    parser.add_argument('-R', '--recursive', action='store_true', help='batch: convert all directories containing frames below the input directories')
+    parser.add_argument('-s', '--skip-existing', action='store_true', help='do not overwrite existing .sfrm files')
+    parser.add_argument('-r', '--resume', action='store_true', help='only convert new or changed frames and frames converted with different options')
+    parser.add_argument('--verify', action='store_true', help='resume: also compare the checksums of the converted frames')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of workers, default: number of cores')
+    parser.add_argument('-b', '--backend', choices=('process', 'thread', 'pipeline'), default='process', help='use a pool of processes, threads or a read/convert/write pipeline of threads, default: process')
+    parser.add_argument('-d', '--depth', type=int, default=None, help='pipeline queue depth in frames, default: 2 * jobs')
+    parser.add_argument('--watch', action='store_true', help='keep watching the input directory and convert new frames once they are written completely (pipeline backend)')
+    parser.add_argument('--idle', type=float, default=None, help='watch: stop after IDLE seconds without a new frame, default: run until interrupted')
+    parser.add_argument('--interval', type=float, default=0.2, help='watch: poll the input directory every INTERVAL seconds, default: 0.2')
+    parser.add_argument('--cache', nargs='?', const='', default=None, metavar='DIR', help='keep the decoded .cbf and compressed .tif frames in a disk cache, repeated conversions read them memory mapped, default DIR: output directory/{}'.format(DISK_CACHE_NAME))
+    parser.add_argument('--cache-size', type=float, default=DISK_CACHE_BYTES / 2**30, metavar='GB', help='cache: size cap in GB, the least recently used frames are removed, default: {:.0f}'.format(DISK_CACHE_BYTES / 2**30))
+    parser.add_argument('-t', '--tth-corr', type=float, default=0.0, help='SPring-8 2-theta correction factor')
+    parser.add_argument('-w', '--wavelength', type=float, default=None, help='SPring-8 wavelength, overrides the .inf information')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print errors')
+    parser.add_argument('-V', '--version', action='version', version='%(prog)s {}'.format(p3fc.__version__))
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR if opts.quiet else logging.INFO, format='%(message)s')
+
+    # several datasets: batch queue
+    if len(opts.input) > 1 or opts.recursive:
+        if opts.watch:
+            logging.error('ERROR: Only a single input directory can be watched!')
+            return 2
+        return convert_batch(opts)
+
+    path_input = os.path.abspath(opts.input[0])
+    if opts.output is None:
+        path_output = path_input + '_sfrm'
+    else:
+        path_output = os.path.abspath(opts.output)
+
+    if not os.path.isdir(path_input):
+        logging.error('ERROR: Input directory {} does not exist!'.format(path_input))
+        return 2
+
+    if opts.cache is not None:
+        enable_disk_cache(opts.cache or disk_cache_path(path_output), opts.cache_size * 2**30)
+
+    frames = list_frames(path_input)
+    listed = list(frames)
+    first = frames[0] if frames else None
+    watcher = None
+    if opts.watch:
+        # the frames already there may still be written,
+        # the watcher checks them like new ones (see below)
+        watcher = FrameWatcher(path_input, interval=opts.interval)
+        # the format is detected from the first complete frame
+        logging.info('Waiting for the first complete frame in {}'.format(path_input))
+        first = watcher.first(idle=opts.idle)
+        if first is not None and first not in listed:
+            frames = sorted(frames + [first])
+    if first is None:
+        logging.error('ERROR: No suitable image files found in {}'.format(path_input))
+        return 1
+
+    fmt = detect_format(first)
+    if fmt is None:
+        logging.error('ERROR: Unknown frame format: {}'.format(os.path.basename(first)))
+        return 1
+
+    # watch: the number of frames per run is unknown
+    setup = get_conversion(fmt, first, path_input, path_output,
+                           overwrite=not opts.skip_existing, tth_corr=opts.tth_corr, source_w=opts.wavelength,
+                           catalog=not opts.watch)
+    if setup is None:
+        logging.error('ERROR: Unknown facility!')
+        return 1
+    conversion, args, kwargs = setup
+
+    # Make directories recursively
+    os.makedirs(path_output, exist_ok=True)
+
+    # the manifest records all converted frames
+    # - resume: skip frames that are up to date
+    manifest = Manifest(path_output)
+    options = conversion_options(conversion, args, kwargs)
+    if opts.resume:
+        todo = manifest.pending(frames, options, verify=opts.verify, overwrite=not opts.skip_existing)
+        kwargs['overwrite'] = True
+        logging.info('{}: {} of {} frames are up to date'.format(fmt['site'], len(frames) - len(todo), len(frames)))
+        frames = todo
+    elif opts.skip_existing:
+        todo = manifest.missing(frames)
+        logging.info('{}: {} of {} frames exist'.format(fmt['site'], len(frames) - len(todo), len(frames)))
+        frames = todo
+
+    logging.info('{}: {} frames, {} -> {}'.format(fmt['site'], len(frames), path_input, path_output))
+    t0 = time.time()
+    saved = t0
+    converted, failed = 0, 0
+    total = len(frames)
+    backend = opts.backend
+    if watcher is not None:
+        # now the frame size is known
+        # frames are fed to the pipeline as they are completed
+        watcher.info = fmt['info']
+        # frames not to convert are ignored, the others are passed
+        # on once complete (see watch.py), waited for ones at once
+        ready = [fname for fname in frames if fname in watcher.seen]
+        watcher.seen.update(set(listed).difference(frames))
+        frames = itertools.chain(ready, watcher.frames(idle=opts.idle))
+        backend = 'pipeline'
+        logging.info('Watching {}, press Ctrl+C to stop'.format(path_input))
+    try:
+        for num, (fname, result) in enumerate(convert_frames(frames, conversion, args, kwargs, workers=opts.jobs, backend=backend, depth=opts.depth), start=1):
+            converted += bool(result)
+            failed += not result
+            if result:
+                manifest.record(fname, options, result)
+                # journal the records, watch: at least every 10 s
+                if manifest.changed >= 100 or (watcher is not None and time.time() - saved > 10.0):
+                    manifest.flush()
+                    saved = time.time()
+            total = max(num, total)
+            logging.info('{:>{w}}/{} {}'.format(num, total, os.path.basename(fname), w=len(str(total))))
+    except KeyboardInterrupt:
+        if watcher is None:
+            raise
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        manifest.save()
+    logging.info('Successfully converted {} images in {:.1f} s'.format(converted, time.time() - t0))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
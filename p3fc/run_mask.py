@@ -0,0 +1,66 @@
+def main():
+    '''
+     Write the masks of all runs, no Qt is imported
+      - p3fc-mask input_dir [-o output_dir]: the patches of
+        every run are read from its .msk file (Save Mask)
+      - p3fc-mask input_dir -t run.msk: a template for the runs
+        without patches, --force: for all runs
+    '''
+    import os
+    import time
+    import logging
+    import argparse
+    import p3fc
+    from p3fc.lib.mask import mask_runs
+
+    parser = argparse.ArgumentParser(prog='p3fc-mask', description='Write the SAINT masks (_xa_ frames) of all runs from the stored patches.')
+    parser.add_argument('input', help='input directory containing the frames')
+    parser.add_argument('-o', '--output', default=None, help='output directory holding the patches (.msk), the masks are written to, default: input directory + _sfrm')
+    parser.add_argument('-t', '--template', default=None, help='patches file (.msk) used for the runs without one, copied to the runs')
+    parser.add_argument('-f', '--force', action='store_true', help='template: use it for all runs, their patches files are overwritten')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of workers, default: number of cores (max. 8)')
+    parser.add_argument('--no-pad', action='store_true', help='do not pad the masks to a multiple of 8 pixels')
+    parser.add_argument('--flip', action='store_true', help='the patches were drawn on the flipped image (Flip Image)')
+    parser.add_argument('--keep-negative', action='store_true', help='do not mask the negative (dead) pixels of the first frame')
+    parser.add_argument('--npy', action='store_true', help='also write the masks as numpy .npy files')
+    parser.add_argument('--no-sfrm', action='store_true', help='do not write the Bruker .sfrm masks')
+    parser.add_argument('-w', '--wavelength', type=float, default=None, help='wavelength of the mask header, default: 1.0')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print errors')
+    parser.add_argument('-V', '--version', action='version', version='%(prog)s {}'.format(p3fc.__version__))
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR if opts.quiet else logging.INFO, format='%(message)s')
+
+    path_input = os.path.abspath(opts.input)
+    if opts.output is None:
+        path_output = path_input + '_sfrm'
+    else:
+        path_output = os.path.abspath(opts.output)
+
+    if not os.path.isdir(path_input):
+        logging.error('ERROR: Input directory {} does not exist!'.format(path_input))
+        return 2
+    if opts.template is not None and not os.path.isfile(opts.template):
+        logging.error('ERROR: Template {} does not exist!'.format(opts.template))
+        return 2
+
+    t0 = time.time()
+    written, failed = 0, 0
+    for stem, run, path_mask, error in mask_runs(path_input, path_output, template=opts.template, force=opts.force, workers=opts.jobs,
+                                                 flip=opts.flip, negative=not opts.keep_negative, pad=not opts.no_pad,
+                                                 wavelength=opts.wavelength, sfrm=not opts.no_sfrm, npy=opts.npy):
+        if error:
+            failed += 1
+            logging.warning('WARNING: Run {} of {} skipped: {}'.format(run, stem, error))
+        else:
+            written += 1
+            logging.info('{}'.format(os.path.basename(path_mask)))
+    if written + failed == 0:
+        logging.error('ERROR: No suitable image files found in {}'.format(path_input))
+        return 1
+    logging.info('Successfully wrote {} masks in {:.1f} s'.format(written, time.time() - t0))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
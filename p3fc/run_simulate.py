@@ -0,0 +1,41 @@
+def main():
+    '''
+     Simulate a data collection, no Qt is imported
+      - p3fc-simulate input_dir output_dir [-r rate]
+      - test the watch mode: p3fc-convert output_dir --watch
+    '''
+    import os
+    import time
+    import logging
+    import argparse
+    import p3fc
+    from p3fc.lib.simulate import simulate_collection
+
+    parser = argparse.ArgumentParser(prog='p3fc-simulate', description='Write the frames of a directory to another directory at a given frame rate.')
+    parser.add_argument('input', help='input directory containing the frames')
+    parser.add_argument('output', help='output directory, the frames are written to')
+    parser.add_argument('-r', '--rate', type=float, default=1.0, help='frames per second, default: 1')
+    parser.add_argument('-c', '--chunks', type=int, default=4, help='every frame is written in that many parts, default: 4')
+    parser.add_argument('-n', '--number', type=int, default=None, help='number of frames to write, default: all')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print errors')
+    parser.add_argument('-V', '--version', action='version', version='%(prog)s {}'.format(p3fc.__version__))
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR if opts.quiet else logging.INFO, format='%(message)s')
+
+    path_input = os.path.abspath(opts.input)
+    if not os.path.isdir(path_input):
+        logging.error('ERROR: Input directory {} does not exist!'.format(path_input))
+        return 2
+    if opts.rate <= 0 or opts.chunks < 1:
+        logging.error('ERROR: The rate and the number of chunks must be positive!')
+        return 2
+
+    t0 = time.time()
+    written = simulate_collection(path_input, os.path.abspath(opts.output), rate=opts.rate, chunks=opts.chunks, number=opts.number)
+    logging.info('Wrote {} frames in {:.1f} s'.format(written, time.time() - t0))
+    return 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
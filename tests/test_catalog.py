@@ -0,0 +1,41 @@
+import os
+from p3fc.lib.catalog import FrameCatalog, frame_name_info
+
+def write_frame(path, name, omega=0.0):
+    fname = os.path.join(path, name)
+    with open(fname, 'wb') as ofile:
+        ofile.write('###CBF: VERSION 1.5\r\n# Omega {:.4f} deg.\r\n# Omega_increment 0.1000 deg.\r\n# Flux 1.5e+06\r\n'.format(omega).encode())
+    return fname
+
+def test_frame_name_info():
+    assert frame_name_info('xtal_01_0001.cbf') == ('xtal', 1, 1)
+    assert frame_name_info('xtal_a_02_0010.tif.gz') == ('xtal_a', 2, 10)
+    assert frame_name_info('xtal_02010.tif') == ('xtal', 2, 10)
+
+def test_runs_and_gaps(tmp_path):
+    path = str(tmp_path)
+    for run, frames in ((1, (1, 2, 3)), (2, (2, 3, 5, 6))):
+        for frame in frames:
+            write_frame(path, 'xtal_{:02}_{:04}.cbf'.format(run, frame), omega=frame * 0.1)
+    with FrameCatalog(path) as catalog:
+        assert catalog.update() == 7
+        # only new or changed frames are scanned
+        assert catalog.update() == 0
+        assert catalog.runs() == [('xtal', 1, os.path.join(path, 'xtal_01_0001.cbf'), 1, 3, 3),
+                                  ('xtal', 2, os.path.join(path, 'xtal_02_0002.cbf'), 2, 6, 4)]
+        assert catalog.gaps('xtal', 1) == []
+        assert catalog.gaps('xtal', 2) == [1, 4]
+        assert catalog.gaps('xtal', 3) == []
+        assert catalog.nframes() == {'xtal':{1:3, 2:6}}
+        header = catalog.header(os.path.join(path, 'xtal_02_0005.cbf'))
+        assert header['omega'] == 0.5
+        assert header['increment'] == 0.1
+        assert header['flux'] == 1.5e6
+        assert header['chi'] is None
+        # a frame is written, another one removed
+        write_frame(path, 'xtal_02_0004.cbf')
+        os.remove(os.path.join(path, 'xtal_01_0003.cbf'))
+        assert catalog.update() == 1
+        assert catalog.gaps('xtal', 2) == [1]
+        assert catalog.nframes() == {'xtal':{1:2, 2:6}}
+        assert catalog.frames('xtal', 1) == [os.path.join(path, 'xtal_01_0001.cbf'), os.path.join(path, 'xtal_01_0002.cbf')]
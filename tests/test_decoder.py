@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from p3fc.lib.utility import decByteOffset_np
+
+def encode_byte_offset(values):
+    '''
+     CBF byte-offset compression of 'values'
+      - deltas of 1 byte, escaped (0x80) ones of 2, 4 or 8 bytes
+    '''
+    stream = bytearray()
+    last = 0
+    for value in values:
+        delta = int(value) - last
+        last = int(value)
+        if -127 <= delta <= 127:
+            stream += delta.to_bytes(1, 'little', signed=True)
+        elif -32767 <= delta <= 32767:
+            stream += b'\x80' + delta.to_bytes(2, 'little', signed=True)
+        elif -2**31 + 1 <= delta <= 2**31 - 1:
+            stream += b'\x80\x00\x80' + delta.to_bytes(4, 'little', signed=True)
+        else:
+            stream += b'\x80\x00\x80\x00\x00\x00\x80' + delta.to_bytes(8, 'little', signed=True)
+    return bytes(stream)
+
+def decode_byte_offset(stream):
+    '''
+     reference decoder, one delta at a time
+    '''
+    values = []
+    pos, last = 0, 0
+    while pos < len(stream):
+        if stream[pos] != 0x80:
+            delta = int.from_bytes(stream[pos:pos+1], 'little', signed=True)
+            pos += 1
+        elif stream[pos+1:pos+3] != b'\x00\x80':
+            delta = int.from_bytes(stream[pos+1:pos+3], 'little', signed=True)
+            pos += 3
+        elif stream[pos+3:pos+7] != b'\x00\x00\x00\x80':
+            delta = int.from_bytes(stream[pos+3:pos+7], 'little', signed=True)
+            pos += 7
+        else:
+            delta = int.from_bytes(stream[pos+7:pos+15], 'little', signed=True)
+            pos += 15
+        last += delta
+        values.append(last)
+    return values
+
+def test_small_deltas():
+    values = np.cumsum([0, 1, 5, -3, 127, -127, -100])
+    stream = encode_byte_offset(values)
+    assert b'\x80' not in stream
+    assert decByteOffset_np(stream).tolist() == values.tolist()
+
+@pytest.mark.parametrize('scale', [100, 30000, 2**20, 2**40])
+def test_random_frames(scale):
+    # counts in the range of the exceptions, 0x80 bytes within the values
+    rng = np.random.default_rng(scale)
+    values = rng.integers(-scale, scale, size=5000)
+    values[rng.integers(0, values.size, size=200)] = 0
+    stream = encode_byte_offset(values)
+    assert decode_byte_offset(stream) == values.tolist()
+    assert decByteOffset_np(stream).tolist() == values.tolist()
+
+def test_marker_bytes_in_values():
+    # deltas whose bytes are (or look like) escape markers
+    deltas = [-128, 128, 0x80, 0x8080, -0x8000, 0x800080, 0x80008000, -2**31, 2**31, 0x8000000080, -2**63 + 1, 1, -1]
+    values = np.cumsum(deltas).tolist()
+    stream = encode_byte_offset(values)
+    assert decode_byte_offset(stream) == values
+    assert decByteOffset_np(stream).tolist() == values
+
+def test_dtype():
+    values = [0, 200, -70000, 3]
+    data = decByteOffset_np(encode_byte_offset(values), dtype='int32')
+    assert data.dtype == np.int32
+    assert data.tolist() == values
@@ -0,0 +1,96 @@
+import os
+import json
+import pytest
+from p3fc.lib.utility import get_sfrm_name
+from p3fc.lib.manifest import Manifest, MANIFEST_JOURNAL, conversion_options, frame_options, frame_output
+
+def convert(fname, path_output, content=b'frame'):
+    '''
+     stand-in for a conversion: writes the output of a frame
+    '''
+    chunks = [content, os.path.basename(fname).encode()]
+    with open(os.path.join(path_output, get_sfrm_name(fname)), 'wb') as ofile:
+        ofile.writelines(chunks)
+    return frame_output(chunks)
+
+def dummy(*args, **kwargs):
+    pass
+
+@pytest.fixture
+def dataset(tmp_path):
+    path_input = tmp_path / 'input'
+    path_output = tmp_path / 'output'
+    path_input.mkdir()
+    path_output.mkdir()
+    frames = []
+    for run in (1, 2):
+        for frame in range(1, 4):
+            fname = path_input / 'xtal_{:02}_{:04}.cbf'.format(run, frame)
+            fname.write_bytes(os.urandom(64))
+            frames.append(str(fname))
+    return frames, str(path_output)
+
+def convert_pending(manifest, frames, options, **kwargs):
+    todo = manifest.pending(frames, options, **kwargs)
+    for fname in todo:
+        manifest.record(fname, options, convert(fname, manifest.path_output))
+    manifest.save()
+    return todo
+
+def test_resume(dataset):
+    frames, path_output = dataset
+    options = conversion_options(dummy, (), {'tth_corr':0.0})
+    assert convert_pending(Manifest(path_output), frames, options) == frames
+    # nothing to do
+    manifest = Manifest(path_output)
+    assert manifest.pending(frames, options, verify=True) == []
+    # changed source, removed and corrupted output
+    os.utime(frames[0], ns=(0, 0))
+    os.remove(os.path.join(path_output, get_sfrm_name(frames[1])))
+    with open(os.path.join(path_output, get_sfrm_name(frames[2])), 'r+b') as ofile:
+        ofile.write(b'x')
+    assert manifest.pending(frames, options) == frames[:2]
+    assert manifest.pending(frames, options, verify=True) == frames[:3]
+    # different settings
+    assert manifest.pending(frames, conversion_options(dummy, (), {'tth_corr':0.1})) == frames
+    assert manifest.pending(frames, conversion_options(dummy, (), {'tth_corr':0.0, 'overwrite':False})) == frames[:2]
+
+def test_not_recorded(dataset):
+    # outputs of frames converted before, without manifest
+    frames, path_output = dataset
+    for fname in frames[:2]:
+        convert(fname, path_output)
+    manifest = Manifest(path_output)
+    options = conversion_options(dummy, (), {})
+    assert manifest.pending(frames, options) == frames
+    assert manifest.pending(frames, options, overwrite=False) == frames[2:]
+    assert manifest.missing(frames) == frames[2:]
+
+def test_run_tables(dataset):
+    # a frame added to run 2 converts run 2 again, not run 1
+    frames, path_output = dataset
+    nframes = {'xtal':{1:3, 2:3}}
+    options = conversion_options(dummy, (), {'nframes':nframes})
+    convert_pending(Manifest(path_output), frames, options)
+    added = conversion_options(dummy, (), {'nframes':{'xtal':{1:3, 2:4}}})
+    assert options.fingerprint == added.fingerprint
+    assert frame_options(options, frames[0]) == frame_options(added, frames[0])
+    assert Manifest(path_output).pending(frames, added) == frames[3:]
+
+def test_journal(dataset):
+    frames, path_output = dataset
+    options = conversion_options(dummy, (), {})
+    manifest = Manifest(path_output)
+    for fname in frames[:4]:
+        manifest.record(fname, options, convert(fname, path_output))
+    manifest.flush()
+    assert not os.path.exists(manifest.path)
+    # interrupted: the journal is replayed, a torn last record is skipped
+    with open(manifest.journal, 'a') as ofile:
+        ofile.write(json.dumps([frames[4], {}])[:-5])
+    resumed = Manifest(path_output)
+    assert resumed.pending(frames, options) == frames[4:]
+    # save compacts the journal into the manifest
+    convert_pending(resumed, frames, options)
+    assert not os.path.exists(os.path.join(path_output, MANIFEST_JOURNAL))
+    assert Manifest(path_output).pending(frames, options, verify=True) == []
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from p3fc.lib.mask import rasterize_patch, rasterize_patches, patch_bounds, MaskRaster
+
+def covered(shape, name, pos, size, angle):
+    '''
+     reference: pixels whose center is within the patch,
+     tested for every pixel in the patch coordinates
+    '''
+    rows, cols = np.indices(shape)
+    dx = cols + 0.5 - pos[0]
+    dy = rows + 0.5 - pos[1]
+    a = np.deg2rad(angle)
+    u = dx * np.cos(a) + dy * np.sin(a)
+    v = dy * np.cos(a) - dx * np.sin(a)
+    w, h = size
+    if name == 'rect':
+        return (u >= min(0, w)) & (u <= max(0, w)) & (v >= min(0, h)) & (v <= max(0, h))
+    return ((u - w / 2) / (w / 2))**2 + ((v - h / 2) / (h / 2))**2 <= 1.0
+
+def random_patch(rng, shape):
+    name = str(rng.choice(['rect', 'circ']))
+    pos = tuple(rng.uniform(-10, max(shape) + 10, size=2))
+    size = tuple(rng.uniform(-40, 40, size=2))
+    return name, pos, size, float(rng.uniform(-180, 180))
+
+@pytest.mark.parametrize('seed', range(20))
+def test_rasterize_patch(seed):
+    rng = np.random.default_rng(seed)
+    shape = (60, 80)
+    for _ in range(10):
+        name, pos, size, angle = random_patch(rng, shape)
+        mask = np.ones(shape, dtype=bool)
+        rasterize_patch(mask, name, pos, size, angle, False)
+        assert np.array_equal(~mask, covered(shape, name, pos, size, angle))
+
+def test_rasterize_patches_order():
+    # later patches are drawn over earlier ones
+    shape = (20, 20)
+    patches = [('rect', (2.0, 2.0), (10.0, 10.0), 0.0, 0),
+               ('circ', (4.0, 4.0), (6.0, 6.0), 0.0, 1)]
+    mask = rasterize_patches(shape, patches)
+    expected = ~covered(shape, *patches[0][:4]) | covered(shape, *patches[1][:4])
+    assert np.array_equal(mask, expected)
+
+def test_patch_bounds():
+    shape = (50, 50)
+    assert patch_bounds(shape, 'rect', (10.0, 20.0), (5.0, 3.0)) == (20, 23, 10, 15)
+    assert patch_bounds(shape, 'rect', (100.0, 100.0), (5.0, 3.0)) is None
+    assert patch_bounds(shape, 'circ', (10.0, 10.0), (0.0, 3.0)) is None
+    rows, cols = np.nonzero(covered(shape, 'circ', (7.3, 9.1), (20.5, 11.2), 33.0))
+    assert patch_bounds(shape, 'circ', (7.3, 9.1), (20.5, 11.2), 33.0) == (rows.min(), rows.max() + 1, cols.min(), cols.max() + 1)
+
+def test_unknown_shape():
+    with pytest.raises(ValueError):
+        rasterize_patch(np.ones((5, 5), dtype=bool), 'poly', (0, 0), (1, 1), 0.0, False)
+
+@pytest.mark.parametrize('seed', range(10))
+def test_mask_raster_update(seed):
+    # incremental updates equal a full redraw
+    rng = np.random.default_rng(seed)
+    shape = (60, 80)
+    raster = MaskRaster(shape)
+    patches = []
+    for _ in range(30):
+        action = rng.integers(3) if patches else 0
+        if action == 0:
+            patches.insert(int(rng.integers(len(patches) + 1)), (*random_patch(rng, shape), int(rng.integers(2))))
+        elif action == 1:
+            del patches[int(rng.integers(len(patches)))]
+        else:
+            # drag a patch
+            idx = int(rng.integers(len(patches)))
+            name, pos, size, angle, value = patches[idx]
+            patches[idx] = (name, (pos[0] + rng.uniform(-5, 5), pos[1] + rng.uniform(-5, 5)), size, angle, value)
+        raster.update(patches)
+        assert np.array_equal(raster.mask, rasterize_patches(shape, patches))
+
+def test_mask_raster_unchanged():
+    raster = MaskRaster((20, 20))
+    patches = [('rect', (2.0, 2.0), (5.0, 5.0), 0.0, 0)]
+    assert raster.update(patches) == [(2, 7, 2, 7)]
+    assert raster.update(list(patches)) == []
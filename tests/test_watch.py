@@ -0,0 +1,64 @@
+import os
+import time
+from p3fc.lib.watch import FrameWatcher, expected_frame_size
+
+# 4 x 4 int32 pixels after an 8 byte header
+INFO = (4, 4, 8, 'int32')
+
+def write(path, name, size):
+    fname = os.path.join(path, name)
+    with open(fname, 'ab') as ofile:
+        ofile.write(b'\x01' * (size - os.path.getsize(fname) if os.path.exists(fname) else size))
+    return fname
+
+def test_expected_frame_size(tmp_path):
+    assert expected_frame_size(str(tmp_path / 'x_01_0001.tif'), INFO) == 72
+    assert expected_frame_size(str(tmp_path / 'x_01_0001.tif.gz'), INFO) is None
+    assert expected_frame_size(str(tmp_path / 'x_01_0001.tif'), None) is None
+    fname = tmp_path / 'x_01_0001.cbf'
+    fname.write_bytes(b'X-Binary-Size: 100\r\n\r\n\x0c\x1a\x04\xd5')
+    assert expected_frame_size(str(fname), INFO) == 22 + 4 + 100
+
+def test_complete(tmp_path):
+    path = str(tmp_path)
+    watcher = FrameWatcher(path, info=INFO, known=[os.path.join(path, 'x_01_0001.tif')])
+    write(path, 'x_01_0001.tif', 72)
+    write(path, 'notes.txt', 72)
+    fname = write(path, 'x_01_0002.tif', 40)
+    # stable, but too small
+    assert watcher.poll() == []
+    assert watcher.poll() == []
+    write(path, 'x_01_0002.tif', 72)
+    # growing, then complete, reported once
+    assert watcher.poll() == []
+    assert watcher.poll() == [fname]
+    assert watcher.poll() == []
+
+def test_settle(tmp_path):
+    # frames of unknown size need to be stable for 'settle' seconds
+    path = str(tmp_path)
+    watcher = FrameWatcher(path, settle=0.2)
+    fname = write(path, 'x_01_0001.tif.gz', 10)
+    assert watcher.poll() == []
+    assert watcher.poll() == []
+    time.sleep(0.25)
+    assert watcher.poll() == [fname]
+
+def test_first(tmp_path):
+    # the first frame is found before the size is known,
+    # the others are checked again once it is
+    path = str(tmp_path)
+    watcher = FrameWatcher(path, interval=0.01, settle=0.0)
+    first = write(path, 'x_01_0001.tif', 72)
+    second = write(path, 'x_01_0002.tif', 40)
+    assert watcher.first(idle=1.0) == first
+    watcher.info = INFO
+    assert watcher.poll() == []
+    write(path, 'x_01_0002.tif', 72)
+    assert list(watcher.frames(idle=0.2)) == [second]
+
+def test_idle(tmp_path):
+    watcher = FrameWatcher(str(tmp_path), interval=0.01)
+    assert watcher.first(idle=0.05) is None
+    watcher.stop()
+    assert list(watcher.frames()) == []